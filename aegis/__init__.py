@@ -0,0 +1 @@
+"""Shared core logic for the Aegis Health web app and alert worker."""
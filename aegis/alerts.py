@@ -0,0 +1,198 @@
+"""Alert preparation and sending shared by the web app and the headless worker."""
+import time
+from datetime import datetime
+
+from aegis.dispatch import RISK_LEVELS, dispatcher_from_env, format_report, risk_level
+from aegis.forecast import describe_outlook
+from aegis.ledger import delivery_ledger, outcome
+from aegis.sms import BULK_MAX_RECIPIENTS, DEMO_SMS, bulk_configured, send_bulk_sms, send_sms, twilio_configured
+from aegis.tracing import CycleTrace
+from aegis.weather import fetch_weather_for_cities
+
+# Per-risk-level delivery latency of the most recent alert cycle in this process
+last_dispatch_report = None
+
+
+def build_health_alert_message(city, weather_data, disease, risk, precautions, outlook=None, observed_at=None):
+    """Build SMS alert message based on current weather/climate data - exact format for Twilio.
+
+    outlook is a forecast line (e.g. an upcoming High risk) added after the current risk.
+    observed_at is when the conditions were computed (epoch seconds, e.g. a risk
+    view row's computed_at); default now.
+    """
+    if weather_data.get('stale'):
+        conditions = f"last known conditions at {weather_data['observed_at']} (weather service unavailable)"
+    else:
+        when = datetime.fromtimestamp(observed_at) if observed_at is not None else datetime.now()
+        conditions = f"current conditions at {when.strftime('%d/%m/%Y %H:%M')}"
+    outlook = f"OUTLOOK:\n{outlook}\n\n" if outlook else ""
+    return (
+        f"HEALTH ALERT - {city}\n"
+        f"==================\n\n"
+        f"Based on {conditions}\n\n"
+        f"CLIMATE DATA:\n"
+        f"Temperature: {weather_data['Temperature']} C\n"
+        f"Humidity: {weather_data['Humidity']}%\n"
+        f"AQI: {weather_data['AQI']}\n"
+        f"Rainfall: {weather_data['Rainfall']} mm\n"
+        f"Wind Speed: {weather_data['WindSpeed']} m/s\n"
+        f"Pressure: {weather_data['Pressure']} hPa\n\n"
+        f"HEALTH RISK:\n"
+        f"Disease Risk: {disease}\n"
+        f"Risk Level: {risk}\n\n"
+        f"{outlook}"
+        f"PRECAUTIONS:\n"
+        f"1. {precautions[0]}\n"
+        f"2. {precautions[1]}\n"
+        f"3. {precautions[2]}\n\n"
+        f"Stay safe! - Aegis Health"
+    )
+
+
+def prepare_alerts(users, model, on_failed=None, cancelled=None, trace=None, fetch_weather=fetch_weather_for_cities,
+                   risk_view=None, timelines=None):
+    """Weather, prediction and message for each user, as dispatch jobs.
+
+    users: dicts with 'phone', 'city' and optionally 'due_at' (scheduled slot).
+    Cities with a fresh row in risk_view (a RiskView) take weather and
+    prediction from it; the rest come from one batched fetch_weather(cities)
+    call (the simulator passes a replayed one) and the model. on_failed(phone,
+    city) is called for users that can't be alerted; cancelled() stops early.
+    Stage timings go to trace (a CycleTrace) if given. With timelines (a
+    RiskTimelines), users whose current risk isn't High are warned of a High
+    risk forecast in the next ADVANCE_ALERT_HOURS.
+    """
+    trace = trace or CycleTrace('prepare')
+    cities = list(dict.fromkeys(user['city'] for user in users))
+    rows = {}
+    if risk_view is not None:
+        with trace.span('risk_view'):
+            for city in cities:
+                row = risk_view.get(city)
+                if row is not None:
+                    rows[city] = row
+    missing = [city for city in cities if city not in rows]
+    weather_by_city = {}
+    if missing:
+        with trace.span('weather'):
+            weather_by_city = fetch_weather(missing)
+    now = time.time()
+    jobs = []
+    outlooks = {}
+    for user in users:
+        if cancelled is not None and cancelled():
+            break
+        phone, city = user['phone'], user['city']
+        row = rows.get(city)
+        if row is not None:
+            weather_data, disease, risk, precautions = row['weather'], row['disease'], row['risk'], row['precautions']
+            observed_at = row['computed_at']
+        else:
+            observed_at = None
+            weather_data = weather_by_city.get(city)
+            if not weather_data:
+                print(f"[Alerts] Could not fetch weather for {city}")
+                if on_failed:
+                    on_failed(phone, city)
+                continue
+            try:
+                with trace.span('predict', city, phone):
+                    disease, risk, precautions = model.predict(weather_data)
+            except Exception as e:
+                print(f"[Alerts] Error predicting for {phone}: {str(e)}")
+                disease = None
+            if disease is None:
+                print(f"[Alerts] Prediction failed for {city}")
+                if on_failed:
+                    on_failed(phone, city)
+                continue
+        outlook = None
+        if timelines is not None and risk_level(risk) != RISK_LEVELS[0]:
+            if city not in outlooks:
+                with trace.span('forecast', city):
+                    step = timelines.outlook(city)
+                    outlooks[city] = describe_outlook(step) if step else None
+            outlook = outlooks[city]
+        with trace.span('message', city, phone):
+            message = build_health_alert_message(city, weather_data, disease, risk, precautions, outlook, observed_at)
+        jobs.append({'phone': phone, 'city': city, 'risk': risk, 'disease': disease, 'message': message,
+                     'overdue': now - user.get('due_at', now)})
+    return jobs
+
+
+def record_delivery(job, result, source):
+    """Append one send outcome to the delivery ledger (queued, written in the background)."""
+    status, error_code, sid = outcome(result)
+    delivery_ledger().record(job['phone'], job.get('city'), job.get('disease'), job.get('risk'), status,
+                             error_code, sid, source)
+
+
+def dispatch_alerts(jobs, progress=None, cancelled=None, source='schedule', trace=None, claim=None):
+    """Send prepared alert jobs highest risk first and log per-level p50/p99 delivery latency.
+
+    With a Notify service configured, users sharing a city message get one bulk call.
+    Every outcome goes to the delivery ledger, tagged with source. Each send call
+    is timed into trace if given. claim is passed on to Dispatcher.dispatch.
+    """
+    global last_dispatch_report
+    trace = trace or CycleTrace(source)
+    cities = {job['phone']: job['city'] for job in jobs}
+
+    def timed_send(phone, message):
+        with trace.span('send', cities.get(phone), phone):
+            return send_sms(phone, message)
+
+    def timed_send_bulk(phones, message):
+        with trace.span('send', cities.get(phones[0]) if phones else None):
+            return send_bulk_sms(phones, message)
+
+    def on_sent(job, delivered):
+        record_delivery(job, job.get('result'), source)
+        if progress is not None:
+            progress(job, delivered)
+
+    dispatcher = dispatcher_from_env(timed_send, send_bulk=timed_send_bulk if bulk_configured() else None,
+                                     bulk_max=BULK_MAX_RECIPIENTS)
+    report = dispatcher.dispatch(jobs, progress=on_sent, cancelled=cancelled, claim=claim)
+    report['finished_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    last_dispatch_report = report
+    print(f"[Dispatch] {format_report(report)}")
+    return report
+
+
+def send_due_alerts(due_users, model, risk_view=None, timelines=None, claim=None, progress=None):
+    """Send alerts to one batch of users whose scheduled slot has come up.
+
+    Cities in risk_view (if given) skip the weather fetch and prediction, and
+    timelines (if given) add a forecast outlook. claim (see Dispatcher.dispatch)
+    can drop jobs just before they are sent; progress(job, delivered) follows
+    each send. Returns the phones that were
+    handled (sent or failed, not dropped), which the scheduler records so they
+    are not caught up again after a restart.
+    """
+    if not model.ensure_loaded():
+        print("[Background Alert] Model not loaded, skipping...")
+        return []
+
+    if DEMO_SMS:
+        print("[Background Alert] DEMO_SMS is enabled, skipping real alerts...")
+        return []
+
+    if not twilio_configured():
+        print("[Background Alert] Twilio credentials not set, skipping...")
+        return []
+
+    print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Alert batch: {len(due_users)} users due")
+    failed = []
+    # Users were loaded and validated at the scheduler's last resync, so the batch starts at the weather fetch
+    trace = CycleTrace('schedule')
+    jobs = prepare_alerts(due_users, model, on_failed=lambda phone, city: failed.append(phone), trace=trace,
+                          risk_view=risk_view, timelines=timelines)
+    # High-risk alerts go out first
+    report = dispatch_alerts(jobs, trace=trace, claim=claim, progress=progress)
+    print(f"[Background Alert] Batch completed: {report['sent']} successful, {report['submitted']} submitted in bulk, "
+          f"{report['failed'] + len(failed)} failed")
+    trace.finish(users=len(due_users), sent=report['sent'], submitted=report['submitted'],
+                 failed=report['failed'] + len(failed))
+    dropped = {job['phone'] for job in jobs if job.get('dropped')}
+    return [user['phone'] for user in due_users if user['phone'] not in dropped]
@@ -0,0 +1,139 @@
+"""Build-time static asset pipeline: content-hashed, precompressed copies of static/.
+
+    python -m aegis.assets            # run once per deploy (render.yaml buildCommand)
+
+Every file in static/ is copied to static/dist/ as <name>.<hash>.<ext>, next
+to a .gz (and, with the optional brotli package installed, a .br) variant, and
+listed in static/dist/manifest.json. Templates link assets with
+asset_url('style.css'); the /assets/ route serves the precompressed variant the
+browser accepts with an immutable, year-long Cache-Control. Changed content
+gets a new name, so browsers never revalidate and gunicorn never compresses.
+
+Without a build (local development) asset_url falls back to the plain
+/static/ URL.
+"""
+import gzip
+import hashlib
+import json
+import os
+
+STATIC_DIR = 'static'
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_FILE = 'manifest.json'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Smaller files aren't worth a compressed variant
+MIN_COMPRESS_BYTES = 256
+# (Accept-Encoding token, file suffix), best first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def hashed_name(name, content):
+    """'style.css' -> 'style.<first 12 hex of sha256>.css'"""
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(content).hexdigest()[:12]}{ext}"
+
+
+def build(static_dir=STATIC_DIR, dist_dir=DIST_DIR):
+    """Write hashed and compressed copies of every static file and the manifest. Returns the manifest."""
+    os.makedirs(dist_dir, exist_ok=True)
+    brotli = _brotli()
+    if brotli is None:
+        print("[Assets] brotli not installed, writing gzip variants only (pip install brotli)")
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != dist_dir]
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, static_dir).replace(os.sep, '/')
+            with open(path, 'rb') as file:
+                content = file.read()
+            target = hashed_name(name, content)
+            manifest[name] = target
+            variants = {target: content}
+            if len(content) >= MIN_COMPRESS_BYTES:
+                # mtime=0 keeps the .gz bytes identical across builds
+                variants[target + '.gz'] = gzip.compress(content, compresslevel=9, mtime=0)
+                if brotli is not None:
+                    variants[target + '.br'] = brotli.compress(content, quality=11)
+            for variant, data in variants.items():
+                out_path = os.path.join(dist_dir, variant)
+                os.makedirs(os.path.dirname(out_path), exist_ok=True)
+                with open(out_path, 'wb') as file:
+                    file.write(data)
+            sizes = ', '.join(f"{variant[len(target):] or 'raw'} {len(data)}"
+                              for variant, data in variants.items())
+            print(f"[Assets] {name} -> {target} ({sizes} bytes)")
+    _prune(dist_dir, manifest)
+    tmp_path = os.path.join(dist_dir, MANIFEST_FILE + '.tmp')
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(tmp_path, os.path.join(dist_dir, MANIFEST_FILE))
+    return manifest
+
+
+def _prune(dist_dir, manifest):
+    """Drop hashed files from older builds."""
+    keep = {MANIFEST_FILE}
+    for target in manifest.values():
+        keep.update({target, target + '.gz', target + '.br'})
+    for root, _, files in os.walk(dist_dir):
+        for filename in files:
+            name = os.path.relpath(os.path.join(root, filename), dist_dir).replace(os.sep, '/')
+            if name not in keep:
+                os.remove(os.path.join(root, filename))
+
+
+class AssetManifest:
+    """Logical name -> hashed name, read once from the manifest the build wrote."""
+
+    def __init__(self, dist_dir=DIST_DIR):
+        self.dist_dir = dist_dir
+        self._entries = None
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            try:
+                with open(os.path.join(self.dist_dir, MANIFEST_FILE)) as file:
+                    self._entries = json.load(file)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def lookup(self, name):
+        """Hashed file name for a static file, or None if it wasn't built."""
+        return self.entries.get(name)
+
+    def served(self, filename):
+        """Whether filename is one of the current build's hashed files."""
+        return filename in self.entries.values()
+
+    def variant(self, filename, accept_encoding):
+        """(file to send, Content-Encoding or None) for the best variant the client accepts."""
+        accepted = set()
+        for token in (accept_encoding or '').split(','):
+            name, _, params = token.partition(';')
+            if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                accepted.add(name.strip().lower())
+        for encoding, suffix in ENCODINGS:
+            if encoding in accepted and os.path.exists(os.path.join(self.dist_dir, filename + suffix)):
+                return filename + suffix, encoding
+        return filename, None
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Build hashed, precompressed static assets')
+    parser.add_argument('--static', default=STATIC_DIR)
+    parser.add_argument('--dist', default=None, help='output directory (default <static>/dist)')
+    args = parser.parse_args()
+    built = build(args.static, args.dist or os.path.join(args.static, 'dist'))
+    print(f"[Assets] {len(built)} files in the manifest")
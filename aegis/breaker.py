@@ -0,0 +1,92 @@
+"""Failure-rate circuit breaker (closed / open / half-open)."""
+import threading
+import time
+from collections import deque
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Opens when the failure rate over the last `window` calls reaches the threshold.
+
+    While open, allow() returns False until `open_seconds` have passed; then up to
+    `half_open_calls` probe calls are let through. A successful probe closes the
+    breaker, a failed one re-opens it.
+    """
+
+    def __init__(self, failure_threshold=0.5, window=20, min_calls=5, open_seconds=30, half_open_calls=1,
+                 clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.window = window
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self._clock = clock
+        self._results = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+        self.times_opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self):
+        if self._state == OPEN and self._clock() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probes = 0
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = self._clock()
+        self._results.clear()
+        self.times_opened += 1
+
+    def allow(self):
+        """True if a call may go upstream now."""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes < self.half_open_calls:
+                self._probes += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._state = CLOSED
+                self._results.clear()
+            self._results.append(True)
+
+    def record_failure(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._open()
+                return
+            self._results.append(False)
+            failures = self._results.count(False)
+            if (len(self._results) >= self.min_calls
+                    and failures / len(self._results) >= self.failure_threshold):
+                self._open()
+
+    def stats(self):
+        with self._lock:
+            self._maybe_half_open()
+            calls = len(self._results)
+            return {
+                'state': self._state,
+                'recent_calls': calls,
+                'recent_failure_rate': round(self._results.count(False) / calls, 3) if calls else 0.0,
+                'times_opened': self.times_opened,
+                'rejected': self.rejected,
+            }
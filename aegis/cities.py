@@ -0,0 +1,104 @@
+"""City canonicalization: one key per city for weather, prediction and alert grouping.
+
+Names are normalized (Unicode NFKC, accents, case, whitespace, punctuation)
+and mapped through known aliases ("Poona" -> "Pune"). Real renames are only
+ever mapped through the alias table. Beyond that, only an unambiguous typo of
+a known city is corrected: one letter added, dropped or swapped with its
+neighbour ("Chenai", "Mumbaii", "Jaiupr"). Substituting one letter for another
+is never corrected, because that is exactly how different real cities differ
+(Raipur/Jaipur, Nagaur/Nagpur, Mangalore/Bangalore). Unknown cities are kept as
+typed, in normalized title case.
+"""
+import csv
+import re
+import threading
+import unicodedata
+from functools import lru_cache
+
+DATASET_FILE = 'climate_health_precaution_dataset_500.csv'
+TYPO_MIN_LENGTH = 5  # shorter names are too easy to confuse
+
+# Historic names and common spellings -> canonical name
+CITY_ALIASES = {
+    'poona': 'Pune',
+    'bombay': 'Mumbai',
+    'bengaluru': 'Bangalore',
+    'bangaluru': 'Bangalore',
+    'calcutta': 'Kolkata',
+    'madras': 'Chennai',
+    'new delhi': 'Delhi',
+    'nagpur city': 'Nagpur',
+    'amdavad': 'Ahmedabad',
+    'hyderabad deccan': 'Hyderabad',
+    'secunderabad': 'Hyderabad',
+    'pink city': 'Jaipur',
+    'mangaluru': 'Mangalore',
+}
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def normalize_city_text(name):
+    """Lower-case, accent-free, single-spaced form of a city name."""
+    text = unicodedata.normalize('NFKC', str(name))
+    text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    text = text.casefold()
+    text = re.sub(r"[^\w\s-]", ' ', text)
+    text = re.sub(r'[\s_-]+', ' ', text)
+    return text.strip()
+
+
+def _load_index():
+    """normalized name -> canonical name, seeded from the dataset and the alias table."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            index = {}
+            try:
+                with open(DATASET_FILE, newline='', encoding='utf-8') as file:
+                    for row in csv.DictReader(file):
+                        name = (row.get('City') or '').strip()
+                        if name:
+                            index.setdefault(normalize_city_text(name), name)
+            except OSError:
+                pass
+            for alias, canonical in CITY_ALIASES.items():
+                index.setdefault(normalize_city_text(canonical), canonical)
+                index[normalize_city_text(alias)] = canonical
+            _index = index
+        return _index
+
+
+@lru_cache(maxsize=4096)
+def canonical_city(name):
+    """Canonical display name for a user-typed city, or '' for blank input."""
+    text = normalize_city_text(name)
+    if not text:
+        return ''
+    index = _load_index()
+    if text in index:
+        return index[text]
+    if len(text) >= TYPO_MIN_LENGTH:
+        matches = {index[known] for known in index if _one_typo_apart(text, known)}
+        if len(matches) == 1:
+            return matches.pop()
+    return text.title()
+
+
+def _one_typo_apart(a, b):
+    """True if a and b differ by one inserted/dropped character or one swap of neighbours (not a substitution)."""
+    if a == b:
+        return False
+    if len(a) == len(b):
+        diff = [i for i in range(len(a)) if a[i] != b[i]]
+        return len(diff) == 2 and diff[1] == diff[0] + 1 and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]]
+    if abs(len(a) - len(b)) != 1:
+        return False
+    short, long = (a, b) if len(a) < len(b) else (b, a)
+    return any(long[:i] + long[i + 1:] == short for i in range(len(long)))
+
+
+def city_key(name):
+    """Lookup key shared by every cache and batch keyed on city."""
+    return canonical_city(name).lower()
@@ -0,0 +1,134 @@
+"""Cold-start import benchmark and startup budget check for the web app and the alert worker.
+
+Each entry point is imported in a fresh interpreter several times; the median
+wall time is reported along with the packages that cost the most import time
+(from -X importtime, summed per top-level package).
+
+With --check, exits non-zero if an entry point goes over its time budget
+(STARTUP_BUDGET_MS, above bare interpreter startup) or imports any of the heavy
+packages that must only load on first use, so regressions fail CI or a deploy.
+
+    python -m aegis.coldstart
+    python -m aegis.coldstart --runs 7 --top 10
+    python -m aegis.coldstart --check
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ENTRY_POINTS = {
+    'worker': 'import aegis.worker',
+    'web': 'import flask_app',
+}
+
+# Milliseconds above bare interpreter startup (median), with headroom for slower hosts
+STARTUP_BUDGET_MS = {
+    'worker': 250,
+    'web': 600,
+}
+
+# Loaded on first use only; importing any of these at startup is a regression
+DEFERRED_PACKAGES = ('pandas', 'numpy', 'scipy', 'sklearn', 'twilio', 'requests')
+
+
+def _env():
+    env = dict(os.environ)
+    # Keep imports from doing real work: no SMS, no model load in the background
+    env.setdefault('DEMO_SMS', 'true')
+    env.setdefault('MODEL_PRELOAD', 'lazy')
+    return env
+
+
+def time_import(statement, runs=5):
+    """Median and min wall seconds for `python -c statement` (interpreter startup included)."""
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', statement], check=True, env=_env(),
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples), min(samples)
+
+
+def baseline(runs=5):
+    """Bare interpreter startup, to subtract from the import timings."""
+    return time_import('pass', runs)
+
+
+def _importtime_lines(statement):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], env=_env(),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    return result.stderr.splitlines()
+
+
+def import_profile(statement, lines=None):
+    """[(self microseconds, package)] summed per top-level package, from -X importtime."""
+    totals = {}
+    for line in lines if lines is not None else _importtime_lines(statement):
+        if not line.startswith('import time:') or line.count('|') != 2:
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        if not own.strip().isdigit():
+            continue  # header line
+        package = name.strip().split('.')[0]
+        totals[package] = totals.get(package, 0) + int(own)
+    return sorted(((us, package) for package, us in totals.items()), reverse=True)
+
+
+def run(entry_points=None, runs=5, top=8, check=False):
+    """Time each entry point and print a summary.
+
+    Returns {name: median ms above bare startup}; with check=True also a list
+    of budget violations (empty when everything is within budget).
+    """
+    entry_points = entry_points or ENTRY_POINTS
+    bare, _ = baseline(runs)
+    print(f"Interpreter startup: {bare * 1000:.0f} ms (median of {runs})")
+    results = {}
+    violations = []
+    for name, statement in entry_points.items():
+        median, fastest = time_import(statement, runs)
+        above_ms = (median - bare) * 1000
+        results[name] = above_ms
+        lines = _importtime_lines(statement)
+        print(f"\n{name}: `{statement}`")
+        print(f"  median {median * 1000:.0f} ms, min {fastest * 1000:.0f} ms, {above_ms:.0f} ms above bare startup")
+        for us, package in import_profile(statement, lines)[:top]:
+            print(f"    {us / 1000:8.1f} ms  {package}")
+        if not check:
+            continue
+        budget = STARTUP_BUDGET_MS.get(name)
+        if budget is not None and above_ms > budget:
+            violations.append(f"{name}: {above_ms:.0f} ms is over its {budget} ms budget")
+        imported = {package for _, package in import_profile(statement, lines)}
+        eager = sorted(imported.intersection(DEFERRED_PACKAGES))
+        if eager:
+            violations.append(f"{name}: imports {', '.join(eager)} at startup")
+    if check:
+        print()
+        for violation in violations:
+            print(f"FAIL {violation}")
+        if not violations:
+            print("OK: all entry points within their startup budget")
+        return results, violations
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Measure (and optionally enforce) cold-start import time')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=8, help='slowest packages to list')
+    parser.add_argument('--check', action='store_true', help='fail if an entry point is over budget')
+    parser.add_argument('entry', nargs='*', help=f"entry points: {', '.join(ENTRY_POINTS)} (default: all)")
+    args = parser.parse_args()
+    unknown = [name for name in args.entry if name not in ENTRY_POINTS]
+    if unknown:
+        parser.error(f"unknown entry point(s): {', '.join(unknown)}")
+    selected = {name: ENTRY_POINTS[name] for name in args.entry} if args.entry else None
+    if args.check:
+        _, failures = run(selected, args.runs, args.top, check=True)
+        sys.exit(1 if failures else 0)
+    run(selected, args.runs, args.top)
@@ -0,0 +1,314 @@
+"""Risk timelines: the predicted health risk for every 3-hour step of the next five days, per registered city.
+
+A background refresher rebuilds the timelines every FORECAST_REFRESH_SECONDS
+(default 10800, about how often OpenWeatherMap updates its forecast). Each city
+costs one forecast call. All steps of a refresh (40 per city) are then scored
+together, with one predict call per ensemble (HealthModel.predict_many), rather
+than one prediction per step.
+
+The predict page shows a city's timeline. Scheduled alerts carry an outlook
+when a High risk is forecast within ADVANCE_ALERT_HOURS (default 24), so users
+hear about it before it arrives. Timelines are written to FORECAST_FILE
+(default risk_forecast.json) and shared between processes like the risk view.
+A registered city that has no timeline yet is fetched in the background on
+first request. Other cities are never fetched, and a full refresh drops the
+timelines of cities that are no longer registered, so the set stays bounded.
+
+    python -m aegis.forecast Pune Mumbai     # fetch, score and print timelines
+"""
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from aegis.cities import canonical_city, city_key
+from aegis.dispatch import RISK_LEVELS, risk_level
+from aegis.scheduler import ALERT_TIMEZONE
+from aegis.weather import fetch_forecast
+
+FORECAST_FILE = os.getenv('FORECAST_FILE', 'risk_forecast.json')
+REFRESH_SECONDS = float(os.getenv('FORECAST_REFRESH_SECONDS', str(3 * 3600)))
+ADVANCE_HOURS = float(os.getenv('ADVANCE_ALERT_HOURS', '24'))
+FETCH_WORKERS = 8
+
+
+def _local(ts):
+    try:
+        from zoneinfo import ZoneInfo
+        return datetime.fromtimestamp(ts, ZoneInfo(ALERT_TIMEZONE))
+    except Exception:
+        return datetime.fromtimestamp(ts)
+
+
+def daily(timeline):
+    """The worst step of each local day: [{'day', 'disease', 'risk', 'at'}]."""
+    days = {}
+    for step in timeline['steps']:
+        when = _local(step['time'])
+        day = when.strftime('%a %d/%m')
+        worst = days.get(day)
+        if worst is None or RISK_LEVELS.index(risk_level(step['risk'])) < RISK_LEVELS.index(risk_level(worst['risk'])):
+            days[day] = {'day': day, 'disease': step['disease'], 'risk': step['risk'], 'at': when.strftime('%H:%M')}
+    return list(days.values())
+
+
+def describe_outlook(step):
+    """One line for an alert message, e.g. 'High Dengue risk expected from Tue 21/10 15:00'."""
+    return f"{step['risk']} {step['disease']} risk expected from {_local(step['time']).strftime('%a %d/%m %H:%M')}"
+
+
+class RiskTimelines:
+    """city -> {'city', 'fetched_at', 'steps': [{'time', 'weather', 'disease', 'risk'}]}, kept fresh in the background.
+
+    cities() returns the registered city names to keep timelines for.
+    """
+
+    def __init__(self, model, cities, path=FORECAST_FILE, refresh_seconds=REFRESH_SECONDS, fetch=fetch_forecast,
+                 clock=time.time, workers=FETCH_WORKERS):
+        self.model = model
+        self.cities = cities
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self.fetch = fetch
+        self.clock = clock
+        self.workers = workers
+        self.refreshed_at = None
+        self.refresh_seconds_taken = None
+        self.refreshes = self.loads = self.upstream_calls = self.scored_steps = 0
+        self._timelines = {}    # city_key -> timeline
+        self._versions = {}     # city_key -> model.version the risks came from
+        self._requested = set()
+        self._file_mtime = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the refresher thread (once)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='risk-forecast', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh_if_due()
+                with self._lock:
+                    requested, self._requested = list(self._requested), set()
+                if requested:
+                    self.refresh(requested)
+            except Exception as e:
+                print(f"[Forecast] Refresh failed: {e}")
+            # Jitter so processes that share the file don't all refresh in the same second
+            self._wake.wait(max(1.0, self._seconds_until_due()) + random.uniform(0, 2))
+            self._wake.clear()
+
+    def _seconds_until_due(self):
+        if self.refreshed_at is None:
+            return 0.0
+        return self.refreshed_at + self.refresh_seconds - self.clock()
+
+    def refresh_if_due(self):
+        """Load fresher timelines another process wrote, or refetch them all once they are old enough."""
+        self._load_file()
+        if self._seconds_until_due() <= 0:
+            self.refresh()
+
+    def refresh(self, cities=None):
+        """Fetch and score the forecast for cities (default: every registered city, dropping any other).
+
+        Returns the number of timelines built.
+        """
+        if not self.model.ensure_loaded():
+            print("[Forecast] Model not loaded, skipping refresh")
+            return 0
+        full = cities is None
+        if full:
+            cities = [city for city in self.cities() if city]
+        cities = list(dict.fromkeys(canonical_city(city) for city in cities))
+        if full:
+            registered = {city_key(city) for city in cities}
+            with self._lock:
+                for key in [key for key in self._timelines if key not in registered]:
+                    del self._timelines[key]
+                    self._versions.pop(key, None)
+        if not cities:
+            return 0  # nothing registered (or synced) yet; try again shortly
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(cities)), thread_name_prefix='forecast') as pool:
+            forecasts = dict(zip(cities, pool.map(self.fetch, cities)))
+        self.upstream_calls += len(cities)
+        fetched_at = self.clock()
+        version = self.model.version
+        timelines = self._score({city: steps for city, steps in forecasts.items() if steps}, fetched_at)
+        with self._lock:
+            for key, timeline in timelines.items():
+                self._timelines[key] = timeline
+                self._versions[key] = version
+            if full:
+                self.refreshed_at = fetched_at
+        if full:
+            self.refreshes += 1
+        self.refresh_seconds_taken = round(time.perf_counter() - started, 3)
+        self._save_file()
+        print(f"[Forecast] Built {len(timelines)}/{len(cities)} timelines "
+              f"({sum(len(t['steps']) for t in timelines.values())} steps) in {self.refresh_seconds_taken}s")
+        return len(timelines)
+
+    def _score(self, forecasts, fetched_at):
+        """{city: [(time, features)]} -> {city_key: timeline}, with every step scored in one batch."""
+        observations = [features for steps in forecasts.values() for _, features in steps]
+        try:
+            scored = self.model.predict_many(observations)
+        except Exception as e:
+            print(f"[Forecast] Prediction failed: {e}")
+            return {}
+        if len(scored) != len(observations):
+            return {}
+        self.scored_steps += len(observations)
+        timelines = {}
+        position = 0
+        for city, steps in forecasts.items():
+            rows = []
+            for ts, features in steps:
+                disease, risk = scored[position]
+                position += 1
+                rows.append({'time': ts, 'weather': features, 'disease': disease, 'risk': risk})
+            timelines[city_key(city)] = {'city': city, 'fetched_at': fetched_at, 'steps': rows}
+        return timelines
+
+    def get(self, city):
+        """The city's timeline from now on, or None. A registered city without one is fetched in the background."""
+        key = city_key(city)
+        with self._lock:
+            timeline = self._timelines.get(key)
+            version = self._versions.get(key)
+        if timeline is None:
+            if self.registered(city):
+                with self._lock:
+                    self._requested.add(canonical_city(city))
+                self._wake.set()
+            return None
+        if version != self.model.version and self.model.loaded:
+            # Scored by another model file (retrained since): re-score the stored forecast, no upstream call
+            version = self.model.version
+            rescored = self._score({timeline['city']: [(step['time'], step['weather']) for step in timeline['steps']]},
+                                   timeline['fetched_at'])
+            if key in rescored:
+                with self._lock:
+                    self._timelines[key] = timeline = rescored[key]
+                    self._versions[key] = version
+        now = self.clock()
+        # Keep the step that is in progress (each covers the 3 hours after its time)
+        steps = [step for step in timeline['steps'] if step['time'] + 3 * 3600 > now]
+        if not steps:
+            return None
+        return dict(timeline, steps=steps)
+
+    def registered(self, city):
+        """Whether city is one of cities(), the only ones timelines are fetched for."""
+        key = city_key(city)
+        return any(city_key(name) == key for name in self.cities() if name)
+
+    def outlook(self, city, hours=ADVANCE_HOURS):
+        """The first step within the next `hours` with a High risk, or None."""
+        timeline = self.get(city)
+        if timeline is None:
+            return None
+        until = self.clock() + hours * 3600
+        for step in timeline['steps']:
+            if step['time'] > until:
+                break
+            if risk_level(step['risk']) == RISK_LEVELS[0]:
+                return step
+        return None
+
+    def _save_file(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {'refreshed_at': self.refreshed_at, 'timelines': list(self._timelines.values()),
+                    'model_versions': dict(self._versions)}
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w') as file:
+                json.dump(data, file)
+            os.replace(tmp_path, self.path)
+            self._file_mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            print(f"[Forecast] Could not save {self.path}: {e}")
+
+    def _load_file(self):
+        if not self.path:
+            return
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._file_mtime:
+            return
+        try:
+            with open(self.path) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return
+        self._file_mtime = mtime
+        with self._lock:
+            for timeline in data.get('timelines', []):
+                key = city_key(timeline['city'])
+                current = self._timelines.get(key)
+                if current is None or timeline['fetched_at'] > current['fetched_at']:
+                    self._timelines[key] = timeline
+                    # A timeline scored by another model file is re-scored on read
+                    self._versions[key] = data.get('model_versions', {}).get(key)
+            if data.get('refreshed_at') and (self.refreshed_at is None or data['refreshed_at'] > self.refreshed_at):
+                self.refreshed_at = data['refreshed_at']
+        self.loads += 1
+
+    def stats(self):
+        with self._lock:
+            timelines = list(self._timelines.values())
+            requested = len(self._requested)
+        now = self.clock()
+        return {
+            'cities': len(timelines),
+            'steps': sum(len(timeline['steps']) for timeline in timelines),
+            'refreshed_seconds_ago': round(now - self.refreshed_at) if self.refreshed_at else None,
+            'last_refresh_seconds': self.refresh_seconds_taken,
+            'refreshes': self.refreshes,
+            'loaded_from_file': self.loads,
+            'upstream_calls': self.upstream_calls,
+            'scored_steps': self.scored_steps,
+            'requested': requested,
+            'refresh_interval_seconds': self.refresh_seconds,
+            'advance_alert_hours': ADVANCE_HOURS,
+        }
+
+
+if __name__ == '__main__':
+    import argparse
+    from aegis.model import model_from_env
+
+    parser = argparse.ArgumentParser(description='Fetch the forecast for some cities and print their risk timelines')
+    parser.add_argument('cities', nargs='+')
+    parser.add_argument('--hours', type=float, default=ADVANCE_HOURS)
+    args = parser.parse_args()
+    timelines = RiskTimelines(model_from_env(), lambda: args.cities, path=None)
+    timelines.refresh()
+    for name in args.cities:
+        timeline = timelines.get(name)
+        if timeline is None:
+            print(f"{name}: no forecast")
+            continue
+        print(f"{timeline['city']}: {len(timeline['steps'])} steps")
+        for day in daily(timeline):
+            print(f"    {day['day']}  {day['risk']:<9} {day['disease']} (worst at {day['at']})")
+        step = timelines.outlook(name, args.hours)
+        if step:
+            print(f"    outlook: {describe_outlook(step)}")
+    print(timelines.stats())
@@ -0,0 +1,212 @@
+"""Background alert jobs with progress that any gunicorn worker can stream.
+
+Each job's state is a small JSON file in ALERT_JOBS_DIR (default alert_jobs/),
+rewritten atomically as it progresses. The worker that runs a job and the
+worker serving its Server-Sent Events stream don't have to be the same process.
+Cancelling drops a <id>.cancel marker that the running job checks before each send.
+"""
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+JOBS_DIR = os.getenv('ALERT_JOBS_DIR', 'alert_jobs')
+KEEP_JOBS = 20          # finished job files kept for the alerts page
+RECENT_LIMIT = 50       # per-user progress entries kept in the job file
+SAVE_INTERVAL = 0.25    # seconds between progress writes
+# A running job whose file hasn't changed for this long died with its worker
+STALE_SECONDS = int(os.getenv('ALERT_JOB_STALE_SECONDS', '300'))
+# A running job rewrites its file at least this often, even while a phase reports no progress
+HEARTBEAT_SECONDS = STALE_SECONDS / 3
+
+FINISHED = ('done', 'cancelled', 'failed', 'lost')
+_JOB_ID = re.compile(r'^[0-9a-f]{12}$')
+
+
+class AlertJob:
+    """Progress of one send-to-all run; thread-safe, persisted to <jobs_dir>/<id>.json."""
+
+    def __init__(self, job_id, total, jobs_dir=JOBS_DIR):
+        self.id = job_id
+        self.jobs_dir = jobs_dir
+        self.status = 'queued'
+        self.message = ''
+        self.total = total
+        self.sent = self.submitted = self.failed = self.skipped = 0
+        self.started_at = time.time()
+        self.sending_since = None
+        self.finished_at = None
+        self.seq = 0
+        self.recent = []
+        self.report = None
+        self._lock = threading.Lock()
+        self._saved_at = 0.0
+
+    @property
+    def path(self):
+        return os.path.join(self.jobs_dir, f'{self.id}.json')
+
+    @property
+    def cancel_path(self):
+        return os.path.join(self.jobs_dir, f'{self.id}.cancel')
+
+    def cancelled(self):
+        return os.path.exists(self.cancel_path)
+
+    def set_status(self, status, message=''):
+        with self._lock:
+            self.status = status
+            self.message = message
+            if status == 'sending' and self.sending_since is None:
+                self.sending_since = time.time()
+            if status in FINISHED:
+                self.finished_at = time.time()
+        self.save(force=True)
+
+    def record(self, phone, city, outcome, risk=None):
+        """One user's result: outcome is 'sent', 'submitted' (in a bulk chunk), 'failed' or 'skipped'."""
+        with self._lock:
+            if outcome == 'sent':
+                self.sent += 1
+            elif outcome == 'submitted':
+                self.submitted += 1
+            elif outcome == 'failed':
+                self.failed += 1
+            else:
+                self.skipped += 1
+            self.seq += 1
+            self.recent.append({'seq': self.seq, 'phone': phone, 'city': city, 'outcome': outcome, 'risk': risk})
+            del self.recent[:-RECENT_LIMIT]
+        self.save()
+
+    def eta_seconds(self):
+        """Remaining time at the send rate so far, or None before the first send."""
+        processed = self.sent + self.submitted + self.failed + self.skipped
+        if not self.sending_since or not processed:
+            return None
+        elapsed = time.time() - self.sending_since
+        return round(max(0, self.total - processed) * elapsed / processed)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'id': self.id, 'status': self.status, 'message': self.message,
+                'total': self.total, 'sent': self.sent, 'submitted': self.submitted, 'failed': self.failed,
+                'skipped': self.skipped,
+                'started_at': self.started_at, 'finished_at': self.finished_at,
+                'eta_seconds': None if self.status in FINISHED else self.eta_seconds(),
+                'seq': self.seq, 'recent': list(self.recent), 'report': self.report,
+                'updated_at': time.time(),
+            }
+
+    def save(self, force=False):
+        now = time.time()
+        if not force and now - self._saved_at < SAVE_INTERVAL:
+            return
+        self._saved_at = now
+        data = self.to_dict()
+        tmp_path = f'{self.path}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'w') as file:
+                json.dump(data, file)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"[Jobs] Could not save job {self.id}: {e}")
+
+
+def _prune(jobs_dir, keep=KEEP_JOBS):
+    files = sorted((os.path.join(jobs_dir, name) for name in os.listdir(jobs_dir) if name.endswith('.json')),
+                   key=os.path.getmtime)
+    for path in files[:-keep]:
+        for stale in (path, path[:-len('.json')] + '.cancel'):
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+
+def create_job(total, jobs_dir=JOBS_DIR):
+    """Register a new job and write its initial state."""
+    os.makedirs(jobs_dir, exist_ok=True)
+    _prune(jobs_dir)
+    job = AlertJob(uuid.uuid4().hex[:12], total, jobs_dir)
+    job.save(force=True)
+    return job
+
+
+def start_job(job, target, heartbeat=HEARTBEAT_SECONDS):
+    """Run target(job) on a daemon thread; an unexpected exception marks the job failed.
+
+    While it runs, a heartbeat rewrites the job file every `heartbeat` seconds, so a
+    long phase with no per-user progress (fetching weather) isn't reported lost.
+    """
+    finished = threading.Event()
+
+    def beat():
+        while not finished.wait(heartbeat):
+            job.save(force=True)
+
+    def run():
+        threading.Thread(target=beat, name=f'alert-job-{job.id}-heartbeat', daemon=True).start()
+        try:
+            target(job)
+        except Exception as e:
+            print(f"[Jobs] Job {job.id} failed: {e}")
+            import traceback
+            traceback.print_exc()
+            job.set_status('failed', str(e))
+        finally:
+            finished.set()
+    thread = threading.Thread(target=run, name=f'alert-job-{job.id}', daemon=True)
+    thread.start()
+    return thread
+
+
+def read_job(job_id, jobs_dir=JOBS_DIR):
+    """Current state of a job as a dict, or None for an unknown id."""
+    if not _JOB_ID.match(job_id or ''):
+        return None
+    try:
+        with open(os.path.join(jobs_dir, f'{job_id}.json')) as file:
+            data = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if data['status'] not in FINISHED and time.time() - data['updated_at'] > STALE_SECONDS:
+        data['status'] = 'lost'
+        data['message'] = 'The worker running this job stopped before it finished'
+    return data
+
+
+def cancel_job(job_id, jobs_dir=JOBS_DIR):
+    """Ask a running job to stop; returns False for unknown or finished jobs."""
+    data = read_job(job_id, jobs_dir)
+    if data is None or data['status'] in FINISHED:
+        return False
+    with open(os.path.join(jobs_dir, f'{job_id}.cancel'), 'w') as file:
+        file.write(str(time.time()))
+    return True
+
+
+def stream_events(job_id, jobs_dir=JOBS_DIR, poll=0.5, heartbeat=15):
+    """Server-Sent Events for a job: a snapshot on every change, ending once it finishes."""
+    last_seen = None
+    idle = 0.0
+    while True:
+        data = read_job(job_id, jobs_dir)
+        if data is None:
+            yield 'event: missing\ndata: {}\n\n'
+            return
+        marker = (data['status'], data['seq'], data['message'])
+        if marker != last_seen:
+            last_seen = marker
+            idle = 0.0
+            yield f'data: {json.dumps(data)}\n\n'
+            if data['status'] in FINISHED:
+                return
+        elif idle >= heartbeat:
+            idle = 0.0
+            yield ': keep-alive\n\n'
+        time.sleep(poll)
+        idle += poll
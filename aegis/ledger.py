@@ -0,0 +1,232 @@
+"""Append-only ledger of alert deliveries, with fast aggregate queries.
+
+Every send outcome (scheduled cycles, send-to-all, manual sends) is appended
+with its city, predicted disease and risk, status and Twilio error code.
+Status is 'sent' (sid is the message's SID), 'submitted' (part of a Notify bulk
+chunk; sid is the chunk's notification SID, shared by all its recipients) or
+'failed'.
+record() only queues the row; a background thread writes queued rows in
+batches, so the send path never waits on disk.
+
+Rows go to one SQLite file per UTC day in ALERT_LEDGER_DIR (default
+alert_ledger/), e.g. deliveries-20261019.db (see aegis.segments). Each segment holds the raw rows
+(indexed by time and phone) and an hourly rollup keyed by city, disease, risk,
+status and error code, updated in the same transaction. Aggregate queries read
+only the rollups of the days in range, so they stay fast at tens of millions
+of rows; old days can be archived or deleted a file at a time.
+
+    python -m aegis.ledger --rows 20000000 --days 7     # synthetic load + query timings
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from aegis.cities import canonical_city
+from aegis.segments import DaySegmentStore, day_files
+
+LEDGER_DIR = os.getenv('ALERT_LEDGER_DIR', 'alert_ledger')
+PREFIX = 'deliveries'
+BATCH_SIZE = 500            # queued rows that trigger a write before the timer
+FLUSH_SECONDS = 1.0
+DIMENSIONS = ('city', 'disease', 'risk', 'status', 'error_code')
+GROUPINGS = DIMENSIONS + ('day', 'hour')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS deliveries (
+    ts REAL NOT NULL, phone TEXT NOT NULL, city TEXT NOT NULL, disease TEXT NOT NULL, risk TEXT NOT NULL,
+    status TEXT NOT NULL, error_code INTEGER NOT NULL, sid TEXT, source TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS deliveries_ts ON deliveries (ts);
+CREATE INDEX IF NOT EXISTS deliveries_phone ON deliveries (phone, ts);
+CREATE TABLE IF NOT EXISTS rollup (
+    hour INTEGER NOT NULL, city TEXT NOT NULL, disease TEXT NOT NULL, risk TEXT NOT NULL, status TEXT NOT NULL,
+    error_code INTEGER NOT NULL, count INTEGER NOT NULL,
+    PRIMARY KEY (hour, city, disease, risk, status, error_code)) WITHOUT ROWID;
+"""
+
+
+def outcome(result):
+    """(status, Twilio error code or 0, message SID or None) for a send_sms/send_bulk_sms result."""
+    if result is True or isinstance(result, str):
+        return 'sent', 0, result if isinstance(result, str) else None
+    if isinstance(result, dict) and result.get('status') == 'submitted':
+        return 'submitted', 0, result.get('notification_sid')
+    code = result.get('code') if isinstance(result, dict) else None
+    try:
+        code = int(code or 0)
+    except (TypeError, ValueError):
+        code = 0
+    return 'failed', code, None
+
+
+class DeliveryLedger(DaySegmentStore):
+    """Queues delivery rows and writes them in batches on a background thread."""
+    prefix = PREFIX
+    schema = _SCHEMA
+    thread_name = 'delivery-ledger'
+    log_tag = 'Ledger'
+
+    def __init__(self, ledger_dir=LEDGER_DIR, batch_size=BATCH_SIZE, flush_seconds=FLUSH_SECONDS, clock=time.time):
+        super().__init__(ledger_dir, batch_size, flush_seconds, clock)
+
+    def record(self, phone, city, disease, risk, status, error_code=0, sid=None, source='', ts=None):
+        """Queue one delivery; returns immediately. The city is stored under its canonical name."""
+        self.enqueue((self.clock() if ts is None else ts, phone or '', canonical_city(city or ''), disease or '', risk or '',
+                      status, int(error_code or 0), sid, source))
+
+    def row_time(self, row):
+        return row[0]
+
+    def write_day(self, conn, day, rows):
+        """The raw rows plus their counts added to the hourly rollup."""
+        rollup = Counter((int(row[0] // 3600),) + row[2:7] for row in rows)
+        conn.executemany('INSERT INTO deliveries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        conn.executemany(
+            'INSERT INTO rollup VALUES (?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT DO UPDATE SET count = count + excluded.count',
+            [key + (count,) for key, count in rollup.items()])
+
+
+def aggregate(since, until, group_by=('city',), filters=None, ledger_dir=LEDGER_DIR, limit=1000):
+    """Delivery counts between two timestamps, grouped and filtered by DIMENSIONS.
+
+    group_by may also contain 'day' or 'hour' (UTC). Times are matched at hour
+    resolution. A city filter is canonicalized like recorded cities, so an
+    alias or another case of the name matches too.
+    Returns {'rows': [{...group values, 'count'}], 'total', 'segments', 'seconds'}.
+    Raises ValueError for unknown dimensions.
+    """
+    started = time.perf_counter()
+    filters = {key: value for key, value in (filters or {}).items() if value not in (None, '')}
+    unknown = [name for name in list(group_by) + list(filters) if name not in GROUPINGS]
+    if unknown:
+        raise ValueError(f"Unknown dimension(s): {', '.join(unknown)}. Use {', '.join(GROUPINGS)}")
+    columns = []
+    for name in group_by:
+        if name == 'day':
+            columns.append("date(hour * 3600, 'unixepoch')")
+        elif name == 'hour':
+            columns.append("strftime('%Y-%m-%d %H:00', hour * 3600, 'unixepoch')")
+        else:
+            columns.append(name)
+    where = ['hour >= ?', 'hour <= ?']
+    params = [int(since // 3600), int(until // 3600)]
+    for name, value in filters.items():
+        if name in ('day', 'hour'):
+            raise ValueError(f"Filter by time with since/until, not {name}")
+        if name == 'city':
+            value = canonical_city(value)
+        where.append(f'{name} = ?')
+        params.append(int(value) if name == 'error_code' else value)
+    select = ', '.join(columns + ['SUM(count)'])
+    sql = f"SELECT {select} FROM rollup WHERE {' AND '.join(where)}"
+    if columns:
+        sql += f" GROUP BY {', '.join(columns)}"
+
+    totals = Counter()
+    segments = [path for _, path in day_files(ledger_dir, PREFIX, since, until)]
+    for path in segments:
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, timeout=30)
+        try:
+            for row in conn.execute(sql, params):
+                if row[-1]:
+                    totals[tuple(row[:-1])] += row[-1]
+        except sqlite3.OperationalError as e:
+            print(f"[Ledger] Skipping {path}: {e}")
+        finally:
+            conn.close()
+    rows = [dict(zip(group_by, key), count=count) for key, count in totals.most_common(limit)]
+    return {'rows': rows, 'total': sum(totals.values()), 'groups': len(totals), 'segments': len(segments),
+            'seconds': round(time.perf_counter() - started, 4)}
+
+
+def parse_time(text, default):
+    """Epoch seconds from an ISO date/datetime (UTC if no offset) or epoch number; default when blank."""
+    if not text:
+        return default
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    value = datetime.fromisoformat(text)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def delivery_ledger():
+    """The process-wide ledger (created on first use)."""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = DeliveryLedger()
+        return _ledger
+
+
+if __name__ == '__main__':
+    import argparse
+    import random
+    import shutil
+    import tempfile
+
+    parser = argparse.ArgumentParser(description='Load the delivery ledger with synthetic rows and time queries')
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--cities', type=int, default=200)
+    parser.add_argument('--dir', help='ledger directory (default: a temporary one, removed afterwards)')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    ledger_dir = args.dir or tempfile.mkdtemp(prefix='aegis-ledger-')
+    rng = random.Random(args.seed)
+    diseases = ['Dengue', 'Malaria', 'Heat Stroke', 'Asthma', 'Influenza', 'Cholera']
+    risks = ['High', 'Moderate', 'Low']
+    cities = ['Pune', 'Mumbai', 'Delhi', 'Chennai'] + [f'City {i:03d}' for i in range(args.cities - 4)]
+    end = time.time()
+    start = end - args.days * 86400
+    writer = DeliveryLedger(ledger_dir)
+    # Everyone in a city gets the same prediction within an hour, as in a real cycle
+    prediction = {}
+    batch = []
+    started = time.perf_counter()
+    for i in range(args.rows):
+        ts = start + (end - start) * i / args.rows
+        city = cities[(int(rng.paretovariate(1.2)) - 1) % len(cities)]
+        key = (city, int(ts // 3600))
+        if key not in prediction:
+            prediction[key] = (rng.choice(diseases), rng.choices(risks, weights=[53, 33, 14])[0])
+        disease, risk = prediction[key]
+        failed = rng.random() < 0.02
+        batch.append((ts, f'+91{9000000000 + i % 5000000}', city, disease, risk, 'failed' if failed else 'sent',
+                      rng.choice([21211, 21610, 30003, 30005]) if failed else 0, None, 'bench'))
+        if len(batch) >= 100000:
+            writer.write(batch)
+            batch = []
+    if batch:
+        writer.write(batch)
+    load_seconds = time.perf_counter() - started
+    size = sum(os.path.getsize(os.path.join(ledger_dir, name)) for name in os.listdir(ledger_dir))
+    print(f"Wrote {args.rows} rows over {args.days} days in {load_seconds:.1f} s "
+          f"({args.rows / load_seconds:.0f} rows/s), {size / 2 ** 20:.0f} MiB")
+
+    last_week = (end - 7 * 86400, end)
+    queries = [
+        ('High-risk Dengue alerts to Pune, last week', (), {'city': 'Pune', 'disease': 'Dengue', 'risk': 'High'}),
+        ('sent/failed by risk', ('risk', 'status'), {}),
+        ('failures by Twilio error code', ('error_code',), {'status': 'failed'}),
+        ('top cities by day', ('day', 'city'), {}),
+    ]
+    for name, group_by, filters in queries:
+        result = aggregate(*last_week, group_by=group_by, filters=filters, ledger_dir=ledger_dir, limit=5)
+        print(f"{name}: {result['total']} rows in {result['groups']} groups, "
+              f"{result['seconds'] * 1000:.1f} ms over {result['segments']} segments")
+        for row in result['rows'][:3]:
+            print(f"    {row}")
+    if not args.dir:
+        shutil.rmtree(ledger_dir, ignore_errors=True)
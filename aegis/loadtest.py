@@ -0,0 +1,79 @@
+"""Concurrency load test: slow weather requests mixed with fast page loads.
+
+Run the app against a slow upstream, then drive it:
+
+    python -m aegis.stubs --port 8081 --delay 5
+    OWM_BASE_URL=http://127.0.0.1:8081 gunicorn flask_app:app
+    python -m aegis.loadtest --target http://127.0.0.1:5000 --slow 16 --fast 40
+
+With sync workers, the fast requests queue behind the slow ones; with the
+gthread/gevent profiles they should stay fast.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(target, slow=16, fast=40, fast_path='/admin/login', city='Pune', fast_delay=0.05):
+    """Fire `slow` POST /fetch_weather requests and, meanwhile, `fast` GETs of fast_path."""
+    import requests
+
+    timings = {'slow': [], 'fast': []}
+    errors = {'slow': 0, 'fast': 0}
+    lock = threading.Lock()
+
+    def record(kind, fn):
+        start = time.perf_counter()
+        try:
+            fn().raise_for_status()
+            with lock:
+                timings[kind].append(time.perf_counter() - start)
+        except Exception:
+            with lock:
+                errors[kind] += 1
+
+    def slow_call():
+        record('slow', lambda: requests.post(f'{target}/fetch_weather', json={'city': city}, timeout=60))
+
+    def fast_call():
+        record('fast', lambda: requests.get(f'{target}{fast_path}', timeout=60))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=slow + fast) as pool:
+        for _ in range(slow):
+            pool.submit(slow_call)
+        time.sleep(0.2)  # let the slow requests occupy the server first
+        for _ in range(fast):
+            pool.submit(fast_call)
+            time.sleep(fast_delay)
+    wall = time.perf_counter() - start
+
+    report = {'wall_seconds': round(wall, 2)}
+    for kind in ('slow', 'fast'):
+        report[kind] = {
+            'ok': len(timings[kind]),
+            'errors': errors[kind],
+            'p50_s': round(_percentile(timings[kind], 50) or 0, 3),
+            'p99_s': round(_percentile(timings[kind], 99) or 0, 3),
+        }
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Aegis concurrency load test')
+    parser.add_argument('--target', default='http://127.0.0.1:5000')
+    parser.add_argument('--slow', type=int, default=16, help='concurrent /fetch_weather requests')
+    parser.add_argument('--fast', type=int, default=40, help='fast page loads issued meanwhile')
+    parser.add_argument('--fast-path', default='/admin/login')
+    args = parser.parse_args()
+    for key, value in run(args.target, args.slow, args.fast, args.fast_path).items():
+        print(f"{key}: {value}")
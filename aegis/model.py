@@ -0,0 +1,180 @@
+"""Health risk model: loading, auto-training and prediction, shared by the web app and the worker.
+
+Nothing heavy is imported until the model is first used: pandas and
+scikit-learn come in with the first load() or predict(), so importing this
+module (or starting the worker) stays fast.
+"""
+import os
+import threading
+from collections import namedtuple
+
+from aegis.prediction_cache import cache_from_env
+from aegis.training import (DATASET_FILE, MODEL_FILE, FEATURES, train_from_config, write_bundle_atomic,
+                            print_report)
+
+PRECAUTION_FIELDS = ['Precaution_1', 'Precaution_2', 'Precaution_3']
+
+# Everything one prediction needs, swapped in as a whole so a reader never mixes two models
+ModelBundle = namedtuple('ModelBundle', 'gb_disease gb_risk le_disease le_risklevel precautions version')
+
+
+class HealthModel:
+    """The trained ensembles plus an optional quantized prediction cache."""
+
+    def __init__(self, model_file=MODEL_FILE, dataset_file=DATASET_FILE, cache=None):
+        self.model_file = model_file
+        self.dataset_file = dataset_file
+        self.cache = cache
+        # ModelBundle in use, replaced in one assignment; readers take a local reference once
+        self.bundle = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self.bundle is not None
+
+    @property
+    def version(self):
+        """Signature of the model file in use ('<mtime_ns>-<size>'), or None.
+
+        It changes only when the file does and is the same in every process;
+        the prediction cache clears itself on change.
+        """
+        bundle = self.bundle
+        return bundle.version if bundle is not None else None
+
+    def _use(self, bundle, version):
+        self.bundle = ModelBundle(bundle['gb_disease'], bundle['gb_risk'], bundle['le_disease'],
+                                  bundle['le_risklevel'], bundle['precautions'], version)
+
+    def _clear(self):
+        self.bundle = None
+
+    def file_version(self):
+        """Signature of the model file on disk, or None if it is missing."""
+        try:
+            return _signature(os.stat(self.model_file))
+        except OSError:
+            return None
+
+    def train(self):
+        """Train from the dataset, write the model file atomically and use it. Returns True on success."""
+        if not os.path.exists(self.dataset_file):
+            print(f"Error: Dataset file '{self.dataset_file}' not found. Cannot train model automatically.")
+            return False
+        try:
+            print("Training model automatically...")
+            bundle = train_from_config(self.dataset_file)
+            print_report(bundle['training_report'])
+            # Temp file + rename so other workers never read a half-written pickle
+            write_bundle_atomic(bundle, self.model_file)
+            self._use(bundle, self.file_version())
+            print("Model trained and loaded successfully!")
+            return True
+        except Exception as e:
+            print(f"Error training model automatically: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            return False
+
+    def load(self):
+        """Load or reload the model file, auto-training if it is missing or unreadable.
+
+        Does nothing if the file in use hasn't changed.
+        """
+        with self._lock:
+            version = self.version
+            if version is not None and version == self.file_version():
+                return True
+            return self._load()
+
+    def ensure_loaded(self):
+        """Load on first use; True once a model is available. Concurrent callers load it once."""
+        if self.loaded:
+            return True
+        with self._lock:
+            return self.loaded or self._load()
+
+    def _load(self):
+        import pickle
+
+        if not os.path.exists(self.model_file):
+            print("Model file not found. Training model automatically...")
+        else:
+            try:
+                with open(self.model_file, 'rb') as file:
+                    # Signature of the file actually opened, even if it is replaced meanwhile
+                    version = _signature(os.fstat(file.fileno()))
+                    self._use(pickle.load(file), version)
+                print("Model loaded successfully!")
+                return True
+            except (ModuleNotFoundError, ImportError, AttributeError, KeyError) as e:
+                print(f"Warning: Could not load model file due to compatibility issue: {e}")
+                print("Attempting to automatically retrain the model...")
+            except Exception as e:
+                print(f"Warning: Could not load model file: {e}")
+                print("Attempting to automatically retrain the model...")
+        if self.train():
+            return True
+        self._clear()
+        return False
+
+    def predict(self, weather_data):
+        """(disease, risk level, [3 precautions]) for one observation, or (None, None, []) without a model."""
+        bundle = self.bundle
+        if bundle is None:
+            return None, None, []
+        if self.cache is not None:
+            return self.cache.get_or_compute(weather_data, bundle.version,
+                                             lambda representative: self._predict_uncached(representative, bundle))
+        return self._predict_uncached(weather_data, bundle)
+
+    def _predict_uncached(self, weather_data, bundle=None):
+        """Run both ensembles of bundle (default: the one in use) and look up precautions"""
+        import pandas as pd
+
+        bundle = bundle or self.bundle
+        if bundle is None:
+            return None, None, []
+        input_df = pd.DataFrame([weather_data], columns=FEATURES)
+        y_d_pred = bundle.le_disease.inverse_transform(bundle.gb_disease.predict(input_df))[0]
+        y_r_pred = bundle.le_risklevel.inverse_transform(bundle.gb_risk.predict(input_df))[0]
+        return y_d_pred, y_r_pred, _precautions(bundle.precautions, y_d_pred, y_r_pred)
+
+    def predict_many(self, observations):
+        """[(disease, risk level)] for many observations, scored in one batch per ensemble.
+
+        Bypasses the prediction cache. Returns [] without a model.
+        """
+        import pandas as pd
+
+        bundle = self.bundle
+        if bundle is None or not observations:
+            return []
+        input_df = pd.DataFrame(observations, columns=FEATURES)
+        diseases = bundle.le_disease.inverse_transform(bundle.gb_disease.predict(input_df))
+        risks = bundle.le_risklevel.inverse_transform(bundle.gb_risk.predict(input_df))
+        return list(zip(diseases.tolist(), risks.tolist()))
+
+    def precautions_for(self, disease, risk):
+        """The 3 precautions for a disease and risk level (any level of the disease if that pair isn't listed)."""
+        bundle = self.bundle
+        if bundle is None:
+            return []
+        return _precautions(bundle.precautions, disease, risk)
+
+
+def _precautions(table, disease, risk):
+    result = table[(table['Disease_Risk'] == disease) & (table['Risk_Level'] == risk)]
+    if result.empty:
+        result = table[table['Disease_Risk'] == disease]
+    return result.iloc[0][PRECAUTION_FIELDS].tolist() if not result.empty else ["No data"] * 3
+
+
+def _signature(stat):
+    return f'{stat.st_mtime_ns}-{stat.st_size}'
+
+
+def model_from_env():
+    """HealthModel with the prediction cache configured from the environment (not loaded yet)."""
+    return HealthModel(cache=cache_from_env())
@@ -0,0 +1,381 @@
+"""Append-only store of fetched weather observations, for retraining on real conditions.
+
+Every observation fetched from OpenWeatherMap (single or group calls) is
+recorded with its canonical city. An AQI that was filled in after the AQI call
+failed (aqi_estimated) is stored as NULL, not as a reading. record() only
+queues the row; a background thread writes queued rows in batches, so the fetch
+path never waits on disk.
+
+Rows go to one SQLite file per UTC day in OBSERVATION_STORE_DIR (default
+observations/), e.g. observations-20261019.db, keyed by (city, time) (see
+aegis.segments). Days older
+than OBSERVATION_RAW_DAYS (default 7) are downsampled to one row per city and
+hour (the mean of that hour's readings). Days older than
+OBSERVATION_RETENTION_DAYS (default 365) are deleted. Maintenance runs hourly
+on the writer thread, or on demand with --maintain.
+
+The readings carry no disease outcome. training_chunks() joins them with
+reported outcomes per city and day from OBSERVATION_LABELS_FILE (a CSV with
+City, Date, Disease_Risk, Risk_Level and optionally Precaution_1..3). It yields
+chunks in the dataset's columns. With MODEL_TRAIN_OBSERVATIONS=true the model
+is trained on the dataset CSV followed by these chunks (see
+aegis.training.train_from_config).
+
+    python -m aegis.observations --cities 200 --days 30     # synthetic load + downsample/read timings
+    python -m aegis.observations --maintain                  # downsample and expire the real store
+    python -m aegis.observations --check                     # estimated AQI never reaches training
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from aegis.cities import canonical_city, city_key
+from aegis.segments import DaySegmentStore, connect, day_files, day_of
+
+STORE_DIR = os.getenv('OBSERVATION_STORE_DIR', 'observations')
+PREFIX = 'observations'
+RAW_DAYS = int(os.getenv('OBSERVATION_RAW_DAYS', '7'))
+RETENTION_DAYS = int(os.getenv('OBSERVATION_RETENTION_DAYS', '365'))
+LABELS_FILE = os.getenv('OBSERVATION_LABELS_FILE', 'observation_labels.csv')
+BATCH_SIZE = 500            # queued rows that trigger a write before the timer
+FLUSH_SECONDS = 5.0
+MAINTAIN_SECONDS = 3600
+COLUMNS = ('Temperature', 'Humidity', 'AQI', 'Rainfall', 'WindSpeed', 'Pressure')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS observations (
+    city TEXT NOT NULL, ts INTEGER NOT NULL, temperature REAL, humidity REAL, aqi REAL, rainfall REAL,
+    wind_speed REAL, pressure REAL, samples INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (city, ts)) WITHOUT ROWID;
+"""
+_FIELDS = 'temperature, humidity, aqi, rainfall, wind_speed, pressure'
+
+
+def _partitions(store_dir):
+    """[(day, path)] of the store's partitions, oldest first."""
+    return day_files(store_dir, PREFIX)
+
+
+class ObservationStore(DaySegmentStore):
+    """Queues observations and writes them in batches on a background thread; maintains the store hourly."""
+    prefix = PREFIX
+    schema = _SCHEMA
+    thread_name = 'observation-store'
+    log_tag = 'Observations'
+
+    def __init__(self, store_dir=STORE_DIR, batch_size=BATCH_SIZE, flush_seconds=FLUSH_SECONDS, clock=time.time):
+        super().__init__(store_dir, batch_size, flush_seconds, clock)
+        self._maintained_at = 0.0
+
+    def record(self, city, observation, ts=None):
+        """Queue one observation (model features) for city; returns immediately.
+
+        An estimated AQI (the last reading or the default, see aegis.weather) is stored as NULL.
+        """
+        if observation.get('aqi_estimated'):
+            observation = dict(observation, AQI=None)
+        self.enqueue((city_key(canonical_city(city)), int(self.clock() if ts is None else ts)) +
+                     tuple(observation.get(name) for name in COLUMNS))
+
+    def after_flush(self):
+        if self.clock() - self._maintained_at >= MAINTAIN_SECONDS:
+            self._maintained_at = self.clock()
+            maintain(self.directory, now=self._maintained_at)
+
+    def row_time(self, row):
+        return row[1]
+
+    def write_day(self, conn, day, rows):
+        """Repeats of (city, ts) are ignored."""
+        conn.executemany(f'INSERT OR IGNORE INTO observations (city, ts, {_FIELDS}) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+
+def downsample(path):
+    """Replace a partition's raw rows with one row per city and hour. Returns (rows before, rows after).
+
+    Hourly rows sit on the hour and carry their sample count, so a partition
+    that received late readings after downsampling is merged again correctly.
+    A NULL field (an AQI that wasn't measured) is left out of its mean.
+    """
+    conn = connect(path)
+    try:
+        conn.executescript(_SCHEMA)
+        before = conn.execute('SELECT COUNT(*) FROM observations').fetchone()[0]
+        if not conn.execute('SELECT 1 FROM observations WHERE ts % 3600 != 0 LIMIT 1').fetchone():
+            return before, before
+        averages = ', '.join(f'SUM({name} * samples) / SUM(CASE WHEN {name} IS NOT NULL THEN samples END)'
+                             for name in _FIELDS.split(', '))
+        with conn:
+            conn.execute(f'CREATE TEMP TABLE hourly AS SELECT city, ts / 3600 * 3600 AS hour, {averages}, '
+                         'SUM(samples) FROM observations GROUP BY city, hour')
+            conn.execute('DELETE FROM observations')
+            conn.execute('INSERT INTO observations SELECT * FROM hourly')
+        after = conn.execute('SELECT COUNT(*) FROM observations').fetchone()[0]
+        conn.execute('VACUUM')
+        return before, after
+    finally:
+        conn.close()
+
+
+def maintain(store_dir=STORE_DIR, raw_days=RAW_DAYS, retention_days=RETENTION_DAYS, now=None):
+    """Downsample partitions older than raw_days and delete those older than retention_days.
+
+    Returns {'downsampled', 'deleted'} partition counts.
+    """
+    now = time.time() if now is None else now
+    raw_cutoff = day_of(now - raw_days * 86400)
+    keep_cutoff = day_of(now - retention_days * 86400)
+    downsampled = deleted = 0
+    for day, path in _partitions(store_dir):
+        if day < keep_cutoff:
+            for suffix in ('', '-wal', '-shm'):
+                try:
+                    os.remove(path + suffix)
+                except OSError:
+                    pass
+            deleted += 1
+        elif day < raw_cutoff:
+            before, after = downsample(path)
+            if after < before:
+                downsampled += 1
+    if downsampled or deleted:
+        print(f"[Observations] Downsampled {downsampled} and deleted {deleted} day partitions")
+    return {'downsampled': downsampled, 'deleted': deleted}
+
+
+def iter_observations(store_dir=STORE_DIR, since=None, until=None, cities=None, chunksize=50000):
+    """Yield DataFrame chunks of stored observations (columns ts, City and the model features), oldest day first."""
+    import pandas as pd
+
+    keys = [city_key(canonical_city(city)) for city in cities] if cities else None
+    where, params = [], []
+    if since is not None:
+        where.append('ts >= ?')
+        params.append(int(since))
+    if until is not None:
+        where.append('ts < ?')
+        params.append(int(until))
+    if keys:
+        where.append(f"city IN ({', '.join('?' * len(keys))})")
+        params.extend(keys)
+    sql = f"SELECT ts, city, {_FIELDS} FROM observations"
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    for _, path in day_files(store_dir, PREFIX, since, until):
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, timeout=30)
+        try:
+            cursor = conn.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(chunksize)
+                if not rows:
+                    break
+                yield pd.DataFrame(rows, columns=['ts', 'City'] + list(COLUMNS))
+        except sqlite3.OperationalError as e:
+            print(f"[Observations] Skipping {path}: {e}")
+        finally:
+            conn.close()
+
+
+def load_labels(labels_file=LABELS_FILE):
+    """Reported outcomes {(city key, 'YYYY-MM-DD'): (disease, risk, p1, p2, p3)}, or {} without a labels file."""
+    import pandas as pd
+
+    if not os.path.exists(labels_file):
+        return {}
+    labels = {}
+    for row in pd.read_csv(labels_file, dtype=str).fillna('').to_dict('records'):
+        if not (row.get('City') and row.get('Date') and row.get('Disease_Risk') and row.get('Risk_Level')):
+            continue
+        precautions = tuple(row.get(f'Precaution_{i}') or 'No data' for i in (1, 2, 3))
+        labels[(city_key(canonical_city(row['City'])), row['Date'][:10])] = \
+            (row['Disease_Risk'], row['Risk_Level']) + precautions
+    return labels
+
+
+def training_chunks(store_dir=STORE_DIR, labels_file=LABELS_FILE, since=None, chunksize=50000):
+    """Yield stored observations that have a reported outcome, in the training dataset's columns.
+
+    Each observation is matched to its city's label for that local day (ALERT_TIMEZONE).
+    Observations without a measured AQI are left out.
+    """
+    from aegis.scheduler import ALERT_TIMEZONE
+    from aegis.training import PRECAUTION_COLUMNS
+    import pandas as pd
+
+    labels = load_labels(labels_file)
+    if not labels:
+        return
+    for chunk in iter_observations(store_dir, since=since, chunksize=chunksize):
+        chunk = chunk.dropna(subset=['AQI'])
+        if chunk.empty:
+            continue
+        when = pd.to_datetime(chunk['ts'], unit='s', utc=True)
+        try:
+            when = when.dt.tz_convert(ALERT_TIMEZONE)
+        except Exception:
+            pass
+        matched = [labels.get(key) for key in zip(chunk['City'], when.dt.strftime('%Y-%m-%d'))]
+        keep = [label is not None for label in matched]
+        if not any(keep):
+            continue
+        chunk = chunk.loc[keep].drop(columns='ts').reset_index(drop=True)
+        outcomes = pd.DataFrame([label for label in matched if label is not None], columns=PRECAUTION_COLUMNS)
+        yield pd.concat([chunk, outcomes], axis=1)
+
+
+def store_stats(store_dir=STORE_DIR):
+    """Partition count, size on disk and rows per resolution, for the admin pages."""
+    partitions = _partitions(store_dir)
+    raw = hourly = size = 0
+    for _, path in partitions:
+        size += sum(os.path.getsize(path + suffix) for suffix in ('', '-wal') if os.path.exists(path + suffix))
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, timeout=30)
+        try:
+            # Downsampled rows sit on the hour
+            count, on_hour = conn.execute('SELECT COUNT(*), TOTAL(ts % 3600 = 0) FROM observations').fetchone()
+        except sqlite3.OperationalError:
+            continue
+        finally:
+            conn.close()
+        hourly += int(on_hour)
+        raw += count - int(on_hour)
+    return {'partitions': len(partitions), 'first_day': partitions[0][0] if partitions else None,
+            'last_day': partitions[-1][0] if partitions else None, 'raw_rows': raw, 'hourly_rows': hourly,
+            'size_mib': round(size / 2 ** 20, 2), 'raw_days': RAW_DAYS, 'retention_days': RETENTION_DAYS,
+            'written_here': _store.written if _store is not None else 0}
+
+
+def check():
+    """Record a measured and an estimated reading of one city into a temporary store. Verify that
+    only the measured AQI is stored, averaged and trained on. Returns a list of failures."""
+    import shutil
+    import tempfile
+
+    directory = tempfile.mkdtemp(prefix='aegis-observations-check-')
+    failures = []
+    try:
+        ts = int(time.time()) // 3600 * 3600
+        store = ObservationStore(directory)
+        reading = {'Temperature': 30.0, 'Humidity': 70, 'AQI': 150, 'Rainfall': 0.5, 'WindSpeed': 3.0, 'Pressure': 1008}
+        store.record('Pune', reading, ts=ts)
+        store.record('Pune', dict(reading, AQI=100, aqi_estimated=True), ts=ts + 60)
+        store.flush()
+
+        stored = [aqi for chunk in iter_observations(directory) for aqi in chunk['AQI'].tolist()]
+        if len(stored) != 2 or stored[0] != 150 or stored[1] == stored[1]:  # NaN for NULL
+            failures.append(f"expected stored AQI [150, NULL], got {stored}")
+
+        labels_file = os.path.join(directory, 'labels.csv')
+        with open(labels_file, 'w') as file:
+            file.write('City,Date,Disease_Risk,Risk_Level\n')
+            for offset in (-1, 0, 1):  # the local day of ts in any ALERT_TIMEZONE
+                day = time.strftime('%Y-%m-%d', time.gmtime(ts + offset * 86400))
+                file.write(f'Pune,{day},Asthma,High\n')
+        trained = [aqi for chunk in training_chunks(directory, labels_file) for aqi in chunk['AQI'].tolist()]
+        if trained != [150]:
+            failures.append(f"expected training rows with AQI [150], got {trained}")
+
+        for _, path in _partitions(directory):
+            downsample(path)
+        hourly = [aqi for chunk in iter_observations(directory) for aqi in chunk['AQI'].tolist()]
+        if hourly != [150]:
+            failures.append(f"expected the hourly mean AQI [150], got {hourly}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return failures
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def observation_store():
+    """The process-wide store (created on first use), or None if OBSERVATION_STORE_DIR is empty."""
+    global _store
+    if not STORE_DIR:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = ObservationStore()
+        return _store
+
+
+if __name__ == '__main__':
+    import argparse
+    import random
+    import shutil
+    import tempfile
+
+    parser = argparse.ArgumentParser(description='Load the observation store with synthetic readings and time it')
+    parser.add_argument('--cities', type=int, default=200)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--interval', type=int, default=300, help='seconds between readings of a city')
+    parser.add_argument('--dir', help='store directory (default: a temporary one, removed afterwards)')
+    parser.add_argument('--maintain', action='store_true', help='only downsample and expire the store in --dir')
+    parser.add_argument('--check', action='store_true', help='fail if an estimated AQI is stored or trained on')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    if args.check:
+        failures = check()
+        for failure in failures:
+            print(f"FAIL {failure}")
+        if not failures:
+            print("OK: estimated AQI is stored as NULL and left out of hourly means and training")
+        raise SystemExit(1 if failures else 0)
+
+    if args.maintain:
+        print(maintain(args.dir or STORE_DIR))
+        print(store_stats(args.dir or STORE_DIR))
+        raise SystemExit(0)
+
+    store_dir = args.dir or tempfile.mkdtemp(prefix='aegis-observations-')
+    rng = random.Random(args.seed)
+    cities = ['Pune', 'Mumbai', 'Delhi', 'Chennai'] + [f'City {i:03d}' for i in range(args.cities - 4)]
+    end = time.time()
+    start = end - args.days * 86400
+    store = ObservationStore(store_dir)
+
+    # Queueing cost, as seen by the fetch path
+    sample = {'Temperature': 30.0, 'Humidity': 70, 'AQI': 120, 'Rainfall': 0.5, 'WindSpeed': 3.0, 'Pressure': 1008}
+    started = time.perf_counter()
+    for i in range(10000):
+        store.record(cities[i % len(cities)], sample, ts=end - 10000 + i)
+    record_us = (time.perf_counter() - started) / 10000 * 1e6
+    store.flush()
+
+    rows = 0
+    started = time.perf_counter()
+    batch = []
+    for step in range(int(args.days * 86400 / args.interval)):
+        ts = start + step * args.interval
+        for city in cities:
+            batch.append((city_key(city), int(ts), round(rng.uniform(15, 42), 1), rng.randint(20, 100),
+                          rng.randint(20, 400), round(rng.expovariate(2), 1), round(rng.uniform(0, 15), 1),
+                          rng.randint(990, 1020)))
+        if len(batch) >= 100000:
+            store.write(batch)
+            rows += len(batch)
+            batch = []
+    store.write(batch)
+    rows += len(batch)
+    write_seconds = time.perf_counter() - started
+    before = store_stats(store_dir)
+    print(f"record(): {record_us:.1f} us per observation (queue only)")
+    print(f"Wrote {rows} readings ({args.cities} cities every {args.interval}s for {args.days} days) in "
+          f"{write_seconds:.1f} s ({rows / write_seconds:.0f} rows/s), {before['size_mib']} MiB")
+
+    started = time.perf_counter()
+    result = maintain(store_dir, now=end)
+    after = store_stats(store_dir)
+    print(f"Downsampled {result['downsampled']} days in {time.perf_counter() - started:.1f} s: "
+          f"{before['raw_rows']} raw -> {after['raw_rows']} raw + {after['hourly_rows']} hourly rows, "
+          f"{before['size_mib']} -> {after['size_mib']} MiB")
+
+    started = time.perf_counter()
+    read = sum(len(chunk) for chunk in iter_observations(store_dir))
+    print(f"Read {read} rows in chunks in {time.perf_counter() - started:.2f} s")
+    if not args.dir:
+        shutil.rmtree(store_dir, ignore_errors=True)
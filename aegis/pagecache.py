@@ -0,0 +1,92 @@
+"""Validators and fragment caching for pages built from users.csv and the model files.
+
+DataVersion turns the files a page depends on into a version token: their
+(mtime, size) signatures, re-read at most every PAGE_VERSION_RECHECK seconds
+(default 1), or right away after invalidate() when this process wrote one of
+them. The token is the same in every gunicorn worker, so ETags from one worker
+validate in another. Pages use it for ETag/Last-Modified and answer
+If-None-Match with a 304 before loading anything; FragmentCache keeps rendered
+pieces of pages (user tables, status cards) until the version changes.
+"""
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+RECHECK_SECONDS = float(os.getenv('PAGE_VERSION_RECHECK', '1'))
+
+
+class DataVersion:
+    """Version token for a set of files, cheap enough to check on every request."""
+
+    def __init__(self, paths, recheck=RECHECK_SECONDS, clock=time.monotonic):
+        self.paths = list(paths)
+        self.recheck = recheck
+        self.clock = clock
+        self._signatures = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Re-read the signatures on the next call (after this process changed a file)."""
+        with self._lock:
+            self._checked_at = None
+
+    def signatures(self):
+        """{path: (mtime_ns, size) or None if missing}"""
+        with self._lock:
+            now = self.clock()
+            if self._checked_at is None or now - self._checked_at >= self.recheck:
+                signatures = {}
+                for path in self.paths:
+                    try:
+                        stat = os.stat(path)
+                        signatures[path] = (stat.st_mtime_ns, stat.st_size)
+                    except OSError:
+                        signatures[path] = None
+                self._signatures = signatures
+                self._checked_at = now
+            return self._signatures
+
+    def exists(self, path):
+        return self.signatures().get(path) is not None
+
+    def token(self, *extra):
+        """Short hex version of the files plus any extra values that change the output."""
+        parts = [f'{path}={signature}' for path, signature in sorted(self.signatures().items())]
+        parts.extend(str(value) for value in extra)
+        return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+    def last_modified(self):
+        """Newest modification time of the files (UTC datetime), or None if none exist."""
+        times = [signature[0] for signature in self.signatures().values() if signature is not None]
+        if not times:
+            return None
+        return datetime.fromtimestamp(max(times) // 10 ** 9, tz=timezone.utc)
+
+
+class FragmentCache:
+    """Rendered fragments keyed by name, each valid for one version token."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, name, version, render):
+        """Cached fragment for this version, or render() it and keep it until the version changes."""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        html = render()
+        with self._lock:
+            self._entries[name] = (version, html)
+        return html
+
+    def stats(self):
+        with self._lock:
+            return {'fragments': len(self._entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,49 @@
+"""Canonical E.164 phone normalization shared by every entry point."""
+
+DEFAULT_COUNTRY_CODE = '91'
+
+
+def normalize_phone(phone):
+    """Return the E.164 form of a phone number (e.g. +91XXXXXXXXXX), or None if invalid.
+
+    Accepts +91XXXXXXXXXX, 91XXXXXXXXXX, 0XXXXXXXXXX, XXXXXXXXXX, 00<cc><number>,
+    values with spaces/dashes/brackets and numbers mangled to floats by CSV tools.
+    """
+    if phone is None:
+        return None
+
+    phone_str = str(phone).strip()
+    if not phone_str or phone_str.lower() == 'nan':
+        return None
+
+    # Handle float conversion (e.g., if stored as 9123456789.0 in CSV)
+    if '.' in phone_str and 'e' not in phone_str.lower():
+        phone_str = phone_str.split('.')[0]
+
+    # Keep digits, plus a leading + only
+    has_plus = phone_str.startswith('+')
+    digits = ''.join(c for c in phone_str if c.isdigit())
+
+    if not has_plus and digits.startswith('00'):
+        # International dialling prefix: 00<cc><number>
+        has_plus = True
+        digits = digits[2:]
+
+    if has_plus:
+        if digits.startswith(DEFAULT_COUNTRY_CODE):
+            return '+' + digits if len(digits) == 12 else None
+        # Other country codes: E.164 allows at most 15 digits
+        return '+' + digits if 9 <= len(digits) <= 15 else None
+
+    if len(digits) == 10:
+        return '+' + DEFAULT_COUNTRY_CODE + digits  # XXXXXXXXXX -> +91XXXXXXXXXX
+    if len(digits) == 12 and digits.startswith(DEFAULT_COUNTRY_CODE):
+        return '+' + digits  # 91XXXXXXXXXX -> +91XXXXXXXXXX
+    if len(digits) == 11 and digits.startswith('0'):
+        return '+' + DEFAULT_COUNTRY_CODE + digits[1:]  # 0XXXXXXXXXX -> +91XXXXXXXXXX
+    return None
+
+
+def is_canonical(phone):
+    """True if phone is already stored in canonical E.164 form."""
+    return phone is not None and normalize_phone(phone) == str(phone)
@@ -0,0 +1,184 @@
+"""Optional LRU cache of model predictions keyed on quantized weather features.
+
+Weather readings repeat within small tolerances (31.2 C and 31.3 C at the same
+humidity band), so predictions are cached per bucket instead of running both
+ensembles on every call. The cache clears itself when the model version changes.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+FEATURES = ['Temperature', 'Humidity', 'AQI', 'Rainfall', 'WindSpeed', 'Pressure']
+
+# Bucket width per feature (same units as the model input)
+DEFAULT_BUCKET_WIDTHS = {
+    'Temperature': 0.5,
+    'Humidity': 5,
+    'AQI': 10,
+    'Rainfall': 1,
+    'WindSpeed': 1,
+    'Pressure': 2,
+}
+
+
+def parse_bucket_widths(spec):
+    """Parse "Temperature=0.5,Humidity=5" into a full widths dict (missing keys use defaults)."""
+    widths = dict(DEFAULT_BUCKET_WIDTHS)
+    for part in (spec or '').split(','):
+        if '=' not in part:
+            continue
+        name, value = part.split('=', 1)
+        name = name.strip()
+        if name not in widths:
+            raise ValueError(f"Unknown feature in bucket spec: {name}")
+        widths[name] = float(value)
+    return widths
+
+
+class PredictionCache:
+    """Thread-safe LRU of (disease, risk, precautions) keyed on quantized features."""
+
+    def __init__(self, maxsize=1024, bucket_widths=None):
+        self.maxsize = maxsize
+        self.bucket_widths = dict(bucket_widths or DEFAULT_BUCKET_WIDTHS)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._model_version = None
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+        self._miss_seconds = 0.0
+
+    def quantize(self, weather_data):
+        """Return (key, representative) for a weather dict.
+
+        The representative is the bucket centre, which is what the model should be
+        run on so that every reading in a bucket gets the same prediction.
+        """
+        key = []
+        representative = {}
+        for name in FEATURES:
+            width = self.bucket_widths[name]
+            bucket = int((float(weather_data[name]) // width)) if width > 0 else float(weather_data[name])
+            key.append(bucket)
+            representative[name] = (bucket + 0.5) * width if width > 0 else bucket
+        return tuple(key), representative
+
+    def _check_version(self, model_version):
+        if model_version != self._model_version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._model_version = model_version
+
+    def get_or_compute(self, weather_data, model_version, compute):
+        """Return the cached prediction for weather_data, calling compute(representative) on a miss."""
+        key, representative = self.quantize(weather_data)
+        with self._lock:
+            self._check_version(model_version)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        start = time.perf_counter()
+        result = compute(representative)
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.misses += 1
+            self._miss_seconds += elapsed
+            # Don't cache failures, and don't store results computed under an older model
+            if result[0] is not None and model_version == self._model_version:
+                self._entries[key] = result
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit-rate metrics, including the estimated model time saved by hits."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            avg_miss = self._miss_seconds / self.misses if self.misses else 0.0
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'avg_miss_ms': round(avg_miss * 1000, 3),
+                'estimated_saved_ms': round(self.hits * avg_miss * 1000, 1),
+                'model_version': self._model_version,
+                'bucket_widths': self.bucket_widths,
+            }
+
+
+def cache_from_env():
+    """Build a PredictionCache from PREDICTION_CACHE* env vars, or None when disabled."""
+    if os.environ.get('PREDICTION_CACHE', 'false').lower() not in ('1', 'true', 'yes'):
+        return None
+    return PredictionCache(
+        maxsize=int(os.environ.get('PREDICTION_CACHE_SIZE', '1024')),
+        bucket_widths=parse_bucket_widths(os.environ.get('PREDICTION_CACHE_BUCKETS', '')),
+    )
+
+
+def replay_benchmark(predict, rows, cache, jitter=0.2, repeats=5, seed=42):
+    """Replay weather rows (with small jitter) through predict with and without the cache.
+
+    predict(weather_dict) -> (disease, risk, precautions). Returns timing and hit-rate stats.
+    """
+    import random
+    rng = random.Random(seed)
+    traffic = []
+    for _ in range(repeats):
+        for row in rows:
+            traffic.append({name: float(row[name]) + rng.uniform(-jitter, jitter) for name in FEATURES})
+
+    start = time.perf_counter()
+    for weather in traffic:
+        predict(weather)
+    uncached = time.perf_counter() - start
+
+    cache.clear()
+    start = time.perf_counter()
+    for weather in traffic:
+        cache.get_or_compute(weather, 'benchmark', predict)
+    cached = time.perf_counter() - start
+
+    return {
+        'requests': len(traffic),
+        'uncached_ms_per_request': round(uncached / len(traffic) * 1000, 3),
+        'cached_ms_per_request': round(cached / len(traffic) * 1000, 3),
+        'speedup': round(uncached / cached, 2) if cached else None,
+        'cache': cache.stats(),
+    }
+
+
+if __name__ == '__main__':
+    # Replay the training dataset as traffic: python -m aegis.prediction_cache [rows]
+    import pickle
+    import sys
+    import pandas as pd
+
+    with open('health_model.pkl', 'rb') as file:
+        bundle = pickle.load(file)
+
+    def predict(weather):
+        input_df = pd.DataFrame([weather], columns=FEATURES)
+        disease = bundle['le_disease'].inverse_transform(bundle['gb_disease'].predict(input_df))[0]
+        risk = bundle['le_risklevel'].inverse_transform(bundle['gb_risk'].predict(input_df))[0]
+        return disease, risk, []
+
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    rows = pd.read_csv('climate_health_precaution_dataset_500.csv', nrows=limit).to_dict('records')
+    cache = PredictionCache(bucket_widths=parse_bucket_widths(os.environ.get('PREDICTION_CACHE_BUCKETS', '')))
+    for key, value in replay_benchmark(predict, rows, cache).items():
+        print(f"{key}: {value}")
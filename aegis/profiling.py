@@ -0,0 +1,238 @@
+"""Opt-in cProfile capture of a single request or alert cycle, for admins.
+
+An admin adds ?profile=1 (or the X-Aegis-Profile: 1 header) to a request; that
+request runs under cProfile, together with the work it hands to other threads
+through follow() (the dispatcher's senders, the AQI fetches on the weather
+pool). Other threads, including pool threads created during the capture, are
+never profiled. The result is written to PROFILE_DIR (default
+profiles/) as a .pstats file plus a .txt summary, and only the newest
+PROFILE_KEEP runs are kept. With the flag absent nothing is installed, so
+normal requests pay nothing.
+
+Open a .pstats file with `python -m pstats`, snakeviz or gprof2dot.
+
+    python -m aegis.profiling --check   # no profiler is left behind in any thread
+"""
+import cProfile
+import functools
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '50'))
+PROFILE_HEADER = 'X-Aegis-Profile'
+SUMMARY_LINES = 40
+
+_NAME = re.compile(r'^[0-9]{8}-[0-9]{6}-[0-9]{3}-[a-z0-9_]+$')
+# Only one capture at a time, so a saved profile covers a single request or cycle
+_capture_lock = threading.Lock()
+_active = threading.local()  # .capture while the thread runs a capture
+
+
+def requested(args, headers):
+    """Whether a request asks to be profiled (query flag or header)."""
+    return args.get('profile') in ('1', 'true') or headers.get(PROFILE_HEADER) in ('1', 'true')
+
+
+def follow(func):
+    """func wrapped to run under the calling thread's capture, for a thread target or pool task it hands off.
+
+    Outside a capture func is returned unchanged.
+    """
+    capture = getattr(_active, 'capture', None)
+    return func if capture is None else capture.wrap(func)
+
+
+class _Capture:
+    """cProfile for the calling thread and for the functions it hands off with follow().
+
+    Every profiler is enabled and disabled on its own thread, so none outlives
+    the call it covers.
+    """
+
+    def __init__(self):
+        self.profiles = []  # finished profiles only
+        self._lock = threading.Lock()
+
+    def _profiled(self, func, *args, **kwargs):
+        if sys.getprofile() is not None:
+            return func(*args, **kwargs)  # already profiled (called inline on a profiled thread)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            with self._lock:
+                self.profiles.append(profile)
+
+    def wrap(self, func):
+        @functools.wraps(func)
+        def profiled(*args, **kwargs):
+            return self._profiled(func, *args, **kwargs)
+        return profiled
+
+    def run(self, func, *args, **kwargs):
+        _active.capture = self
+        try:
+            return self._profiled(func, *args, **kwargs)
+        finally:
+            _active.capture = None
+
+    def stats(self):
+        """Merged stats of the profiles finished so far (hand-offs still running are left out)."""
+        stream = io.StringIO()
+        with self._lock:
+            profiles = list(self.profiles)
+        stats = None
+        for profile in profiles:
+            try:
+                if stats is None:
+                    stats = pstats.Stats(profile, stream=stream)
+                else:
+                    stats.add(profile)
+            except TypeError:
+                continue  # a thread that never got to record anything
+        return stats, stream
+
+
+def profile_call(label, func, *args, profile_dir=PROFILE_DIR, **kwargs):
+    """Run func(*args, **kwargs) under the profiler and save the result. Returns func's result.
+
+    If another capture is already running, func runs unprofiled.
+    """
+    if not _capture_lock.acquire(blocking=False):
+        print(f"[Profile] Another capture is running; {label} not profiled")
+        return func(*args, **kwargs)
+    capture = _Capture()
+    started = time.perf_counter()
+    try:
+        return capture.run(func, *args, **kwargs)
+    finally:
+        seconds = time.perf_counter() - started
+        _capture_lock.release()
+        try:
+            save(capture, label, seconds, profile_dir)
+        except Exception as e:
+            print(f"[Profile] Could not save profile for {label}: {e}")
+
+
+def save(capture, label, seconds, profile_dir=PROFILE_DIR):
+    stats, stream = capture.stats()
+    if stats is None:
+        return None
+    os.makedirs(profile_dir, exist_ok=True)
+    now = datetime.now()
+    slug = re.sub(r'[^a-z0-9_]+', '_', label.lower()).strip('_') or 'run'
+    name = f"{now.strftime('%Y%m%d-%H%M%S')}-{now.microsecond // 1000:03d}-{slug}"
+    stats.dump_stats(os.path.join(profile_dir, name + '.pstats'))
+    stream.write(f"{label}: {seconds * 1000:.1f} ms wall, {len(capture.profiles)} profiled call(s)\n\n")
+    stats.sort_stats('cumulative').print_stats(SUMMARY_LINES)
+    with open(os.path.join(profile_dir, name + '.txt'), 'w') as file:
+        file.write(stream.getvalue())
+    _prune(profile_dir)
+    print(f"[Profile] {label}: {seconds * 1000:.1f} ms, saved {name}.pstats")
+    return name
+
+
+def _prune(profile_dir, keep=PROFILE_KEEP):
+    for name in [entry['name'] for entry in list_profiles(profile_dir)][keep:]:
+        for suffix in ('.pstats', '.txt'):
+            try:
+                os.remove(os.path.join(profile_dir, name + suffix))
+            except OSError:
+                pass
+
+
+def list_profiles(profile_dir=PROFILE_DIR):
+    """Saved profiles, newest first: [{'name', 'label', 'created', 'summary' (first line)}]."""
+    if not os.path.isdir(profile_dir):
+        return []
+    entries = []
+    for filename in os.listdir(profile_dir):
+        name, ext = os.path.splitext(filename)
+        if ext != '.pstats' or not _NAME.match(name):
+            continue
+        summary = ''
+        try:
+            with open(os.path.join(profile_dir, name + '.txt')) as file:
+                summary = file.readline().strip()
+        except OSError:
+            pass
+        created = datetime.strptime(name[:19], '%Y%m%d-%H%M%S-%f')
+        entries.append({'name': name, 'label': name[20:], 'created': created.strftime('%Y-%m-%d %H:%M:%S'),
+                        'summary': summary})
+    return sorted(entries, key=lambda entry: entry['name'], reverse=True)
+
+
+def profile_path(name, ext, profile_dir=PROFILE_DIR):
+    """Path of a saved profile file, or None for a name that isn't one."""
+    if ext not in ('.pstats', '.txt') or not _NAME.match(name or ''):
+        return None
+    path = os.path.join(profile_dir, name + ext)
+    return path if os.path.exists(path) else None
+
+
+def check(profile_dir):
+    """Profile a call that hands work to a dispatcher and to a pool created during the capture,
+    then verify no thread is left with a profiler. Returns a list of failures."""
+    from concurrent.futures import ThreadPoolExecutor
+    from aegis.dispatch import Dispatcher
+
+    pool = []
+    seen = []
+
+    def handed_off(n):
+        seen.append(sys.getprofile() is not None)
+        return sum(i * i for i in range(n))
+
+    def request():
+        pool.append(ThreadPoolExecutor(max_workers=2, thread_name_prefix='check-pool'))  # created lazily, as _io_pool is
+        futures = [pool[0].submit(follow(handed_off), 20000) for _ in range(4)]
+        jobs = [{'phone': f'+9190000000{i}', 'message': 'check', 'risk': 'High'} for i in range(4)]
+        Dispatcher(lambda phone, message: handed_off(20000) and 'SM0', workers=2).dispatch(jobs)
+        return [future.result() for future in futures]
+
+    profile_call('profiling check', request, profile_dir=profile_dir)
+    failures = []
+    if not seen or not all(seen):
+        failures.append(f"hand-offs ran unprofiled during the capture ({seen.count(False)} of {len(seen)})")
+    after = [pool[0].submit(sys.getprofile).result() for _ in range(8)]
+    if any(profiler is not None for profiler in after):
+        failures.append("a pool thread created during the capture is still profiled")
+    if sys.getprofile() is not None:
+        failures.append("the capturing thread is still profiled")
+    leftover = threading.Thread(target=lambda: after.append(sys.getprofile()))
+    leftover.start()
+    leftover.join()
+    if after[-1] is not None:
+        failures.append("a thread started after the capture is profiled")
+    saved = list_profiles(profile_dir)
+    if not saved or '7 profiled call(s)' not in saved[0]['summary']:  # request, 4 pool tasks, 2 senders
+        failures.append(f"expected 7 profiled calls in the summary, got {saved[0]['summary'] if saved else 'no profile'}")
+    pool[0].shutdown()
+    return failures
+
+
+if __name__ == '__main__':
+    import argparse
+    import tempfile
+    parser = argparse.ArgumentParser(description='Self-check of the request profiler')
+    parser.add_argument('--check', action='store_true', help='fail if a profiler outlives its capture')
+    args = parser.parse_args()
+    if not args.check:
+        parser.error('nothing to do; use --check')
+    from aegis import profiling  # the module the dispatcher's follow() uses, not this __main__ copy
+    with tempfile.TemporaryDirectory() as directory:
+        failures = profiling.check(directory)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if not failures:
+        print("OK: only the captured call and its hand-offs were profiled, and no profiler was left behind")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,240 @@
+"""Materialized per-city risk: the latest weather and prediction for every registered city.
+
+A background refresher rebuilds the view every RISK_VIEW_REFRESH_SECONDS
+(default 300). Each refresh makes one batched weather fetch for all registered
+cities and one prediction per city. /predict, single sends and alert cycles
+read a city's row from a dict instead of calling OpenWeatherMap and the model
+inline. A city is computed live only in two cases:
+- it isn't in the view yet (it then joins the view);
+- its row is older than RISK_VIEW_MAX_AGE_SECONDS (default 1800), for
+  example because the refresher died.
+Only registered cities are refreshed. A row for any other city (an ad-hoc
+lookup, a typo, a city whose users left) is dropped once it is older than
+RISK_VIEW_MAX_AGE_SECONDS, so the view and its file stay bounded.
+
+The view is also written to RISK_VIEW_FILE (default risk_view.json), so the
+gunicorn workers and the alert worker share one refresh. A process that finds
+a fresh enough file loads it instead of fetching again. Sharded workers keep
+their own view of their own cities (path=None).
+"""
+import json
+import os
+import random
+import threading
+import time
+
+from aegis.cities import canonical_city, city_key
+from aegis.weather import fetch_weather_for_cities, fetch_weather_for_city
+
+VIEW_FILE = os.getenv('RISK_VIEW_FILE', 'risk_view.json')
+REFRESH_SECONDS = float(os.getenv('RISK_VIEW_REFRESH_SECONDS', '300'))
+MAX_AGE_SECONDS = float(os.getenv('RISK_VIEW_MAX_AGE_SECONDS', '1800'))
+
+
+class RiskView:
+    """city -> {'city', 'weather', 'disease', 'risk', 'precautions', 'computed_at'}, kept fresh in the background.
+
+    cities() returns the registered city names to keep in the view.
+    """
+
+    def __init__(self, model, cities, path=VIEW_FILE, refresh_seconds=REFRESH_SECONDS, max_age=MAX_AGE_SECONDS,
+                 fetch_many=fetch_weather_for_cities, fetch_one=fetch_weather_for_city, clock=time.time):
+        self.model = model
+        self.cities = cities
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self.max_age = max_age
+        self.fetch_many = fetch_many
+        self.fetch_one = fetch_one
+        self.clock = clock
+        self.refreshed_at = None
+        self.refresh_seconds_taken = None
+        self.hits = self.misses = self.refreshes = self.loads = 0
+        self._rows = {}         # city_key -> row
+        self._versions = {}     # city_key -> model.version the row's prediction came from
+        self._file_mtime = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Start the refresher thread (once)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='risk-view', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh_if_due()
+            except Exception as e:
+                print(f"[RiskView] Refresh failed: {e}")
+            # Jitter so processes that share the file don't all refresh in the same second
+            time.sleep(max(1.0, self._seconds_until_due()) + random.uniform(0, 2))
+
+    def _seconds_until_due(self):
+        if self.refreshed_at is None:
+            return 0.0
+        return self.refreshed_at + self.refresh_seconds - self.clock()
+
+    def refresh_if_due(self):
+        """Load a fresher view another process wrote, or recompute it once the view is old enough."""
+        self._load_file()
+        if self._seconds_until_due() <= 0:
+            self.refresh()
+
+    def refresh(self):
+        """Fetch weather for every registered city in one batch and predict each. Returns the row count."""
+        if not self.model.ensure_loaded():
+            print("[RiskView] Model not loaded, skipping refresh")
+            return 0
+        started = time.perf_counter()
+        cities = list(dict.fromkeys(canonical_city(city) for city in self.cities() if city))
+        self._expire({city_key(city) for city in cities})
+        if not cities:
+            return 0  # nothing registered (or synced) yet; try again shortly
+        weather_by_city = self.fetch_many(cities)
+        version = self.model.version  # read before scoring, so a swap mid-refresh only causes a re-score
+        rows = {}
+        for city in cities:
+            row = self._compute(city, weather_by_city.get(city))
+            if row is not None:
+                rows[city_key(city)] = row
+        now = self.clock()
+        with self._lock:
+            for key, row in rows.items():
+                self._rows[key] = row
+                self._versions[key] = version
+            self.refreshed_at = now
+        self.refreshes += 1
+        self.refresh_seconds_taken = round(time.perf_counter() - started, 3)
+        self._save_file()
+        print(f"[RiskView] Refreshed {len(rows)}/{len(cities)} cities in {self.refresh_seconds_taken}s")
+        return len(rows)
+
+    def _expire(self, registered):
+        """Drop rows of unregistered cities that are too old to be served."""
+        cutoff = self.clock() - self.max_age
+        with self._lock:
+            expired = [key for key, row in self._rows.items() if key not in registered and row['computed_at'] < cutoff]
+            for key in expired:
+                del self._rows[key]
+                self._versions.pop(key, None)
+
+    def _compute(self, city, weather):
+        if not weather:
+            return None
+        try:
+            disease, risk, precautions = self.model.predict(weather)
+        except Exception as e:
+            print(f"[RiskView] Prediction failed for {city}: {e}")
+            return None
+        if disease is None:
+            return None
+        return {'city': city, 'weather': weather, 'disease': disease, 'risk': risk,
+                'precautions': list(precautions), 'computed_at': self.clock()}
+
+    def get(self, city):
+        """The city's row if the view has a recent one, else None. Never calls upstream."""
+        key = city_key(city)
+        with self._lock:
+            row = self._rows.get(key)
+            version = self._versions.get(key)
+        if row is None or self.clock() - row['computed_at'] > self.max_age:
+            return None
+        if version != self.model.version:
+            self.model.ensure_loaded()  # rows loaded from the file carry the writer's model version
+        if version != self.model.version:
+            # Scored by another model file (retrained since): re-score the stored weather, no upstream call
+            version = self.model.version
+            updated = self._compute(row['city'], row['weather'])
+            if updated is None:
+                return None
+            updated['computed_at'] = row['computed_at']
+            with self._lock:
+                self._rows[key] = row = updated
+                self._versions[key] = version
+        return row
+
+    def lookup(self, city):
+        """The city's row, computed live (and added to the view) if it isn't in the view. None on failure."""
+        row = self.get(city)
+        if row is not None:
+            self.hits += 1
+            return row
+        self.misses += 1
+        if not self.model.ensure_loaded():
+            return None
+        city = canonical_city(city)
+        version = self.model.version
+        row = self._compute(city, self.fetch_one(city))
+        if row is not None:
+            with self._lock:
+                self._rows[city_key(city)] = row
+                self._versions[city_key(city)] = version
+        return row
+
+    def _save_file(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {'refreshed_at': self.refreshed_at, 'rows': list(self._rows.values()),
+                    'model_versions': dict(self._versions)}
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w') as file:
+                json.dump(data, file)
+            os.replace(tmp_path, self.path)
+            self._file_mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            print(f"[RiskView] Could not save {self.path}: {e}")
+
+    def _load_file(self):
+        if not self.path:
+            return
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._file_mtime:
+            return
+        try:
+            with open(self.path) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return
+        self._file_mtime = mtime
+        if not data.get('refreshed_at') or (self.refreshed_at and data['refreshed_at'] <= self.refreshed_at):
+            return
+        cutoff = self.clock() - self.max_age
+        with self._lock:
+            for row in data.get('rows', []):
+                if row['computed_at'] < cutoff:
+                    continue  # too old to serve; a registered city is refetched by the next refresh
+                key = city_key(row['city'])
+                current = self._rows.get(key)
+                if current is None or row['computed_at'] > current['computed_at']:
+                    self._rows[key] = row
+                    # A row scored by another model file is re-scored on read
+                    self._versions[key] = data.get('model_versions', {}).get(key)
+            self.refreshed_at = data['refreshed_at']
+        self.loads += 1
+
+    def stats(self):
+        with self._lock:
+            rows = list(self._rows.values())
+        now = self.clock()
+        ages = [now - row['computed_at'] for row in rows]
+        return {
+            'cities': len(rows),
+            'refreshed_seconds_ago': round(now - self.refreshed_at) if self.refreshed_at else None,
+            'oldest_row_seconds': round(max(ages)) if ages else None,
+            'last_refresh_seconds': self.refresh_seconds_taken,
+            'refreshes': self.refreshes,
+            'loaded_from_file': self.loads,
+            'hits': self.hits,
+            'misses': self.misses,
+            'refresh_interval_seconds': self.refresh_seconds,
+            'max_age_seconds': self.max_age,
+        }
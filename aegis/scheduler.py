@@ -0,0 +1,260 @@
+"""Heap-based alert scheduler with per-user cadence, jitter and catch-up.
+
+Each user's cadence is 'hourly', '<N>h' (every N hours) or 'daily@HH:MM' (local
+time, ALERT_TIMEZONE). Instead of sending to everyone on the hour, every user
+gets a stable offset inside their interval (derived from the phone number), so
+sends are spread evenly across the window. Daily sends are spread over
+ALERT_DAILY_JITTER_MINUTES after the chosen time.
+
+Last-sent times are persisted, so after a restart or a long cycle each user
+with a missed tick gets one catch-up send (not one per missed tick), spread
+over ALERT_CATCHUP_SPREAD_SECONDS.
+"""
+import heapq
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+
+DEFAULT_CADENCE = 'hourly'
+SCHEDULE_STATE_FILE = os.getenv('ALERT_SCHEDULE_FILE', 'alert_schedule.json')
+ALERT_TIMEZONE = os.getenv('ALERT_TIMEZONE', 'Asia/Kolkata')
+DAILY_JITTER_SECONDS = int(os.getenv('ALERT_DAILY_JITTER_MINUTES', '15')) * 60
+CATCHUP_SPREAD_SECONDS = int(os.getenv('ALERT_CATCHUP_SPREAD_SECONDS', '300'))
+
+_INTERVAL_RE = re.compile(r'^(\d{1,2})h$')
+_DAILY_RE = re.compile(r'^daily@([01]\d|2[0-3]):([0-5]\d)$')
+
+
+def parse_cadence(cadence):
+    """Validate a cadence string. Returns ('interval', seconds) or ('daily', (hour, minute)); raises ValueError."""
+    value = str(cadence or DEFAULT_CADENCE).strip().lower()
+    if value == 'hourly':
+        return 'interval', 3600
+    match = _INTERVAL_RE.match(value)
+    if match and 1 <= int(match.group(1)) <= 24:
+        return 'interval', int(match.group(1)) * 3600
+    match = _DAILY_RE.match(value)
+    if match:
+        return 'daily', (int(match.group(1)), int(match.group(2)))
+    raise ValueError(f"Invalid cadence '{cadence}'. Use hourly, <N>h or daily@HH:MM")
+
+
+def describe_cadence(cadence):
+    """Human-readable cadence for templates."""
+    try:
+        kind, value = parse_cadence(cadence)
+    except ValueError:
+        return 'Hourly'
+    if kind == 'daily':
+        return f'Daily at {value[0]:02d}:{value[1]:02d}'
+    return 'Hourly' if value == 3600 else f'Every {value // 3600} hours'
+
+
+def _stable_fraction(phone, salt=''):
+    """Deterministic value in [0, 1) for spreading a user's sends."""
+    return zlib.crc32(f'{salt}{phone}'.encode('utf-8')) / 2 ** 32
+
+
+def _timezone():
+    try:
+        from zoneinfo import ZoneInfo
+        return ZoneInfo(ALERT_TIMEZONE)
+    except Exception:
+        return None
+
+
+def next_slot(phone, cadence, after):
+    """First scheduled send time for this user strictly after `after` (epoch seconds)."""
+    kind, value = parse_cadence(cadence)
+    if kind == 'interval':
+        offset = _stable_fraction(phone) * value
+        slot = (after - offset) // value * value + offset
+        while slot <= after:
+            slot += value
+        return slot
+
+    hour, minute = value
+    tz = _timezone()
+    jitter = _stable_fraction(phone, 'daily') * DAILY_JITTER_SECONDS
+    day = datetime.fromtimestamp(after, tz).replace(hour=hour, minute=minute, second=0, microsecond=0)
+    slot = day.timestamp() + jitter
+    while slot <= after:
+        day = day + timedelta(days=1)
+        slot = day.timestamp() + jitter
+    return slot
+
+
+class AlertScheduler:
+    """Min-heap of (due time, phone) with lazily discarded stale entries.
+
+    Last-sent times live in state_file, or in state_store when several workers
+    share users (anything with load(phones) -> {phone: ts} and save({phone: ts})).
+    """
+
+    def __init__(self, state_file=SCHEDULE_STATE_FILE, clock=time.time, state_store=None):
+        self.state_file = state_file
+        self.state_store = state_store
+        self.clock = clock
+        self._heap = []
+        self._due = {}        # phone -> due time currently scheduled
+        self._cadence = {}    # phone -> cadence
+        self._users = {}      # phone -> user row (dict)
+        self._unsaved = set()
+        self._last_sent = {} if state_store is not None else self._load_state()
+        self._lock = threading.Lock()
+
+    def _load_state(self):
+        try:
+            with open(self.state_file) as file:
+                return {phone: float(ts) for phone, ts in json.load(file).items()}
+        except (OSError, ValueError):
+            return {}
+
+    def save_state(self):
+        if self.state_store is not None:
+            with self._lock:
+                changes = {phone: self._last_sent[phone] for phone in self._unsaved}
+                self._unsaved.clear()
+            if changes:
+                self.state_store.save(changes)
+            return
+        with self._lock:
+            snapshot = {phone: ts for phone, ts in self._last_sent.items() if phone in self._users}
+        try:
+            tmp_path = f'{self.state_file}.tmp'
+            with open(tmp_path, 'w') as file:
+                json.dump(snapshot, file)
+            os.replace(tmp_path, self.state_file)
+        except OSError as e:
+            print(f"[Scheduler] Could not save schedule state: {e}")
+
+    def _first_due(self, phone, cadence, now):
+        last = self._last_sent.get(phone)
+        if last is None:
+            return next_slot(phone, cadence, now)
+        due = next_slot(phone, cadence, last)
+        if due <= now:
+            # Missed tick(s): one catch-up send, spread so restarts don't burst
+            return now + _stable_fraction(phone, 'catchup') * CATCHUP_SPREAD_SECONDS
+        return due
+
+    def _push(self, phone, due):
+        self._due[phone] = due
+        heapq.heappush(self._heap, (due, phone))
+
+    def sync_users(self, users):
+        """Schedule new users, reschedule cadence changes and drop removed users.
+
+        users: iterable of dicts with at least 'phone' and optionally 'cadence'.
+        """
+        now = self.clock()
+        current = {}
+        for user in users:
+            current[user['phone']] = dict(user)
+        if self.state_store is not None:
+            # Users handed over from another worker: pick up when they were last sent
+            new_phones = [phone for phone in current if phone not in self._users]
+            if new_phones:
+                loaded = self.state_store.load(new_phones)
+                with self._lock:
+                    self._last_sent.update(loaded)
+        with self._lock:
+            for phone in list(self._users):
+                if phone not in current:
+                    self._users.pop(phone)
+                    self._due.pop(phone, None)
+                    self._cadence.pop(phone, None)
+            for phone, user in current.items():
+                cadence = user.get('cadence') or DEFAULT_CADENCE
+                try:
+                    parse_cadence(cadence)
+                except ValueError:
+                    cadence = DEFAULT_CADENCE
+                self._users[phone] = user
+                if self._cadence.get(phone) != cadence:
+                    self._cadence[phone] = cadence
+                    self._push(phone, self._first_due(phone, cadence, now))
+
+    def next_due(self):
+        """Earliest due time, or None if nobody is scheduled."""
+        with self._lock:
+            while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now=None):
+        """Users due at or before now (each at most once), already rescheduled to their next slot.
+
+        Each returned user dict carries 'due_at', the slot it was due in.
+        """
+        now = self.clock() if now is None else now
+        due_users = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due, phone = heapq.heappop(self._heap)
+                if self._due.get(phone) != due:
+                    continue  # stale entry (user removed or rescheduled)
+                due_users.append(dict(self._users[phone], due_at=due))
+                self._push(phone, next_slot(phone, self._cadence[phone], max(due, now)))
+        return due_users
+
+    def mark_sent(self, phone, when=None):
+        with self._lock:
+            self._last_sent[phone] = self.clock() if when is None else when
+            self._unsaved.add(phone)
+
+    def cities(self):
+        """Distinct cities of the scheduled users."""
+        with self._lock:
+            return list(dict.fromkeys(user.get('city') for user in self._users.values() if user.get('city')))
+
+    def stats(self):
+        with self._lock:
+            upcoming = sorted(self._due.values())
+        now = self.clock()
+        return {
+            'scheduled_users': len(upcoming),
+            'next_due_in_seconds': round(upcoming[0] - now) if upcoming else None,
+            'due_next_hour': sum(1 for due in upcoming if due - now <= 3600),
+        }
+
+    def wait(self, stop_event=None, max_sleep=60):
+        """Sleep until the next due time (at most max_sleep, so user changes are picked up)."""
+        due = self.next_due()
+        delay = max_sleep if due is None else max(0.0, min(max_sleep, due - self.clock()))
+        if stop_event is not None:
+            stop_event.wait(delay)
+        else:
+            time.sleep(delay)
+
+
+def run_schedule(scheduler, load_users, process_due, resync_seconds=60, stop_event=None):
+    """Main loop shared by the web app's alert thread and the worker.
+
+    load_users() returns the user dicts to schedule; it is re-read every
+    resync_seconds so registrations and deletions are picked up. process_due(users)
+    handles a batch of due users and returns the phones it handled; those are
+    recorded as sent so a restart only catches up on genuinely missed ticks.
+    """
+    last_sync = None
+    while stop_event is None or not stop_event.is_set():
+        try:
+            now = scheduler.clock()
+            if last_sync is None or now - last_sync >= resync_seconds:
+                scheduler.sync_users(load_users())
+                last_sync = now
+            due = scheduler.pop_due(now)
+            if due:
+                handled = process_due(due) or []
+                for phone in handled:
+                    scheduler.mark_sent(phone, now)
+                scheduler.save_state()
+        except Exception as e:
+            print(f"[Scheduler] Error in alert loop: {e}")
+            import traceback
+            traceback.print_exc()
+        scheduler.wait(stop_event, max_sleep=resync_seconds)
@@ -0,0 +1,127 @@
+"""Day-partitioned SQLite stores written in batches by a background thread.
+
+Shared by the delivery ledger and the observation store. record() only queues
+a row; a writer thread started on first use writes the queue every
+flush_seconds (sooner once batch_size rows are waiting, and at exit). Rows go
+to one SQLite file per UTC day, <prefix>-YYYYMMDD.db in the store's directory,
+one transaction per file. A subclass supplies the file prefix, the schema and
+the per-day write.
+"""
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+
+def day_of(ts):
+    """UTC day of an epoch time, as 'YYYYMMDD'."""
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime('%Y%m%d')
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+def day_path(directory, prefix, day):
+    return os.path.join(directory, f'{prefix}-{day}.db')
+
+
+def day_files(directory, prefix, since=None, until=None):
+    """[(day, path)] of the day files in directory, oldest first, optionally limited to the days of since..until."""
+    if not os.path.isdir(directory):
+        return []
+    first = day_of(since) if since is not None else ''
+    last = day_of(until) if until is not None else '99999999'
+    days = sorted(name[len(prefix) + 1:-len('.db')] for name in os.listdir(directory)
+                  if name.startswith(f'{prefix}-') and name.endswith('.db'))
+    return [(day, day_path(directory, prefix, day)) for day in days if first <= day <= last]
+
+
+class DaySegmentStore:
+    """Queue of rows written to per-day files on a background thread.
+
+    Subclasses set prefix (file name prefix), schema (run on every file before
+    writing), thread_name and log_tag, and implement row_time(row) and
+    write_day(conn, day, rows).
+    """
+    prefix = ''
+    schema = ''
+    thread_name = 'segment-writer'
+    log_tag = 'Segments'
+
+    def __init__(self, directory, batch_size, flush_seconds, clock=time.time):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.clock = clock
+        self.written = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def path(self, day):
+        return day_path(self.directory, self.prefix, day)
+
+    def enqueue(self, row):
+        """Queue one row; returns immediately."""
+        with self._lock:
+            self._pending.append(row)
+            full = len(self._pending) >= self.batch_size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+        if full:
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+                self.after_flush()
+            except Exception as e:
+                print(f"[{self.log_tag}] Could not write rows: {e}")
+
+    def after_flush(self):
+        """Runs on the writer thread after each periodic flush; for housekeeping."""
+
+    def flush(self):
+        """Write everything queued so far. Returns the number of rows written."""
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return 0
+        with self._write_lock:
+            self.write(rows)
+        return len(rows)
+
+    def write(self, rows):
+        """Write rows to their day files, one transaction per file."""
+        os.makedirs(self.directory, exist_ok=True)
+        by_day = {}
+        for row in rows:
+            by_day.setdefault(day_of(self.row_time(row)), []).append(row)
+        for day, day_rows in by_day.items():
+            conn = connect(self.path(day))
+            try:
+                conn.executescript(self.schema)
+                with conn:
+                    self.write_day(conn, day, day_rows)
+            finally:
+                conn.close()
+        self.written += len(rows)
+
+    def row_time(self, row):
+        raise NotImplementedError
+
+    def write_day(self, conn, day, rows):
+        raise NotImplementedError
@@ -0,0 +1,495 @@
+"""Split alert cycles across several worker processes by city.
+
+Users are partitioned into ALERT_SHARDS shards by a hash of their canonical
+city, so one city's weather fetch and predictions stay on one worker. Shards
+are spread over the live workers with a consistent-hash ring: when a worker
+joins or dies, only the shards that move between it and its neighbours change
+owner.
+
+Ownership is claimed through leases in a shared SQLite file (ALERT_LEASE_DB,
+default alert_leases.db). A worker heartbeats and renews its leases from a
+background thread every ALERT_LEASE_TTL/3 seconds; a lease that isn't renewed
+within ALERT_LEASE_TTL seconds can be taken over by another worker. A shard
+only changes hands once its previous owner has released it or its lease has
+expired, so two workers never send for the same shard at once. Before each
+send (or bulk send) the worker records the recipients' last-sent times in the
+same transaction that checks it still holds their shard's lease, with at least
+a third of the TTL to spare; jobs for a shard it has lost are dropped for the
+new owner, which picks up exactly the users the old owner never reached. Sends
+a crashed worker had in flight are checked against Twilio's message log by the
+new owner before it takes their shard live, so each is either kept or redone.
+
+    python -m aegis.worker --sharded                      # one of N workers
+    python -m aegis.sharding --users 2000 --workers 1 2 4
+    python -m aegis.sharding --users 2000 --workers 3 --kill-after 300
+"""
+import bisect
+import hashlib
+import math
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+
+from aegis.cities import city_key
+
+SHARD_COUNT = int(os.getenv('ALERT_SHARDS', '256'))
+LEASE_DB = os.getenv('ALERT_LEASE_DB', 'alert_leases.db')
+# Leases are renewed every LEASE_TTL/3 seconds and not sent under with less than LEASE_TTL/3 left
+LEASE_TTL = float(os.getenv('ALERT_LEASE_TTL', '180'))
+RING_VNODES = 128
+# No worker is assigned more than (1 + RING_LOAD_SLACK) times its fair share of shards
+RING_LOAD_SLACK = 0.1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (worker_id TEXT PRIMARY KEY, expires_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS leases (shard INTEGER PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS sent (phone TEXT PRIMARY KEY, last_sent REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS sending (phone TEXT PRIMARY KEY, shard INTEGER NOT NULL, owner TEXT NOT NULL,
+                                    since REAL NOT NULL, previous REAL);
+"""
+
+
+def _ring_hash(text):
+    # md5 rather than crc32: similar worker names must still land far apart on the ring
+    return int.from_bytes(hashlib.md5(str(text).encode('utf-8')).digest()[:8], 'big')
+
+
+def shard_for(city, shards=SHARD_COUNT):
+    """Shard number for a city; spellings that canonicalize to the same city share a shard."""
+    return zlib.crc32(city_key(city).encode('utf-8')) % shards
+
+
+class HashRing:
+    """Consistent-hash ring of workers, each placed at RING_VNODES points."""
+
+    def __init__(self, members, vnodes=RING_VNODES):
+        self.members = sorted(set(members))
+        points = sorted((_ring_hash(f'{member}#{i}'), member) for member in self.members for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [member for _, member in points]
+
+    def owner(self, key):
+        """Member responsible for key, or None on an empty ring."""
+        if not self._owners:
+            return None
+        index = bisect.bisect(self._hashes, _ring_hash(f'shard-{key}')) % len(self._hashes)
+        return self._owners[index]
+
+    def assignment(self, shards=SHARD_COUNT, slack=RING_LOAD_SLACK):
+        """{member: set of shards} for every member of the ring.
+
+        Consistent hashing with bounded loads: a shard whose ring owner is
+        already full goes to the next member clockwise, so no member ends up
+        with more than (1 + slack) times its fair share.
+        """
+        owned = {member: set() for member in self.members}
+        if not self._owners:
+            return owned
+        capacity = math.ceil(shards * (1 + slack) / len(self.members))
+        for shard in range(shards):
+            index = bisect.bisect(self._hashes, _ring_hash(f'shard-{shard}'))
+            while len(owned[self._owners[index % len(self._owners)]]) >= capacity:
+                index += 1
+            owned[self._owners[index % len(self._owners)]].add(shard)
+        return owned
+
+
+class LeaseStore:
+    """Worker heartbeats, shard leases and last-sent times in one SQLite file.
+
+    Also usable as the AlertScheduler's state_store (load/save of last-sent times).
+    """
+
+    def __init__(self, path=LEASE_DB, ttl=LEASE_TTL, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        # isolation_level=None: transactions are opened explicitly with BEGIN IMMEDIATE
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _transaction(self, work):
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = work(conn)
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            return result
+        finally:
+            conn.close()
+
+    def heartbeat(self, worker_id):
+        """Mark worker_id alive for another ttl seconds and forget workers that stopped heartbeating."""
+        now = self.clock()
+
+        def work(conn):
+            conn.execute('INSERT OR REPLACE INTO workers (worker_id, expires_at) VALUES (?, ?)',
+                         (worker_id, now + self.ttl))
+            conn.execute('DELETE FROM workers WHERE expires_at < ?', (now,))
+        self._transaction(work)
+
+    def live_workers(self):
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT worker_id FROM workers WHERE expires_at >= ?', (self.clock(),)).fetchall()
+        finally:
+            conn.close()
+        return sorted(row[0] for row in rows)
+
+    def claim(self, worker_id, wanted):
+        """Renew or take the leases in wanted, release the rest. Returns the shards now held.
+
+        A shard still leased to another live worker is not taken; it is picked
+        up on a later claim once that worker releases it or its lease expires.
+        """
+        now = self.clock()
+        wanted = set(wanted)
+
+        def work(conn):
+            leases = {shard: (owner, expires_at)
+                      for shard, owner, expires_at in conn.execute('SELECT shard, owner, expires_at FROM leases')}
+            held = set()
+            for shard in wanted:
+                owner, expires_at = leases.get(shard, (worker_id, 0))
+                if owner != worker_id and expires_at >= now:
+                    continue
+                conn.execute('INSERT OR REPLACE INTO leases (shard, owner, expires_at) VALUES (?, ?, ?)',
+                             (shard, worker_id, now + self.ttl))
+                held.add(shard)
+            released = [shard for shard, (owner, _) in leases.items() if owner == worker_id and shard not in held]
+            conn.executemany('DELETE FROM leases WHERE shard = ? AND owner = ?',
+                             [(shard, worker_id) for shard in released])
+            return held
+        return self._transaction(work)
+
+    def holds(self, conn, worker_id, shard, margin=0.0):
+        """Whether worker_id holds a lease on shard good for another margin seconds (inside an open transaction)."""
+        row = conn.execute('SELECT 1 FROM leases WHERE shard = ? AND owner = ? AND expires_at >= ?',
+                           (shard, worker_id, self.clock() + margin)).fetchone()
+        return row is not None
+
+    def begin_sends(self, worker_id, phones_by_shard, margin=0.0, done=()):
+        """Mark {shard: [phone, ...]} as being sent by worker_id, for the shards it still holds; returns those shards.
+
+        The lease check and the writes share one transaction, so a shard taken
+        over in between never has its users marked by the old owner. Each phone
+        gets its last-sent time plus a 'sending' row, kept until the send
+        finishes (phones in done) so a new owner can settle sends cut off by a crash.
+        """
+        now = self.clock()
+
+        def work(conn):
+            conn.executemany('DELETE FROM sending WHERE phone = ? AND owner = ?', [(phone, worker_id) for phone in done])
+            held = {shard for shard in phones_by_shard if self.holds(conn, worker_id, shard, margin)}
+            for shard in held:
+                for phone in phones_by_shard[shard]:
+                    previous = conn.execute('SELECT last_sent FROM sent WHERE phone = ?', (phone,)).fetchone()
+                    conn.execute('INSERT OR REPLACE INTO sending (phone, shard, owner, since, previous) '
+                                 'VALUES (?, ?, ?, ?, ?)', (phone, shard, worker_id, now, previous and previous[0]))
+                    conn.execute('INSERT OR REPLACE INTO sent (phone, last_sent) VALUES (?, ?)', (phone, now))
+            return held
+        return self._transaction(work)
+
+    def in_doubt(self, shards):
+        """[(phone, shard, since)] begun in shards by workers that have since died without finishing them."""
+        shards = list(shards)
+        conn = self._connect()
+        try:
+            live = {row[0] for row in conn.execute('SELECT worker_id FROM workers WHERE expires_at >= ?',
+                                                   (self.clock(),))}
+            rows = []
+            for start in range(0, len(shards), 500):
+                chunk = shards[start:start + 500]
+                rows += conn.execute('SELECT phone, shard, owner, since FROM sending WHERE shard IN (%s)'
+                                     % ','.join('?' * len(chunk)), chunk).fetchall()
+        finally:
+            conn.close()
+        return [(phone, shard, since) for phone, shard, owner, since in rows if owner not in live]
+
+    def settle(self, outcomes):
+        """Close in-doubt sends from {phone: was it sent}; an unsent phone gets its previous last-sent time back."""
+        def work(conn):
+            for phone, was_sent in outcomes.items():
+                row = conn.execute('SELECT previous FROM sending WHERE phone = ?', (phone,)).fetchone()
+                if row is None:
+                    continue
+                if not was_sent:
+                    if row[0] is None:
+                        conn.execute('DELETE FROM sent WHERE phone = ?', (phone,))
+                    else:
+                        conn.execute('INSERT OR REPLACE INTO sent (phone, last_sent) VALUES (?, ?)', (phone, row[0]))
+                conn.execute('DELETE FROM sending WHERE phone = ?', (phone,))
+        self._transaction(work)
+
+    def finish_sends(self, worker_id, phones):
+        self._transaction(lambda conn: conn.executemany('DELETE FROM sending WHERE phone = ? AND owner = ?',
+                                                        [(phone, worker_id) for phone in phones]))
+
+    def leave(self, worker_id):
+        """Drop the worker and its leases so the others can take over right away."""
+        def work(conn):
+            conn.execute('DELETE FROM leases WHERE owner = ?', (worker_id,))
+            conn.execute('DELETE FROM workers WHERE worker_id = ?', (worker_id,))
+        self._transaction(work)
+
+    def load(self, phones):
+        """{phone: last sent time} for the phones that have one."""
+        phones = list(phones)
+        result = {}
+        conn = self._connect()
+        try:
+            for start in range(0, len(phones), 500):
+                chunk = phones[start:start + 500]
+                rows = conn.execute('SELECT phone, last_sent FROM sent WHERE phone IN (%s)' % ','.join('?' * len(chunk)),
+                                    chunk).fetchall()
+                result.update(rows)
+        finally:
+            conn.close()
+        return result
+
+    def save(self, last_sent):
+        """Record {phone: last sent time}."""
+        self._transaction(lambda conn: conn.executemany(
+            'INSERT OR REPLACE INTO sent (phone, last_sent) VALUES (?, ?)', list(last_sent.items())))
+
+
+class ShardCoordinator:
+    """One worker's view of which shards it owns, renewed by start_heartbeat() (or refresh() every ttl/3 seconds).
+
+    was_sent(phone, since) -> True, False or None (can't tell) settles sends a
+    dead worker had in flight on shards this worker takes over (see
+    aegis.sms.sent_since); without it they are assumed sent.
+    """
+
+    def __init__(self, store, worker_id=None, shards=SHARD_COUNT, was_sent=None):
+        self.store = store
+        self.worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+        self.shards = shards
+        self.was_sent = was_sent
+        self.owned = set()
+        self.members = []
+        self._done = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        """Heartbeat, recompute the ring over live workers and claim this worker's shards."""
+        with self._lock:
+            self.store.heartbeat(self.worker_id)
+            members = self.store.live_workers()
+            wanted = HashRing(members).assignment(self.shards).get(self.worker_id, set())
+            owned = self.store.claim(self.worker_id, wanted)
+            # A shard taken over only goes live once its in-doubt sends are settled
+            owned -= self._settle(owned, owned - self.owned)
+            if owned != self.owned or members != self.members:
+                waiting = len(wanted - owned)
+                print(f"[Shards] {self.worker_id}: {len(owned)}/{self.shards} shards, {len(members)} live workers"
+                      + (f", waiting for {waiting} to be released" if waiting else ''))
+            self.owned = owned
+            self.members = members
+        return owned
+
+    def _settle(self, owned, new):
+        """Settle dead workers' in-flight sends on owned shards; returns the new shards that couldn't be yet."""
+        rows = self.store.in_doubt(owned)
+        if not rows:
+            return set()
+        outcomes = {}
+        unsettled = set()
+        for phone, shard, since in rows:
+            was_sent = self.was_sent(phone, since) if self.was_sent else True
+            if was_sent is None:
+                unsettled.add(shard)
+            else:
+                outcomes[phone] = was_sent
+        self.store.settle(outcomes)
+        print(f"[Shards] {self.worker_id}: settled {len(outcomes)} in-flight sends of a dead worker "
+              f"({sum(1 for sent in outcomes.values() if not sent)} never arrived and are due again)")
+        return unsettled & new
+
+    def start_heartbeat(self, interval=None):
+        """Refresh on a daemon thread every interval seconds (default ttl/3), so leases outlive long batches."""
+        interval = interval or self.store.ttl / 3
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"[Shards] {self.worker_id}: lease renewal failed: {e}")
+        self._thread = threading.Thread(target=run, name='shard-heartbeat', daemon=True)
+        self._thread.start()
+
+    def owns(self, city):
+        return shard_for(city, self.shards) in self.owned
+
+    def filter_users(self, users):
+        return [user for user in users if self.owns(user.get('city', ''))]
+
+    def claim_sends(self, jobs):
+        """The jobs whose shard this worker still holds, marked as being sent.
+
+        Used as the dispatcher's claim hook just before each send; jobs for a
+        shard lost since the last refresh are dropped and left to its new owner.
+        Report each send's end with send_finished().
+        """
+        by_shard = {}
+        for job in jobs:
+            by_shard.setdefault(shard_for(job.get('city', ''), self.shards), []).append(job['phone'])
+        with self._lock:
+            done, self._done = self._done, []
+        held = self.store.begin_sends(self.worker_id, by_shard, margin=self.store.ttl / 3, done=done)
+        lost = set(by_shard) - held
+        if lost:
+            with self._lock:
+                self.owned = self.owned - lost
+            print(f"[Shards] {self.worker_id}: lease lost on shard(s) {sorted(lost)}, dropping their sends")
+        return [job for job in jobs if shard_for(job.get('city', ''), self.shards) in held]
+
+    def send_finished(self, job, delivered=None):
+        """Progress hook: the send is over; its 'sending' row is cleared with the next claim."""
+        with self._lock:
+            self._done.append(job['phone'])
+
+    def leave(self):
+        self._stop.set()
+        with self._lock:
+            done, self._done = self._done, []
+            self.store.finish_sends(self.worker_id, done)
+            self.store.leave(self.worker_id)
+            self.owned = set()
+        print(f"[Shards] {self.worker_id} left; its shards are free to take over")
+
+
+# --- Multi-process cycle check -------------------------------------------------------------------
+
+def _synthetic_users(users, cities):
+    return [{'phone': f'+91{9000000000 + index}', 'city': f'Sim City {index % cities:04d}'} for index in range(users)]
+
+
+def simulate(users, workers, cities=50, ttl=6.0, kill_after=0, delay=0.05, timeout=300.0, work_dir=None):
+    """Run real `python -m aegis.worker --sharded` processes against aegis.stubs until every user is sent.
+
+    Every user is on a daily cadence twelve hours from now and seeded as last
+    sent two days ago, so each is due exactly once: a catch-up within the first
+    few seconds. With kill_after, the first worker
+    is SIGKILLed once the stub has accepted that many messages; its shards are
+    taken over when their leases expire. Returns (seconds, duplicates, missing),
+    counted from the messages the stub accepted.
+    """
+    import shutil
+    import signal
+    import subprocess
+    import sys
+    import tempfile
+    from datetime import datetime, timedelta, timezone
+    from aegis.model import HealthModel
+    from aegis.stubs import start_stub
+    from aegis.training import DATASET_FILE, MODEL_FILE
+    from aegis.users import USER_COLUMNS, PHONE_OK
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    work_dir = work_dir or tempfile.mkdtemp(prefix='aegis-shards-')
+    population = _synthetic_users(users, cities)
+    cadence = (datetime.now(timezone.utc) + timedelta(hours=12)).strftime('daily@%H:%M')
+    with open(os.path.join(work_dir, 'users.csv'), 'w') as file:
+        file.write(','.join(USER_COLUMNS) + '\n')
+        file.writelines(f"{user['phone']},,{user['city']},{PHONE_OK},{user['city']},{cadence}\n" for user in population)
+    shutil.copy(os.path.join(root, DATASET_FILE), work_dir)
+    # Trained once here so the workers only load it
+    HealthModel(os.path.join(work_dir, MODEL_FILE), os.path.join(work_dir, DATASET_FILE)).ensure_loaded()
+    db = os.path.join(work_dir, 'alert_leases.db')
+    LeaseStore(db, ttl=ttl).save({user['phone']: time.time() - 2 * 86400 for user in population})
+
+    server, state = start_stub(0, delay)
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    env = dict(os.environ, PYTHONPATH=root, ALERT_LEASE_DB=db, ALERT_LEASE_TTL=str(ttl),
+               ALERT_TIMEZONE='UTC', ALERT_CATCHUP_SPREAD_SECONDS='5', ALERT_SEND_RATE='0', OWM_BASE_URL=base_url, OWM_API_KEY='stub',
+               TWILIO_BASE_URL=base_url, TWILIO_ACCOUNT_SID='AC' + '0' * 32, TWILIO_AUTH_TOKEN='stub',
+               TWILIO_PHONE_NUMBER='+15005550006', TWILIO_NOTIFY_SERVICE_SID='', DEMO_SMS='')
+
+    def spawn(index):
+        log = open(os.path.join(work_dir, f'worker{index}.log'), 'w')
+        return subprocess.Popen([sys.executable, '-m', 'aegis.worker', '--sharded', '--resync', '1'],
+                                cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    def delivered():
+        with state.lock:
+            return len(state.sms)
+
+    started = time.perf_counter()
+    processes = [spawn(index) for index in range(workers)]
+    killed = False
+    try:
+        while time.perf_counter() - started < timeout:
+            if kill_after and not killed and delivered() >= kill_after:
+                processes[0].send_signal(signal.SIGKILL)
+                killed = True
+                print(f"[Shards] killed worker 0 after {delivered()} messages")
+            with state.lock:
+                if len({to for to, _ in state.sms}) >= users:
+                    break
+            time.sleep(0.1)
+        seconds = time.perf_counter() - started
+        # Anything sent twice (e.g. by a worker that kept going after losing a lease) shows up within a TTL
+        time.sleep(ttl)
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)
+        for process in processes:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        server.shutdown()
+    counts = {}
+    with state.lock:
+        for to, _ in state.sms:
+            counts[to] = counts.get(to, 0) + 1
+    duplicates = sum(1 for count in counts.values() if count > 1)
+    missing = sum(1 for user in population if user['phone'] not in counts)
+    if duplicates or missing:
+        print(f"[Shards] worker logs kept in {work_dir}")
+    else:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return seconds, duplicates, missing
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Run sharded alert workers against the local stubs and check every user is sent exactly once')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--cities', type=int, default=50, help='distinct synthetic cities')
+    parser.add_argument('--ttl', type=float, default=6.0, help='lease TTL in seconds')
+    parser.add_argument('--delay', type=float, default=0.05, help='stub response delay in seconds')
+    parser.add_argument('--kill-after', type=int, default=0,
+                        help='SIGKILL the first worker once this many messages were accepted')
+    args = parser.parse_args()
+
+    print(f"{args.users} users in {args.cities} cities, {args.delay * 1000:g} ms per stub call, lease TTL {args.ttl:g}s")
+    failed = False
+    for count in args.workers:
+        seconds, duplicates, missing = simulate(args.users, count, args.cities, args.ttl, args.kill_after, args.delay)
+        print(f"{count} worker(s): {seconds:6.1f} s, duplicates {duplicates}, skipped {missing}")
+        failed = failed or bool(duplicates or missing)
+    if failed:
+        raise SystemExit(1)
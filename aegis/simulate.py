@@ -0,0 +1,385 @@
+"""Accelerated replay of alert cycles, for sizing workers before going live.
+
+The dated per-city observations in climate_health_precaution_dataset_500.csv
+are replayed in virtual time through the real alert pipeline. The
+AlertScheduler decides who is due. prepare_alerts runs the real model on the
+replayed weather and builds the messages. The real Dispatcher orders and groups
+the sends. Twilio is a recording fake that answers instantly. Send latency,
+sender threads and the account's rate limit are applied afterwards in virtual
+time, to the calls in the order the dispatcher made them. The worker loop
+blocks and sleeps in virtual time as it does for real, so a simulated day of a
+large population takes minutes.
+
+Every policy (row order, risk priority, bulk per city) runs once per worker
+count. Workers split the cities with the same consistent-hash ring as
+`python -m aegis.worker --sharded` and share the account's rate limit. The
+report gives:
+- throughput;
+- queue depth (users due when the worker loop wakes);
+- delivery lag behind each user's slot, per risk level;
+- SMS volume: API calls, messages and billed segments.
+
+    python -m aegis.simulate --users 1000000 --cities 500 --days 1 --workers 1,4
+"""
+import csv
+import heapq
+import math
+import random
+import threading
+import time
+from array import array
+from datetime import datetime
+
+from aegis.alerts import prepare_alerts
+from aegis.dispatch import RISK_LEVELS, Dispatcher, percentile, risk_level
+from aegis.model import HealthModel
+from aegis.prediction_cache import PredictionCache
+from aegis.scheduler import ALERT_TIMEZONE, AlertScheduler
+from aegis.sharding import HashRing, shard_for, SHARD_COUNT
+from aegis.training import DATASET_FILE, FEATURES
+from aegis.weather import GROUP_SIZE, WEATHER_TTL_SECONDS
+
+# name -> (risk-prioritized, one bulk call per city message)
+POLICIES = {'row': (False, False), 'priority': (True, False), 'bulk': (True, True)}
+DEFAULT_CADENCES = 'hourly=10,6h=30,daily@08:00=60'
+
+# GSM-7 basic set; the extension characters cost two septets each
+_GSM_BASIC = set("@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?¡"
+                 "ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà")
+_GSM_EXTENDED = set('^{}\\[~]|€')
+
+
+def sms_segments(message):
+    """Billed SMS segments: 160 (153 when split) GSM-7 characters, or 70 (67) UCS-2 ones."""
+    if all(char in _GSM_BASIC or char in _GSM_EXTENDED for char in message):
+        length = len(message) + sum(1 for char in message if char in _GSM_EXTENDED)
+        single, part = 160, 153
+    else:
+        length, single, part = len(message), 70, 67
+    return 1 if length <= single else math.ceil(length / part)
+
+
+def parse_cadences(spec):
+    """'hourly=10,6h=30,daily@08:00=60' -> [(cadence, weight), ...]"""
+    cadences = []
+    for part in spec.split(','):
+        cadence, _, weight = part.strip().rpartition('=')
+        if not cadence:
+            raise ValueError(f"Expected cadence=weight, got '{part}'")
+        cadences.append((cadence, float(weight)))
+    return cadences
+
+
+class WeatherReplay:
+    """The dataset's observations per city, looked up by virtual time.
+
+    A city's rows for one date are spread evenly over that day, and the dates
+    repeat once the dataset runs out. Synthetic cities reuse a dataset city's
+    series, shifted by a few hours and a little warmer or cooler, so they
+    neither change all at once nor all predict alike.
+    """
+
+    def __init__(self, cities, dataset_file=DATASET_FILE):
+        by_city = {}
+        with open(dataset_file, newline='', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                observation = {name: float(row[name]) for name in FEATURES}
+                by_city.setdefault(row['City'], {}).setdefault(row['Date'], []).append(observation)
+        self.dates = sorted({date for days in by_city.values() for date in days})
+        start = datetime.fromisoformat(self.dates[0])
+        try:
+            from zoneinfo import ZoneInfo
+            start = start.replace(tzinfo=ZoneInfo(ALERT_TIMEZONE))
+        except Exception:
+            pass
+        self.start = start.timestamp()
+        bases = sorted(by_city)
+        self.cities = []
+        self._series = {}   # city -> (rows by date, shift seconds, temperature nudge)
+        for index in range(cities):
+            base, copy = bases[index % len(bases)], index // len(bases)
+            name = base if copy == 0 else f'{base} {copy:03d}'
+            self.cities.append(name)
+            self._series[name] = (by_city[base], copy * 7 % 24 * 3600, (copy % 5 - 2) * 0.7)
+        self.calls = 0
+        self._fetched = {}  # city -> virtual time of the last fetch, like weather.py's observation cache
+
+    def reset(self):
+        """Forget fetched cities (a new worker process starts with an empty cache)."""
+        self._fetched = {}
+
+    def observation(self, city, now):
+        days, shift, nudge = self._series[city]
+        elapsed = now - self.start + shift
+        rows = days.get(self.dates[int(elapsed // 86400) % len(self.dates)]) or next(iter(days.values()))
+        observation = rows[int(elapsed % 86400 / 86400 * len(rows))]
+        return dict(observation, Temperature=round(observation['Temperature'] + nudge, 1)) if nudge else observation
+
+    def fetcher(self, now):
+        """A fetch_weather_for_cities stand-in at virtual time now.
+
+        Counts the /group calls the real fetch would make for cities whose
+        observation is older than WEATHER_TTL_SECONDS.
+        """
+        def fetch(cities):
+            unique = dict.fromkeys(cities)
+            stale = [city for city in unique if now - self._fetched.get(city, float('-inf')) >= WEATHER_TTL_SECONDS]
+            for city in stale:
+                self._fetched[city] = now
+            self.calls += math.ceil(len(stale) / GROUP_SIZE)
+            return {city: self.observation(city, now) for city in unique}
+        return fetch
+
+
+class FakeTwilio:
+    """send_sms/send_bulk_sms stand-ins that answer at once and record each call in order."""
+
+    def __init__(self, fail_rate=0.0, seed=0):
+        self.fail_rate = fail_rate
+        self.calls = []         # ([phones], message) in the order the dispatcher sent them
+        self.api_calls = self.messages = self.segments = self.failed = 0
+        self._segments = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _record(self, phones, message):
+        with self._lock:
+            self.calls.append((phones, message))
+            if message not in self._segments:
+                self._segments[message] = sms_segments(message)
+            self.api_calls += 1
+            self.messages += len(phones)
+            self.segments += self._segments[message] * len(phones)
+            results = {}
+            for phone in phones:
+                if self.fail_rate and self._rng.random() < self.fail_rate:
+                    self.failed += 1
+                    results[phone] = {'code': 30003, 'message': 'Unreachable destination handset'}
+                else:
+                    results[phone] = f'SM{phone}'
+            return results
+
+    def send(self, phone, message):
+        return self._record([phone], message)[phone]
+
+    def send_bulk(self, phones, message):
+        return self._record(list(phones), message)
+
+
+class _MemoryStore:
+    """Schedule state store that keeps nothing, so a simulation never touches alert_schedule.json."""
+
+    def load(self, phones):
+        return {}
+
+    def save(self, changes):
+        pass
+
+
+def virtual_send(calls, start, threads, rate, send_seconds, bulk_seconds):
+    """Finish time of each call with `threads` senders taking one rate token per call, from start."""
+    free = [start] * max(1, threads)
+    token = start
+    finished = []
+    for phones, _ in calls:
+        begin = max(heapq.heappop(free), token)
+        if rate > 0:
+            token = begin + 1 / rate   # burst of 1: the next token refills from this one
+        end = begin + (bulk_seconds if len(phones) > 1 else send_seconds)
+        heapq.heappush(free, end)
+        finished.append(end)
+    return finished
+
+
+class Results:
+    """Measurements of one policy and worker count, summed over its workers."""
+
+    def __init__(self):
+        self.lags = {level: array('d') for level in RISK_LEVELS}
+        self.depths = array('l')
+        self.per_hour = {}
+        self.delivered = self.failed = self.behind = 0
+        self.api_calls = self.messages = self.segments = self.weather_calls = 0
+        self.busy_seconds = 0.0
+        self.last_finish = 0.0
+
+    def summary(self, days, workers, threads):
+        span = days * 86400
+        # Senders are busy until the last batch started in the window has gone out
+        busy_span = max(span, self.last_finish)
+        out = {
+            'delivered': self.delivered,
+            'failed': self.failed,
+            'per_hour': round(self.delivered / (span / 3600)),
+            'peak_hour': max(self.per_hour.values(), default=0),
+            'sender_busy': round(self.busy_seconds / (busy_span * workers * threads), 3),
+            'depth_p50': percentile(self.depths, 50) or 0,
+            'depth_p99': percentile(self.depths, 99) or 0,
+            'depth_max': max(self.depths, default=0),
+            'behind_at_end': self.behind,
+            'api_calls': self.api_calls,
+            'messages': self.messages,
+            'segments': self.segments,
+            'weather_calls': self.weather_calls,
+            'lag': {},
+        }
+        for level, lags in self.lags.items():
+            if lags:
+                out['lag'][level] = (round(percentile(lags, 50), 1), round(percentile(lags, 99), 1))
+        return out
+
+
+def run_worker(users, policy, model, replay, results, start, end, threads=8, rate=100.0, send_ms=250.0,
+               bulk_ms=600.0, tick=5.0, bulk_max=1000, fail_rate=0.0, seed=7):
+    """One worker's alert loop over [start, end) in virtual time, measured into results."""
+    prioritize, bulk = POLICIES[policy]
+    replay.reset()
+    clock = [start]
+    scheduler = AlertScheduler(clock=lambda: clock[0], state_store=_MemoryStore())
+    scheduler.sync_users(users)
+    twilio = FakeTwilio(fail_rate, seed)
+    # The real dispatcher with no pacing: it only decides the order and grouping of the calls
+    dispatcher = Dispatcher(twilio.send, workers=threads, rate=0, prioritize=prioritize,
+                            send_bulk=twilio.send_bulk if bulk else None, bulk_max=bulk_max)
+    now = last_wake = start - tick
+    while True:
+        due_at = scheduler.next_due()
+        if due_at is None:
+            break
+        # Like run_schedule: sleep until someone is due, but wake at most every tick
+        now = max(now, due_at, last_wake + tick)
+        if now >= end:
+            break
+        clock[0] = last_wake = now
+        due = scheduler.pop_due(now)
+        results.depths.append(len(due))
+        began = time.perf_counter()
+        jobs = prepare_alerts(due, model, fetch_weather=replay.fetcher(now))
+        # Weather, prediction and message building really ran; their time counts as virtual time too
+        sending_from = now + time.perf_counter() - began
+        twilio.calls = []
+        dispatcher.dispatch(jobs)
+        finished = virtual_send(twilio.calls, sending_from, threads, rate, send_ms / 1000, bulk_ms / 1000)
+        slots = {user['phone']: user['due_at'] for user in due}
+        levels = {job['phone']: risk_level(job['risk']) for job in jobs}
+        for (phones, _), done in zip(twilio.calls, finished):
+            results.busy_seconds += (bulk_ms if len(phones) > 1 else send_ms) / 1000
+            hour = int((done - start) // 3600)
+            results.per_hour[hour] = results.per_hour.get(hour, 0) + len(phones)
+            for phone in phones:
+                results.lags[levels[phone]].append(done - slots[phone])
+        results.delivered += sum(len(phones) for phones, _ in twilio.calls)
+        now = max(finished, default=sending_from)
+        results.last_finish = max(results.last_finish, now - start)
+    clock[0] = end
+    results.behind += len(scheduler.pop_due(end))
+    results.failed += twilio.failed
+    results.api_calls += twilio.api_calls
+    results.messages += twilio.messages
+    results.segments += twilio.segments
+
+
+def population(users, cities, cadences, seed=7):
+    """Synthetic users: city popularity falls off like a Zipf curve, cadences drawn by weight."""
+    rng = random.Random(seed)
+    city_weights = [1 / (rank + 1) ** 0.8 for rank in range(len(cities))]
+    picked_cities = rng.choices(cities, weights=city_weights, k=users)
+    picked_cadences = rng.choices([cadence for cadence, _ in cadences],
+                                  weights=[weight for _, weight in cadences], k=users)
+    return [{'phone': f'+91{9000000000 + index}', 'city': city, 'cadence': cadence}
+            for index, (city, cadence) in enumerate(zip(picked_cities, picked_cadences))]
+
+
+def split_by_worker(users, workers):
+    """Users per worker, by city, with the sharded worker's hash ring."""
+    members = [f'worker-{index}' for index in range(workers)]
+    owner = {}
+    for member, shards in HashRing(members).assignment(SHARD_COUNT).items():
+        for shard in shards:
+            owner[shard] = member
+    city_owner = {}
+    split = {member: [] for member in members}
+    for user in users:
+        city = user['city']
+        if city not in city_owner:
+            city_owner[city] = owner[shard_for(city)]
+        split[city_owner[city]].append(user)
+    return list(split.values())
+
+
+def simulate(users, policy, workers, model, replay, days=1.0, rate=100.0, threads=8, **options):
+    """Run every worker of one configuration over `days` of virtual time. Returns the summary dict.
+
+    rate is the account's API calls per second, shared evenly by the workers;
+    other options go to run_worker.
+    """
+    results = Results()
+    replay.calls = 0
+    end = replay.start + days * 86400
+    started = time.perf_counter()
+    for worker_users in split_by_worker(users, workers):
+        run_worker(worker_users, policy, model, replay, results, replay.start, end, threads=threads,
+                   rate=rate / workers, **options)
+    results.weather_calls = replay.calls
+    summary = results.summary(days, workers, threads)
+    summary['real_seconds'] = round(time.perf_counter() - started, 1)
+    summary['speedup'] = round(days * 86400 / max(summary['real_seconds'], 0.1))
+    return summary
+
+
+def format_summary(policy, workers, threads, rate, summary):
+    lag = ' | '.join(f"{level} p50={p50}s p99={p99}s" for level, (p50, p99) in summary['lag'].items())
+    return '\n'.join([
+        f"{policy}, {workers} worker(s) x {threads} threads, {rate:g} calls/s:",
+        f"  throughput   {summary['delivered']} alerts ({summary['failed']} failed), {summary['per_hour']}/h average, "
+        f"{summary['peak_hour']} in the busiest hour, senders {summary['sender_busy']:.0%} busy",
+        f"  queue depth  p50={summary['depth_p50']} p99={summary['depth_p99']} max={summary['depth_max']} due per wake, "
+        f"{summary['behind_at_end']} still due at the end",
+        f"  lag          {lag or '-'}",
+        f"  SMS volume   {summary['api_calls']} API calls, {summary['messages']} messages, "
+        f"{summary['segments']} segments; {summary['weather_calls']} weather calls",
+        f"  simulated in {summary['real_seconds']} s ({summary['speedup']}x real time)",
+    ])
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Replay dated weather through the alert pipeline in virtual time')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--cities', type=int, default=500)
+    parser.add_argument('--days', type=float, default=1.0)
+    parser.add_argument('--cadences', default=DEFAULT_CADENCES, help='cadence=weight list for the population')
+    parser.add_argument('--policies', default='row,priority,bulk', help=f"any of {', '.join(POLICIES)}")
+    parser.add_argument('--workers', default='1,4', help='worker counts to compare, e.g. 1,2,4')
+    parser.add_argument('--threads', type=int, default=8, help='sender threads per worker (ALERT_SEND_WORKERS)')
+    parser.add_argument('--rate', type=float, default=100.0, help='account-wide Twilio API calls per second')
+    parser.add_argument('--send-ms', type=float, default=250.0, help='latency of one Messages call')
+    parser.add_argument('--bulk-ms', type=float, default=600.0, help='latency of one Notify call')
+    parser.add_argument('--bulk-max', type=int, default=1000, help='recipients per Notify call (TWILIO_BULK_MAX)')
+    parser.add_argument('--tick', type=float, default=5.0, help='shortest virtual sleep of the worker loop')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of messages Twilio rejects')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    policies = [name.strip() for name in args.policies.split(',') if name.strip()]
+    unknown = [name for name in policies if name not in POLICIES]
+    if unknown:
+        parser.error(f"unknown policy: {', '.join(unknown)}")
+    worker_counts = [int(count) for count in args.workers.split(',')]
+
+    replay = WeatherReplay(args.cities)
+    # The cache keeps one prediction per city observation, as a live worker's PREDICTION_CACHE would
+    model = HealthModel(cache=PredictionCache(maxsize=max(1024, args.cities * 8)))
+    if not model.ensure_loaded():
+        raise SystemExit('No model available')
+    began = time.perf_counter()
+    users = population(args.users, replay.cities, parse_cadences(args.cadences), args.seed)
+    print(f"{args.users} users over {args.cities} cities ({args.cadences}) in {time.perf_counter() - began:.1f} s; "
+          f"replaying {args.days:g} day(s) from {replay.dates[0]}")
+    for policy in policies:
+        for workers in worker_counts:
+            summary = simulate(users, policy, workers, model, replay, days=args.days, rate=args.rate,
+                               threads=args.threads, send_ms=args.send_ms, bulk_ms=args.bulk_ms,
+                               bulk_max=args.bulk_max, tick=args.tick, fail_rate=args.fail_rate, seed=args.seed)
+            print(format_summary(policy, workers, args.threads, args.rate, summary))
@@ -0,0 +1,231 @@
+"""Twilio SMS sending, shared by the web app and the alert worker.
+
+twilio is imported on the first real send, so DEMO_SMS runs and worker
+startup don't pay for it.
+
+When TWILIO_NOTIFY_SERVICE_SID is set, send_bulk_sms() hands one message body
+and up to TWILIO_BULK_MAX recipients to Twilio Notify in a single API call;
+otherwise (or if that call fails) it falls back to one Messages call each.
+Notify only reports on the whole chunk, so its recipients are 'submitted',
+not 'sent'.
+"""
+import json
+import os
+import time
+
+# Twilio credentials - loaded from environment variables
+# Set these in your environment or Render dashboard:
+# TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_PHONE_NUMBER
+TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID', '')
+TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN', '')
+TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER', '')
+# Notify service (with this number in its Messaging Service) for bulk sends
+TWILIO_NOTIFY_SERVICE_SID = os.getenv('TWILIO_NOTIFY_SERVICE_SID', '')
+# Recipients per Notify call (Twilio accepts up to 10,000 bindings)
+BULK_MAX_RECIPIENTS = int(os.getenv('TWILIO_BULK_MAX', '1000'))
+# Point the Twilio client somewhere else, e.g. the local stub in aegis.stubs
+TWILIO_BASE_URL = os.getenv('TWILIO_BASE_URL', '').rstrip('/')
+
+# Set to True to simulate SMS (no real Twilio send). Use when Twilio is not set up or trial limits.
+DEMO_SMS = os.environ.get('DEMO_SMS', 'false').lower() in ('1', 'true', 'yes')
+
+
+def twilio_configured():
+    return bool(TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN)
+
+
+def bulk_configured():
+    return twilio_configured() and bool(TWILIO_NOTIFY_SERVICE_SID)
+
+
+def twilio_client():
+    from twilio.rest import Client
+    if not TWILIO_BASE_URL:
+        return Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+
+    from urllib.parse import urlsplit
+    from twilio.http.http_client import TwilioHttpClient
+
+    class RedirectingHttpClient(TwilioHttpClient):
+        def request(self, method, url, *args, **kwargs):
+            parts = urlsplit(url)
+            target = f"{TWILIO_BASE_URL}{parts.path}" + (f"?{parts.query}" if parts.query else '')
+            return super().request(method, target, *args, **kwargs)
+
+    return Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, http_client=RedirectingHttpClient())
+
+
+def _invalid_phone(phone):
+    if not phone or len(phone) < 10:
+        return {
+            'type': 'ValidationError',
+            'message': f'Invalid phone number: {phone}',
+            'user_message': f'Invalid phone number format: {phone}. Phone number must be at least 10 digits.'
+        }
+    return None
+
+
+def send_bulk_sms(phones, msg, client=None):
+    """Send one message to many phones. Returns {phone: result}, each result as from send_sms.
+
+    With Notify configured, every chunk of BULK_MAX_RECIPIENTS goes out in one
+    API call and each recipient's result is {'status': 'submitted',
+    'notification_sid': ...}, the SID of the whole chunk's notification:
+    Notify accepted the chunk, and per-recipient delivery only shows up in the
+    Notify logs. A chunk Notify rejects is retried one message at a time.
+    """
+    results = {}
+    valid = []
+    for phone in dict.fromkeys(phones):
+        error_info = _invalid_phone(phone)
+        if error_info:
+            print(f"ERROR: {error_info['user_message']}")
+            results[phone] = error_info
+        else:
+            valid.append(phone)
+
+    if DEMO_SMS:
+        print(f"\n[DEMO SMS] Would send to {len(valid)} recipients:")
+        print("-" * 40)
+        print(msg[:200] + ("..." if len(msg) > 200 else ""))
+        print("-" * 40)
+        demo_id = "DEMO_" + str(int(time.time()))
+        results.update((phone, demo_id) for phone in valid)
+        return results
+
+    if not bulk_configured():
+        for phone in valid:
+            results[phone] = send_sms(phone, msg)
+        return results
+
+    for start in range(0, len(valid), BULK_MAX_RECIPIENTS):
+        chunk = valid[start:start + BULK_MAX_RECIPIENTS]
+        try:
+            client = client or twilio_client()
+            notification = client.notify.v1.services(TWILIO_NOTIFY_SERVICE_SID).notifications.create(
+                body=msg,
+                to_binding=[json.dumps({'binding_type': 'sms', 'address': phone}) for phone in chunk],
+            )
+            print(f"[Bulk SMS] {len(chunk)} recipients in one call, notification {notification.sid}")
+            results.update((phone, {'status': 'submitted', 'notification_sid': notification.sid}) for phone in chunk)
+        except Exception as e:
+            print(f"[Bulk SMS] Notify call for {len(chunk)} recipients failed ({type(e).__name__}: {e}); "
+                  f"sending one by one")
+            for phone in chunk:
+                results[phone] = send_sms(phone, msg)
+    return results
+
+
+def sent_since(phone, since, client=None):
+    """Whether Twilio accepted a message to phone at or after since (epoch seconds); None if it can't tell.
+
+    Used to settle sends that were in flight when a worker died. Twilio's
+    timestamps are whole seconds, hence the small allowance.
+    """
+    try:
+        client = client or twilio_client()
+        for message in client.messages.list(to=phone, limit=20):
+            if message.date_created and message.date_created.timestamp() >= since - 2:
+                return True
+        return False
+    except Exception as e:
+        print(f"[SMS] Could not look up messages to {phone}: {type(e).__name__}: {e}")
+        return None
+
+
+def send_sms(phone, msg):
+    """Send SMS via Twilio (or simulate when DEMO_SMS is True)"""
+    # Validate phone number format before sending
+    error_info = _invalid_phone(phone)
+    if error_info:
+        print(f"ERROR: {error_info['user_message']}")
+        return error_info
+
+    if DEMO_SMS:
+        print(f"\n[DEMO SMS] Would send to {phone}:")
+        print("-" * 40)
+        print(msg[:200] + ("..." if len(msg) > 200 else ""))
+        print("-" * 40)
+        return "DEMO_" + str(int(time.time()))
+
+    try:
+        print(f"\n{'='*60}")
+        print(f"ATTEMPTING TO SEND SMS")
+        print(f"{'='*60}")
+        print(f"To: {phone}")
+        print(f"From: {TWILIO_PHONE_NUMBER}")
+        print(f"Message length: {len(msg)} characters")
+        print(f"Account SID: {TWILIO_ACCOUNT_SID[:10]}...")
+        
+        if not phone or len(phone) < 10:
+            error_info = {
+                'type': 'ValidationError',
+                'message': f'Invalid phone number: {phone}',
+                'user_message': f'Invalid phone number format: {phone}. Phone number must be at least 10 digits.'
+            }
+            print(f"ERROR: {error_info['user_message']}")
+            return error_info
+        
+        client = twilio_client()
+        print("Twilio client created successfully")
+        
+        message = client.messages.create(
+            body=msg,
+            from_=TWILIO_PHONE_NUMBER,
+            to=phone
+        )
+        
+        print(f"{'='*60}")
+        print(f"SMS SENT SUCCESSFULLY!")
+        print(f"Message SID: {message.sid}")
+        print(f"Message status: {message.status}")
+        print(f"Message price: {getattr(message, 'price', 'N/A')}")
+        print(f"{'='*60}\n")
+        return message.sid
+        
+    except Exception as e:
+        error_msg = str(e)
+        error_type = type(e).__name__
+        error_code = getattr(e, 'code', None)
+        
+        print(f"\n{'!'*60}")
+        print(f"SMS SENDING FAILED")
+        print(f"{'!'*60}")
+        print(f"Error type: {error_type}")
+        print(f"Error code: {error_code}")
+        print(f"Error message: {error_msg}")
+        print(f"Phone number: {phone}")
+        
+        # Check for specific Twilio errors and return detailed error info
+        error_info = {'type': error_type, 'message': error_msg, 'code': error_code}
+        
+        error_lower = error_msg.lower()
+        
+        if "exceeded" in error_lower and ("daily" in error_lower or "limit" in error_lower or "50" in error_msg):
+            print("→ Issue: Twilio daily message limit exceeded (50 messages/day for trial accounts)")
+            error_info['user_message'] = "Daily message limit exceeded. Twilio trial accounts are limited to 50 messages per day. Please upgrade your account or wait until tomorrow."
+        elif "not a valid phone number" in error_lower or "invalid" in error_lower or error_code == 21211:
+            print("→ Issue: Invalid phone number format")
+            error_info['user_message'] = f"Invalid phone number format: {phone}. Please ensure it's in E.164 format (e.g., +91XXXXXXXXXX)."
+        elif "authentication" in error_lower or "unauthorized" in error_lower or error_code == 20003:
+            print("→ Issue: Twilio authentication failed - check credentials")
+            error_info['user_message'] = "Twilio authentication failed. Please check your Twilio Account SID and Auth Token."
+        elif "insufficient" in error_lower or "balance" in error_lower or error_code == 20005:
+            print("→ Issue: Insufficient Twilio account balance")
+            error_info['user_message'] = "Insufficient Twilio account balance. Please add funds to your Twilio account."
+        elif "unverified" in error_lower or (error_code == 21610):
+            print("→ Issue: Phone number not verified in Twilio (trial account)")
+            error_info['user_message'] = f"Phone number {phone} is not verified in your Twilio account. For trial accounts, you must verify recipient numbers at https://console.twilio.com/us1/develop/phone-numbers/manage/verified"
+        elif "permission" in error_lower or "not allowed" in error_lower:
+            print("→ Issue: Permission denied")
+            error_info['user_message'] = "Permission denied. Check your Twilio account settings and phone number permissions."
+        elif error_code == 21408:
+            print("→ Issue: Permission to send SMS to this number denied")
+            error_info['user_message'] = f"Permission denied to send SMS to {phone}. This number may be blocked or not verified in your Twilio account."
+        else:
+            error_info['user_message'] = f"Failed to send SMS: {error_msg} (Code: {error_code})"
+        
+        print(f"User-friendly message: {error_info['user_message']}")
+        print(f"{'!'*60}\n")
+        
+        return error_info
@@ -0,0 +1,216 @@
+"""Local stand-in for OpenWeatherMap and Twilio, for load tests and offline runs.
+
+Twilio's Messages and Notify endpoints accept sends and count API calls, so a
+cycle's round trips can be compared without a Twilio account. Listing
+Messages by To returns what the stub accepted for that number.
+
+    python -m aegis.stubs --port 8081 --delay 5
+    OWM_BASE_URL=http://127.0.0.1:8081 TWILIO_BASE_URL=http://127.0.0.1:8081 gunicorn flask_app:app
+"""
+import json
+import math
+import re
+import threading
+import time
+import uuid
+import zlib
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+_MESSAGES_PATH = re.compile(r'^/2010-04-01/Accounts/[^/]+/Messages\.json$')
+_NOTIFY_PATH = re.compile(r'^/v1/Services/[^/]+/Notifications$')
+
+
+def fake_observation(city):
+    """Deterministic per-city weather payload in OpenWeatherMap's current-weather shape."""
+    seed = zlib.crc32(city.lower().encode('utf-8'))
+    return {
+        'cod': 200,
+        'name': city,
+        'id': 1000000 + seed % 1000000,
+        'coord': {'lat': round(8 + seed % 2500 / 100, 2), 'lon': round(68 + seed % 2900 / 100, 2)},
+        'main': {'temp': 18 + seed % 22 + (seed % 10) / 10, 'humidity': 30 + seed % 65,
+                 'pressure': 990 + seed % 30},
+        'wind': {'speed': (seed % 150) / 10},
+        'rain': {'1h': (seed % 40) / 10},
+        'dt': int(time.time()),
+    }
+
+
+def fake_forecast(city, steps=40):
+    """Deterministic 5 day / 3 hour forecast payload: the city's current weather with a daily cycle and rain spells."""
+    base = fake_observation(city)
+    seed = zlib.crc32(city.lower().encode('utf-8'))
+    start = int(time.time()) // 10800 * 10800 + 10800
+    items = []
+    for step in range(steps):
+        hour_angle = math.sin(2 * math.pi * ((step * 3 + seed % 24) % 24) / 24)
+        spell = (step + seed) % 16 >= 10
+        items.append({
+            'dt': start + step * 10800,
+            'main': {'temp': round(base['main']['temp'] + 4 * hour_angle, 1),
+                     'humidity': min(100, base['main']['humidity'] + (20 if spell else 0) - round(8 * hour_angle)),
+                     'pressure': base['main']['pressure'] - (6 if spell else 0)},
+            'wind': {'speed': round(base['wind']['speed'] * (1.5 if spell else 1), 1)},
+            'rain': {'3h': round(3 * (seed % 40) / 10 + (12 if spell else 0), 1)},
+        })
+    return {'cod': '200', 'cnt': len(items), 'list': items, 'city': {'id': base['id'], 'name': city}}
+
+
+def fake_air_pollution(lat, lon):
+    """Deterministic air-pollution payload for a location."""
+    seed = zlib.crc32(f'{float(lat):.2f},{float(lon):.2f}'.encode('utf-8'))
+    return {
+        'coord': {'lat': float(lat), 'lon': float(lon)},
+        'list': [{'main': {'aqi': 1 + seed % 5},
+                  'components': {'pm2_5': round(5 + seed % 1500 / 10, 1), 'pm10': round(10 + seed % 2500 / 10, 1)},
+                  'dt': int(time.time())}],
+    }
+
+
+class StubState:
+    """Knobs and counters shared by the stub handler."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.fail_cities = set()
+        self.fail_ids = set()
+        self.cities_by_id = {}
+        self.fail_aqi = False
+        self.fail_notify = False
+        self.fail_phones = set()
+        self.sms = []           # (to, body) for every message accepted, single or bulk
+        self.accepted_at = {}   # to -> [accept time, ...]
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def count(self, path):
+        with self.lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+
+    def deliver(self, recipients, body):
+        with self.lock:
+            self.sms.extend((to, body) for to in recipients)
+            now = time.time()
+            for to in recipients:
+                self.accepted_at.setdefault(to, []).append(now)
+
+    def twilio_calls(self):
+        return {path: count for path, count in self.calls.items() if path.startswith('twilio ')}
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # client gave up (e.g. read timeout)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            state.count(url.path)
+            if state.delay:
+                time.sleep(state.delay)
+
+            if _MESSAGES_PATH.match(url.path):
+                state.count('twilio messages list')
+                to = params.get('To', '')
+                with state.lock:
+                    accepted = sorted(state.accepted_at.get(to, []), reverse=True)
+                messages = [{'sid': 'SM' + uuid.uuid4().hex, 'to': to, 'status': 'queued',
+                             'date_created': formatdate(ts, usegmt=True)} for ts in accepted]
+                return self._send(200, {'messages': messages, 'page': 0, 'page_size': 50,
+                                        'uri': url.path, 'next_page_uri': None})
+
+            if url.path == '/data/2.5/weather':
+                city = params.get('q', '')
+                if not city or city.lower() in state.fail_cities:
+                    return self._send(404, {'cod': '404', 'message': 'city not found'})
+                observation = fake_observation(city)
+                state.cities_by_id[observation['id']] = city
+                return self._send(200, observation)
+
+            if url.path == '/data/2.5/forecast':
+                city = params.get('q') or state.cities_by_id.get(int(params.get('id') or 0), '')
+                if not city or city.lower() in state.fail_cities:
+                    return self._send(404, {'cod': '404', 'message': 'city not found'})
+                return self._send(200, fake_forecast(city))
+
+            if url.path == '/data/2.5/air_pollution':
+                if state.fail_aqi or 'lat' not in params or 'lon' not in params:
+                    return self._send(500, {'cod': 500, 'message': 'internal error'})
+                return self._send(200, fake_air_pollution(params['lat'], params['lon']))
+
+            if url.path == '/data/2.5/group':
+                ids = [int(i) for i in params.get('id', '').split(',') if i]
+                if not ids or len(ids) > 20:
+                    return self._send(400, {'cod': '400', 'message': 'between 1 and 20 ids required'})
+                items = [fake_observation(state.cities_by_id[i]) for i in ids
+                         if i in state.cities_by_id and i not in state.fail_ids]
+                return self._send(200, {'cnt': len(items), 'list': items})
+            return self._send(404, {'cod': '404', 'message': f'unknown path {url.path}'})
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            length = int(self.headers.get('Content-Length') or 0)
+            form = parse_qs(self.rfile.read(length).decode('utf-8'))
+            if state.delay:
+                time.sleep(state.delay)
+
+            if _MESSAGES_PATH.match(path):
+                state.count('twilio messages')
+                to, body = form.get('To', [''])[0], form.get('Body', [''])[0]
+                if to in state.fail_phones:
+                    return self._send(400, {'code': 21211, 'status': 400,
+                                            'message': f"The 'To' number {to} is not a valid phone number."})
+                state.deliver([to], body)
+                return self._send(201, {'sid': 'SM' + uuid.uuid4().hex, 'status': 'queued', 'to': to,
+                                        'body': body, 'price': None})
+
+            if _NOTIFY_PATH.match(path):
+                state.count('twilio notify')
+                if state.fail_notify:
+                    return self._send(500, {'code': 20500, 'status': 500, 'message': 'Internal Server Error'})
+                bindings = [json.loads(binding) for binding in form.get('ToBinding', [])]
+                state.deliver([binding['address'] for binding in bindings], form.get('Body', [''])[0])
+                return self._send(201, {'sid': 'NT' + uuid.uuid4().hex, 'body': form.get('Body', [''])[0],
+                                        'priority': 'high'})
+            return self._send(404, {'code': 20404, 'status': 404, 'message': f'unknown path {path}'})
+
+    return Handler
+
+
+def start_stub(port=0, delay=0.0):
+    """Start the stub on a daemon thread. Returns (server, state); server.server_port is the bound port."""
+    state = StubState(delay)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Local OpenWeatherMap and Twilio stand-in')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds to wait before every response')
+    args = parser.parse_args()
+    server, state = start_stub(args.port, args.delay)
+    print(f"Stub OpenWeatherMap and Twilio on http://127.0.0.1:{server.server_port} (delay {args.delay}s)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(f"Twilio API calls: {state.twilio_calls() or 'none'}, {len(state.sms)} messages accepted")
+        server.shutdown()
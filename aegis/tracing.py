@@ -0,0 +1,182 @@
+"""Stage timings for alert cycles: where a send-to-all run or scheduled batch spends its time.
+
+A CycleTrace collects spans for the stages of one cycle (user load, phone
+validation, weather fetch, prediction, message build, SMS send), tagged with
+the city and phone they were for. finish() reduces them to per-stage totals,
+p50/p99 and the slowest cities and users, and writes that summary to
+ALERT_TRACES_DIR (default alert_traces/), one small JSON file per cycle, keeping
+the newest ALERT_TRACE_KEEP. The alerts page shows them.
+
+With ALERT_TRACE_EXPORT set to a file path, every span is also appended there
+in Chrome trace-event format; open the file in https://ui.perfetto.dev or
+chrome://tracing to see the cycle on a timeline.
+
+    python -m aegis.tracing          # print the kept cycles
+"""
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from aegis.dispatch import percentile
+
+TRACES_DIR = os.getenv('ALERT_TRACES_DIR', 'alert_traces')
+KEEP_TRACES = int(os.getenv('ALERT_TRACE_KEEP', '20'))
+EXPORT_FILE = os.getenv('ALERT_TRACE_EXPORT', '')
+SLOWEST = 5
+# Display order; stages a cycle doesn't run are left out of its summary
+STAGES = ('load_users', 'validate_phones', 'risk_view', 'weather', 'predict', 'forecast', 'message', 'send')
+
+_TRACE_ID = re.compile(r'^[0-9]{8}-[0-9]{6}-[0-9a-f]{6}$')
+_export_lock = threading.Lock()
+
+
+class CycleTrace:
+    """Spans of one alert cycle; span() and add() are thread-safe (sends run on dispatcher threads)."""
+
+    def __init__(self, source, clock=time.perf_counter):
+        self.source = source
+        self.clock = clock
+        self.id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self.started_at = time.time()
+        self.spans = []     # (stage, start offset, seconds, thread id, city, phone)
+        self._started = clock()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage, city=None, phone=None):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.add(stage, self.clock() - start, city, phone, start=start)
+
+    def add(self, stage, seconds, city=None, phone=None, start=None):
+        offset = (start if start is not None else self.clock() - seconds) - self._started
+        with self._lock:
+            self.spans.append((stage, offset, seconds, threading.get_ident(), city, phone))
+
+    def summary(self, **counts):
+        """Per-stage totals and percentiles plus the slowest cities and users, as a JSON-able dict."""
+        with self._lock:
+            spans = list(self.spans)
+        by_stage, by_city, by_phone = {}, {}, {}
+        for stage, _, seconds, _, city, phone in spans:
+            by_stage.setdefault(stage, []).append(seconds)
+            if city:
+                by_city[city] = by_city.get(city, 0.0) + seconds
+            if phone:
+                by_phone[phone] = by_phone.get(phone, 0.0) + seconds
+        wall = self.clock() - self._started
+        stages = []
+        for stage in sorted(by_stage, key=lambda name: STAGES.index(name) if name in STAGES else len(STAGES)):
+            durations = by_stage[stage]
+            stages.append({
+                'stage': stage,
+                'count': len(durations),
+                'total_seconds': round(sum(durations), 4),
+                'p50_ms': round(percentile(durations, 50) * 1000, 2),
+                'p99_ms': round(percentile(durations, 99) * 1000, 2),
+            })
+
+        def slowest(totals):
+            return [{'name': name, 'seconds': round(seconds, 4)}
+                    for name, seconds in sorted(totals.items(), key=lambda item: -item[1])[:SLOWEST]]
+
+        return {
+            'id': self.id,
+            'source': self.source,
+            'started_at': datetime.fromtimestamp(self.started_at).strftime('%Y-%m-%d %H:%M:%S'),
+            'seconds': round(wall, 3),
+            'counts': counts,
+            'stages': stages,
+            'slowest_cities': slowest(by_city),
+            'slowest_users': slowest(by_phone),
+        }
+
+    def finish(self, traces_dir=TRACES_DIR, export_file=EXPORT_FILE, **counts):
+        """Save the summary (and export the spans if configured). Returns the summary."""
+        summary = self.summary(**counts)
+        save_summary(summary, traces_dir)
+        if export_file:
+            self.export(export_file)
+        stages = ', '.join(f"{stage['stage']} {stage['total_seconds']}s" for stage in summary['stages'])
+        print(f"[Trace] {self.source} cycle {self.id}: {summary['seconds']}s ({stages})")
+        return summary
+
+    def export(self, path):
+        """Append the spans to a Chrome trace-event file (JSON array format; the closing ] is optional)."""
+        with self._lock:
+            spans = list(self.spans)
+        base_us = self.started_at * 1e6
+        events = [{'name': self.source + ' cycle', 'ph': 'X', 'pid': os.getpid(), 'tid': 0, 'ts': round(base_us),
+                   'dur': round((self.clock() - self._started) * 1e6), 'args': {'id': self.id}}]
+        for stage, offset, seconds, tid, city, phone in spans:
+            args = {key: value for key, value in (('city', city), ('phone', phone)) if value}
+            events.append({'name': stage, 'ph': 'X', 'pid': os.getpid(), 'tid': tid,
+                           'ts': round(base_us + offset * 1e6), 'dur': round(seconds * 1e6), 'args': args})
+        try:
+            with _export_lock:
+                new = not os.path.exists(path) or os.path.getsize(path) == 0
+                with open(path, 'a') as file:
+                    if new:
+                        file.write('[\n')
+                    file.write(''.join(json.dumps(event) + ',\n' for event in events))
+        except OSError as e:
+            print(f"[Trace] Could not export to {path}: {e}")
+
+
+def save_summary(summary, traces_dir=TRACES_DIR, keep=KEEP_TRACES):
+    try:
+        os.makedirs(traces_dir, exist_ok=True)
+        path = os.path.join(traces_dir, summary['id'] + '.json')
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(summary, file)
+        os.replace(tmp_path, path)
+        for name in sorted(_trace_files(traces_dir), reverse=True)[keep:]:
+            os.remove(os.path.join(traces_dir, name))
+    except OSError as e:
+        print(f"[Trace] Could not save cycle {summary['id']}: {e}")
+
+
+def _trace_files(traces_dir):
+    return [name for name in os.listdir(traces_dir)
+            if name.endswith('.json') and _TRACE_ID.match(name[:-len('.json')])]
+
+
+def recent_cycles(traces_dir=TRACES_DIR, limit=KEEP_TRACES):
+    """Saved cycle summaries, newest first."""
+    if not os.path.isdir(traces_dir):
+        return []
+    cycles = []
+    for name in sorted(_trace_files(traces_dir), reverse=True)[:limit]:
+        try:
+            with open(os.path.join(traces_dir, name)) as file:
+                cycles.append(json.load(file))
+        except (OSError, ValueError):
+            continue  # pruned or half-written by another process
+    return cycles
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Show stage timings of recent alert cycles')
+    parser.add_argument('--dir', default=TRACES_DIR)
+    parser.add_argument('--limit', type=int, default=5)
+    args = parser.parse_args()
+    cycles = recent_cycles(args.dir, args.limit)
+    if not cycles:
+        print(f"No traced cycles in {args.dir}")
+    for cycle in cycles:
+        print(f"{cycle['started_at']}  {cycle['source']}  {cycle['seconds']}s  {cycle['counts']}")
+        for stage in cycle['stages']:
+            print(f"    {stage['stage']:<16} n={stage['count']:<6} total={stage['total_seconds']:<9}s "
+                  f"p50={stage['p50_ms']}ms p99={stage['p99_ms']}ms")
+        for label, key in (('cities', 'slowest_cities'), ('users', 'slowest_users')):
+            if cycle[key]:
+                print(f"    slowest {label}: " + ', '.join(f"{row['name']} {row['seconds']}s" for row in cycle[key]))
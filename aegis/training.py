@@ -0,0 +1,452 @@
+"""Model training pipeline: parallel fits, pluggable estimators, atomic artifact writes.
+
+Two modes: 'memory' loads the whole dataset with pandas (fine for the 500-row
+CSV); 'stream' reads it in typed chunks and trains on a weighted histogram of
+binned feature vectors, so peak memory depends on the number of distinct bins
+rather than the number of rows.
+"""
+import multiprocessing
+import os
+import pickle
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+DATASET_FILE = 'climate_health_precaution_dataset_500.csv'
+MODEL_FILE = 'health_model.pkl'
+DATASET_COLUMNS = ['City', 'Temperature', 'Humidity', 'AQI', 'Rainfall', 'WindSpeed', 'Pressure', 'Date', 'DayType',
+                   'Disease_Risk', 'Risk_Level', 'Precaution_1', 'Precaution_2', 'Precaution_3']
+FEATURES = ['Temperature', 'Humidity', 'AQI', 'Rainfall', 'WindSpeed', 'Pressure']
+PRECAUTION_COLUMNS = ['Disease_Risk', 'Risk_Level', 'Precaution_1', 'Precaution_2', 'Precaution_3']
+
+DEFAULT_ESTIMATOR = 'gradient_boosting'
+DEFAULT_STREAM_ESTIMATOR = 'hist_gradient_boosting'
+
+# Typed columns for chunked reads (float32 features, categorical strings)
+DATASET_DTYPES = {
+    'City': 'category', 'Temperature': 'float32', 'Humidity': 'float32', 'AQI': 'float32',
+    'Rainfall': 'float32', 'WindSpeed': 'float32', 'Pressure': 'float32', 'Date': 'str', 'DayType': 'category',
+    'Disease_Risk': 'category', 'Risk_Level': 'category',
+    'Precaution_1': 'str', 'Precaution_2': 'str', 'Precaution_3': 'str',
+}
+
+# Histogram bin width per feature for streaming training
+STREAM_BIN_WIDTHS = {
+    'Temperature': 0.5,
+    'Humidity': 1,
+    'AQI': 5,
+    'Rainfall': 0.5,
+    'WindSpeed': 0.5,
+    'Pressure': 1,
+}
+
+
+def make_estimator(name):
+    """Build an unfitted classifier by name (MODEL_ESTIMATOR)."""
+    if name == 'gradient_boosting':
+        from sklearn.ensemble import GradientBoostingClassifier
+        return GradientBoostingClassifier(n_estimators=100, random_state=42)
+    if name == 'hist_gradient_boosting':
+        from sklearn.ensemble import HistGradientBoostingClassifier
+        return HistGradientBoostingClassifier(max_iter=100, random_state=42)
+    if name == 'random_forest':
+        from sklearn.ensemble import RandomForestClassifier
+        return RandomForestClassifier(n_estimators=100, random_state=42)
+    raise ValueError(f"Unknown estimator '{name}'. Use gradient_boosting, hist_gradient_boosting or random_forest.")
+
+
+def training_config():
+    """Training settings from environment variables."""
+    return {
+        'estimator': os.environ.get('MODEL_ESTIMATOR', DEFAULT_ESTIMATOR),
+        'parallel': os.environ.get('MODEL_TRAIN_PARALLEL', 'true').lower() in ('1', 'true', 'yes'),
+        'mode': os.environ.get('MODEL_TRAIN_MODE', 'memory'),
+        'chunksize': int(os.environ.get('MODEL_TRAIN_CHUNKSIZE', '200000')),
+        'max_cells': int(os.environ.get('MODEL_STREAM_MAX_CELLS', '200000')),
+        'observations': os.environ.get('MODEL_TRAIN_OBSERVATIONS', 'false').lower() in ('1', 'true', 'yes'),
+    }
+
+
+def _fit_one(target, estimator_name, X, y, X_train, y_train, X_test, y_test, sample_weight=None):
+    """Fit one model (runs in a worker process). Returns (fitted_model, report)."""
+    report = {'target': target, 'estimator': estimator_name}
+
+    if sample_weight is not None:
+        # Streaming mode: X is a weighted histogram and the holdout was set aside while reading
+        model = make_estimator(estimator_name)
+        start = time.perf_counter()
+        model.fit(X, y, sample_weight=sample_weight)
+        report['fit_seconds'] = round(time.perf_counter() - start, 3)
+        report['histogram_rows'] = len(X)
+        if X_test is not None and len(X_test):
+            start = time.perf_counter()
+            predictions = model.predict(X_test)
+            report['predict_ms_per_row'] = round((time.perf_counter() - start) * 1000 / len(X_test), 4)
+            report['holdout_accuracy'] = round(float((predictions == y_test).mean()), 4)
+            report['holdout_rows'] = len(X_test)
+
+    elif X_test is not None and len(X_test):
+        holdout_model = make_estimator(estimator_name)
+        holdout_model.fit(X_train, y_train)
+        start = time.perf_counter()
+        predictions = holdout_model.predict(X_test)
+        report['predict_ms_per_row'] = round((time.perf_counter() - start) * 1000 / len(X_test), 4)
+        report['holdout_accuracy'] = round(float((predictions == y_test).mean()), 4)
+        report['holdout_rows'] = len(X_test)
+
+    if sample_weight is None:
+        # Final model is fitted on all rows
+        model = make_estimator(estimator_name)
+        start = time.perf_counter()
+        model.fit(X, y)
+        report['fit_seconds'] = round(time.perf_counter() - start, 3)
+
+    # Single-row latency is what /predict and alert loops actually pay
+    single = X.iloc[[0]] if hasattr(X, 'iloc') else X[:1]
+    start = time.perf_counter()
+    for _ in range(20):
+        model.predict(single)
+    report['predict_ms_single'] = round((time.perf_counter() - start) * 1000 / 20, 3)
+    return model, report
+
+
+def _pool_context():
+    """Start method for the fit processes: forkserver where available, else spawn.
+
+    Never fork: the web app and the worker run background threads (model
+    preload, risk view, forecast, observation writer, weather I/O), and a
+    forked child can inherit a lock one of them held and hang. The forkserver
+    imports only this module, so children start from a clean, single-threaded
+    process. Like spawn, each child still imports the main module as
+    __mp_main__; flask_app only starts its threads outside that import.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(['aegis.training'])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def fit_models(X, y_disease, y_risklevel, estimator=DEFAULT_ESTIMATOR, holdout=0.2, parallel=True):
+    """Fit the disease and risk models (in parallel processes when possible).
+
+    Returns (gb_disease, gb_risk, reports).
+    """
+    if holdout and 0 < holdout < 1:
+        from sklearn.model_selection import train_test_split
+        idx_train, idx_test = train_test_split(range(len(X)), test_size=holdout, random_state=42)
+        splits = {
+            'disease': (X.iloc[idx_train], y_disease[idx_train], X.iloc[idx_test], y_disease[idx_test]),
+            'risk': (X.iloc[idx_train], y_risklevel[idx_train], X.iloc[idx_test], y_risklevel[idx_test]),
+        }
+    else:
+        splits = {'disease': (None, None, None, None), 'risk': (None, None, None, None)}
+
+    jobs = {
+        'disease': (X, y_disease) + splits['disease'],
+        'risk': (X, y_risklevel) + splits['risk'],
+    }
+
+    return _run_fits(jobs, estimator, parallel)
+
+
+def _run_fits(jobs, estimator, parallel, **kwargs):
+    """Run one _fit_one per target, in separate processes when parallel.
+
+    If the processes can't be started or die (e.g. a main script without an
+    `if __name__ == '__main__'` guard), the fits run in-process instead.
+    """
+    results = None
+    if parallel:
+        try:
+            with ProcessPoolExecutor(max_workers=2, mp_context=_pool_context()) as executor:
+                futures = {target: executor.submit(_fit_one, target, estimator, *args, **kwargs)
+                           for target, args in jobs.items()}
+                results = {target: future.result() for target, future in futures.items()}
+        except (BrokenProcessPool, OSError) as e:
+            print(f"Training processes failed ({e}); fitting in-process")
+    if results is None:
+        results = {target: _fit_one(target, estimator, *args, **kwargs) for target, args in jobs.items()}
+        if parallel:
+            for _, report in results.values():
+                report['in_process'] = True
+
+    reports = [results['disease'][1], results['risk'][1]]
+    return results['disease'][0], results['risk'][0], reports
+
+
+def write_bundle_atomic(bundle, path=MODEL_FILE):
+    """Pickle bundle to a temp file in the same directory, then rename over path."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.health_model.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            pickle.dump(bundle, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.chmod(tmp_path, 0o644)  # mkstemp creates 0600 files
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def train_bundle(dataset_file=DATASET_FILE, estimator=None, holdout=0, parallel=None):
+    """Train both models from the dataset CSV and return the model bundle.
+
+    Missing settings come from training_config(). The bundle carries a
+    'training_report' with per-model fit time, latency and, when holdout is
+    set (the CLI's --holdout), holdout accuracy.
+    """
+    import pandas as pd
+    from sklearn.preprocessing import LabelEncoder
+
+    config = training_config()
+    estimator = estimator or config['estimator']
+    parallel = config['parallel'] if parallel is None else parallel
+
+    df = pd.read_csv(dataset_file)
+    df.columns = DATASET_COLUMNS
+
+    X = df[FEATURES]
+    le_disease = LabelEncoder()
+    le_risklevel = LabelEncoder()
+    y_disease = le_disease.fit_transform(df['Disease_Risk'])
+    y_risklevel = le_risklevel.fit_transform(df['Risk_Level'])
+
+    start = time.perf_counter()
+    gb_disease, gb_risk, reports = fit_models(X, y_disease, y_risklevel, estimator=estimator,
+                                              holdout=holdout, parallel=parallel)
+    total_seconds = round(time.perf_counter() - start, 3)
+
+    return {
+        'gb_disease': gb_disease,
+        'gb_risk': gb_risk,
+        'le_disease': le_disease,
+        'le_risklevel': le_risklevel,
+        'precautions': df[PRECAUTION_COLUMNS].drop_duplicates(),
+        'training_report': {
+            'rows': len(df),
+            'mode': 'memory',
+            'estimator': estimator,
+            'parallel': bool(parallel),
+            'total_seconds': total_seconds,
+            'models': reports,
+        },
+    }
+
+
+def iter_dataset_chunks(dataset_file=DATASET_FILE, chunksize=200000):
+    """Yield typed DataFrame chunks of the training dataset."""
+    import pandas as pd
+    reader = pd.read_csv(dataset_file, chunksize=chunksize, header=0, names=DATASET_COLUMNS,
+                         dtype=DATASET_DTYPES, usecols=FEATURES + PRECAUTION_COLUMNS)
+    for chunk in reader:
+        yield chunk
+
+
+def _coarsen(counts, n_features):
+    """Merge histogram cells into bins twice as wide (floor(b / 2) is exact for floor bins)."""
+    merged = {}
+    for key, count in counts.items():
+        new_key = tuple(b // 2 for b in key[:n_features]) + key[n_features:]
+        merged[new_key] = merged.get(new_key, 0) + count
+    return merged
+
+
+def train_bundle_streaming(dataset_file=DATASET_FILE, estimator=None, holdout=0, parallel=None,
+                           chunksize=None, chunks=None, max_cells=None, max_holdout_rows=20000):
+    """Train both models without loading the dataset into memory.
+
+    Each chunk's features are binned to STREAM_BIN_WIDTHS and counted per
+    (bins, disease, risk) cell; the models are fitted on bin centres weighted by
+    those counts. Whenever the histogram exceeds max_cells, every bin width is
+    doubled, so memory stays bounded however many rows are read. Every
+    round(1/holdout)-th row is set aside (up to max_holdout_rows) for the
+    accuracy report. The precaution table is built
+    incrementally (first row seen per disease/risk pair). `chunks` may be any
+    iterable of DataFrames with the dataset columns, e.g. another observation source.
+    """
+    import numpy as np
+    import pandas as pd
+    from sklearn.preprocessing import LabelEncoder
+
+    config = training_config()
+    estimator = estimator or os.environ.get('MODEL_ESTIMATOR', DEFAULT_STREAM_ESTIMATOR)
+    parallel = config['parallel'] if parallel is None else parallel
+    chunksize = chunksize or config['chunksize']
+    max_cells = max_cells or config['max_cells']
+    if chunks is None:
+        chunks = iter_dataset_chunks(dataset_file, chunksize)
+
+    widths = np.array([STREAM_BIN_WIDTHS[name] for name in FEATURES], dtype='float64')
+    holdout_every = int(round(1 / holdout)) if holdout and 0 < holdout < 1 else 0
+    counts = {}
+    precautions = {}
+    holdout_parts = []
+    holdout_kept = 0
+    rows = 0
+
+    start = time.perf_counter()
+    for chunk in chunks:
+        chunk = chunk.dropna(subset=FEATURES + ['Disease_Risk', 'Risk_Level'])
+        if chunk.empty:
+            continue
+        positions = np.arange(rows, rows + len(chunk))
+        rows += len(chunk)
+
+        for row in chunk[PRECAUTION_COLUMNS].drop_duplicates(['Disease_Risk', 'Risk_Level']).itertuples(index=False):
+            precautions.setdefault((str(row[0]), str(row[1])), [str(value) for value in row])
+
+        if holdout_every:
+            is_holdout = positions % holdout_every == 0
+            if holdout_kept < max_holdout_rows:
+                part = chunk.loc[is_holdout, FEATURES + ['Disease_Risk', 'Risk_Level']].head(max_holdout_rows - holdout_kept)
+                holdout_parts.append(part)
+                holdout_kept += len(part)
+            chunk = chunk.loc[~is_holdout]
+
+        bins = np.floor(chunk[FEATURES].to_numpy(dtype='float64') / widths).astype('int32')
+        cells = pd.DataFrame(bins, columns=FEATURES)
+        cells['Disease_Risk'] = chunk['Disease_Risk'].astype(str).to_numpy()
+        cells['Risk_Level'] = chunk['Risk_Level'].astype(str).to_numpy()
+        for key, count in cells.groupby(FEATURES + ['Disease_Risk', 'Risk_Level'], sort=False).size().items():
+            counts[key] = counts.get(key, 0) + int(count)
+        while len(counts) > max_cells:
+            counts = _coarsen(counts, len(FEATURES))
+            widths = widths * 2
+    read_seconds = round(time.perf_counter() - start, 3)
+
+    if not counts:
+        raise ValueError(f"No usable rows in {dataset_file}")
+
+    keys = list(counts.keys())
+    X = pd.DataFrame([key[:len(FEATURES)] for key in keys], columns=FEATURES)
+    X = (X.astype('float64') + 0.5) * widths  # bin centres
+    weights = np.array([counts[key] for key in keys], dtype='float64')
+    le_disease = LabelEncoder().fit([key[-2] for key in keys] + [key[0] for key in precautions])
+    le_risklevel = LabelEncoder().fit([key[-1] for key in keys] + [key[1] for key in precautions])
+    y_disease = le_disease.transform([key[-2] for key in keys])
+    y_risklevel = le_risklevel.transform([key[-1] for key in keys])
+    del counts, keys
+
+    X_test = y_d_test = y_r_test = None
+    if holdout_parts:
+        test = pd.concat(holdout_parts, ignore_index=True)
+        X_test = test[FEATURES].astype('float64')
+        y_d_test = le_disease.transform(test['Disease_Risk'].astype(str))
+        y_r_test = le_risklevel.transform(test['Risk_Level'].astype(str))
+
+    jobs = {
+        'disease': (X, y_disease, None, None, X_test, y_d_test),
+        'risk': (X, y_risklevel, None, None, X_test, y_r_test),
+    }
+    start = time.perf_counter()
+    gb_disease, gb_risk, reports = _run_fits(jobs, estimator, parallel, sample_weight=weights)
+    fit_seconds = round(time.perf_counter() - start, 3)
+
+    return {
+        'gb_disease': gb_disease,
+        'gb_risk': gb_risk,
+        'le_disease': le_disease,
+        'le_risklevel': le_risklevel,
+        'precautions': pd.DataFrame(list(precautions.values()), columns=PRECAUTION_COLUMNS),
+        'training_report': {
+            'rows': rows,
+            'mode': 'stream',
+            'estimator': estimator,
+            'parallel': bool(parallel),
+            'histogram_cells': len(X),
+            'bin_widths': dict(zip(FEATURES, widths.tolist())),
+            'read_seconds': read_seconds,
+            'total_seconds': round(read_seconds + fit_seconds, 3),
+            'models': reports,
+        },
+    }
+
+
+def train_from_config(dataset_file=DATASET_FILE):
+    """Train with the mode chosen by MODEL_TRAIN_MODE ('memory' or 'stream').
+
+    With MODEL_TRAIN_OBSERVATIONS=true, labelled readings from the observation
+    store are streamed in after the dataset (always in 'stream' mode).
+    """
+    config = training_config()
+    if config['observations']:
+        import itertools
+        from aegis.observations import training_chunks
+        chunks = itertools.chain(iter_dataset_chunks(dataset_file, config['chunksize']), training_chunks())
+        return train_bundle_streaming(dataset_file, chunks=chunks)
+    if config['mode'] == 'stream':
+        return train_bundle_streaming(dataset_file)
+    return train_bundle(dataset_file)
+
+
+def write_synthetic_dataset(path, rows, source=DATASET_FILE, chunksize=500000, seed=42):
+    """Write a large synthetic dataset by resampling source rows with feature noise (for profiling)."""
+    import numpy as np
+    import pandas as pd
+
+    base = pd.read_csv(source)
+    base.columns = DATASET_COLUMNS
+    rng = np.random.default_rng(seed)
+    noise = {'Temperature': 1.0, 'Humidity': 3, 'AQI': 10, 'Rainfall': 2, 'WindSpeed': 1, 'Pressure': 3}
+    written = 0
+    while written < rows:
+        n = min(chunksize, rows - written)
+        chunk = base.iloc[rng.integers(0, len(base), n)].reset_index(drop=True)
+        for name, scale in noise.items():
+            chunk[name] = (chunk[name] + rng.normal(0, scale, n)).round(1).clip(lower=0)
+        chunk.to_csv(path, mode='w' if written == 0 else 'a', header=written == 0, index=False)
+        written += n
+    return written
+
+
+def print_report(report):
+    print(f"Training report: {report['rows']} rows, mode={report.get('mode', 'memory')}, "
+          f"estimator={report['estimator']}, parallel={report['parallel']}, total {report['total_seconds']}s")
+    for model in report['models']:
+        details = ', '.join(f"{key}={value}" for key, value in model.items() if key != 'target')
+        print(f"  {model['target']}: {details}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Train the Aegis health risk model.')
+    parser.add_argument('estimator', nargs='?', help='gradient_boosting, hist_gradient_boosting or random_forest')
+    parser.add_argument('--dataset', default=DATASET_FILE)
+    parser.add_argument('--holdout', type=float, default=0.2,
+                        help='fraction held out for the accuracy report (memory mode fits each model twice; 0 disables)')
+    parser.add_argument('--stream', action='store_true', help='out-of-core chunked training')
+    parser.add_argument('--chunksize', type=int, default=None)
+    parser.add_argument('--profile', action='store_true', help='report peak traced and resident memory')
+    parser.add_argument('--synthetic', type=int, metavar='ROWS',
+                        help='first write a synthetic dataset of ROWS rows to --dataset')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        print(f"Writing {args.synthetic} synthetic rows to {args.dataset}...")
+        write_synthetic_dataset(args.dataset, args.synthetic)
+
+    if args.profile:
+        import tracemalloc
+        tracemalloc.start()
+
+    if args.stream:
+        bundle = train_bundle_streaming(args.dataset, estimator=args.estimator, holdout=args.holdout,
+                                        chunksize=args.chunksize)
+    else:
+        bundle = train_bundle(args.dataset, estimator=args.estimator, holdout=args.holdout)
+    write_bundle_atomic(bundle)
+    print_report(bundle['training_report'])
+    print(f"Model written to {MODEL_FILE}")
+
+    if args.profile:
+        import resource
+        _, peak = tracemalloc.get_traced_memory()
+        print(f"Peak traced Python memory: {peak / 1024 ** 2:.1f} MiB")
+        print(f"Peak resident memory: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB "
+              f"(fit workers: {resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024:.1f} MiB)")
@@ -0,0 +1,144 @@
+"""users.csv store: phones and cities are normalized once at write time and validated by migration.
+
+pandas is imported on first use so the alert worker starts without it.
+"""
+import os
+
+from aegis.cities import canonical_city
+from aegis.phones import normalize_phone, is_canonical
+from aegis.scheduler import DEFAULT_CADENCE, parse_cadence
+
+USERS_FILE = 'users.csv'
+# city holds the canonical name, city_raw what the user typed, cadence the alert schedule
+USER_COLUMNS = ['phone', 'password', 'city', 'phone_status', 'city_raw', 'cadence']
+
+# phone_status values
+PHONE_OK = 'ok'
+PHONE_INVALID = 'invalid'
+PHONE_DUPLICATE = 'duplicate'
+
+
+def _read(users_file):
+    import pandas as pd
+    return pd.read_csv(users_file, dtype={'phone': str, 'phone_status': str, 'city': str, 'city_raw': str,
+                                          'cadence': str}, keep_default_na=False)
+
+
+def _valid_cadence(cadence):
+    if not cadence:
+        return False
+    try:
+        parse_cadence(cadence)
+    except ValueError:
+        return False
+    return True
+
+
+def migrate_users(users_file=USERS_FILE):
+    """Normalize every stored phone to E.164, flag invalid/duplicate rows and canonicalize cities.
+
+    Rows without a valid alert cadence get the default (hourly).
+
+    Idempotent: rows that are already canonical are left untouched. Returns a
+    dict with counts, or None if there is no users file.
+    """
+    if not os.path.exists(users_file):
+        return None
+
+    df = _read(users_file)
+    if 'phone_status' not in df.columns:
+        df['phone_status'] = ''
+    if 'city_raw' not in df.columns:
+        df['city_raw'] = df['city']
+    if 'cadence' not in df.columns:
+        df['cadence'] = ''
+
+    report = {'total': len(df), 'normalized': 0, 'invalid': 0, 'duplicate': 0, 'cities_renamed': 0,
+              'cadence_defaulted': 0}
+    seen = set()
+    for idx, row in df.iterrows():
+        if not _valid_cadence(row['cadence']):
+            df.at[idx, 'cadence'] = DEFAULT_CADENCE
+            report['cadence_defaulted'] += 1
+
+        city = canonical_city(row['city_raw'] or row['city'])
+        if city != row['city']:
+            df.at[idx, 'city'] = city
+            report['cities_renamed'] += 1
+
+        raw_phone = row['phone']
+        phone = raw_phone if is_canonical(raw_phone) else normalize_phone(raw_phone)
+        if not phone:
+            df.at[idx, 'phone_status'] = PHONE_INVALID
+            report['invalid'] += 1
+            continue
+        if phone != raw_phone:
+            df.at[idx, 'phone'] = phone
+            report['normalized'] += 1
+        if phone in seen:
+            df.at[idx, 'phone_status'] = PHONE_DUPLICATE
+            report['duplicate'] += 1
+        else:
+            df.at[idx, 'phone_status'] = PHONE_OK
+            seen.add(phone)
+
+    save_users(df[USER_COLUMNS + [c for c in df.columns if c not in USER_COLUMNS]], users_file)
+    return report
+
+
+def load_users(users_file=USERS_FILE):
+    """Load all users, migrating legacy files that predate the current columns."""
+    if not os.path.exists(users_file):
+        import pandas as pd
+        return pd.DataFrame(columns=USER_COLUMNS)
+    df = _read(users_file)
+    if any(column not in df.columns for column in USER_COLUMNS):
+        report = migrate_users(users_file)
+        print(f"[Users] Migrated {users_file}: {report}")
+        df = _read(users_file)
+    return df
+
+
+def alertable_users(df):
+    """Rows whose stored phone is canonical and not flagged."""
+    return df[df['phone_status'] == PHONE_OK]
+
+
+def save_users(df, users_file=USERS_FILE):
+    """Rewrite the users file."""
+    df.to_csv(users_file, index=False)
+
+
+def phone_registered(phone, users_file=USERS_FILE):
+    """True if a canonical phone is already in the users file."""
+    df = load_users(users_file)
+    return phone in df['phone'].values
+
+
+def append_user(phone, password, city, cadence=DEFAULT_CADENCE, users_file=USERS_FILE):
+    """Append a user; phone must already be normalized with normalize_phone().
+
+    city is stored canonicalized, with the typed name kept in city_raw.
+    cadence must pass parse_cadence().
+    """
+    import pandas as pd
+
+    parse_cadence(cadence)
+    if os.path.exists(users_file):
+        load_users(users_file)  # make sure the file has the current schema
+    user_data = pd.DataFrame([[phone, password, canonical_city(city), PHONE_OK, city.strip(), cadence]],
+                             columns=USER_COLUMNS)
+    if os.path.exists(users_file):
+        user_data.to_csv(users_file, mode='a', header=False, index=False)
+    else:
+        user_data.to_csv(users_file, index=False)
+
+
+if __name__ == '__main__':
+    import sys
+    path = sys.argv[1] if len(sys.argv) > 1 else USERS_FILE
+    result = migrate_users(path)
+    if result is None:
+        print(f"No users file at {path}")
+    else:
+        print(f"Migrated {path}: {result}")
@@ -0,0 +1,453 @@
+"""OpenWeatherMap client shared by the web app and alert loops.
+
+Uses one pooled requests.Session with separate connect/read timeouts, so a slow
+upstream holds a worker thread (or greenlet under gevent) for at most
+WEATHER_CONNECT_TIMEOUT + WEATHER_READ_TIMEOUT seconds and reuses connections.
+
+Calls go through a circuit breaker. Observations are kept per city: fresh ones
+(younger than WEATHER_TTL_SECONDS) are served without an upstream call, and
+when the upstream fails or the breaker is open the last known observation is
+served with 'stale': True while a refresh is attempted in the background.
+
+fetch_forecast() returns the 5 day / 3 hour forecast for a city in one call,
+as model features per step, for the risk timelines in aegis.forecast.
+
+fetch_weather_for_cities() serves whole alert cycles: city names are resolved
+to OpenWeatherMap city IDs and coordinates once (cached in WEATHER_CITY_ID_FILE)
+and then fetched in group requests of up to 20 IDs.
+
+AQI comes from the air-pollution endpoint, called concurrently with the weather
+call for the same coordinates and converted from PM2.5/PM10 to the Indian
+National AQI (0-500) scale the model was trained on. Weather and AQI are cached
+together as one observation, and every fresh one is also kept in the
+observation store (aegis.observations) for retraining.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from aegis.breaker import CircuitBreaker, CLOSED, OPEN
+from aegis.cities import canonical_city, city_key
+from aegis.observations import observation_store
+from aegis.profiling import follow
+
+OWM_BASE_URL = os.getenv('OWM_BASE_URL', 'http://api.openweathermap.org').rstrip('/')
+OWM_API_KEY = os.getenv('OWM_API_KEY', 'ac9ea2b0cba9ab0943058f803c7f6e68')
+WEATHER_CONNECT_TIMEOUT = float(os.getenv('WEATHER_CONNECT_TIMEOUT', '3'))
+WEATHER_READ_TIMEOUT = float(os.getenv('WEATHER_READ_TIMEOUT', '7'))
+WEATHER_POOL_SIZE = int(os.getenv('WEATHER_POOL_SIZE', '32'))
+WEATHER_TTL_SECONDS = float(os.getenv('WEATHER_TTL_SECONDS', '300'))
+WEATHER_MAX_STALE_SECONDS = float(os.getenv('WEATHER_MAX_STALE_SECONDS', str(6 * 3600)))
+WEATHER_CITY_ID_FILE = os.getenv('WEATHER_CITY_ID_FILE', 'city_ids.json')
+GROUP_SIZE = 20  # OpenWeatherMap limit for /group requests
+DEFAULT_AQI = 100  # used when no AQI reading is available for a city
+
+breaker = CircuitBreaker(
+    failure_threshold=float(os.getenv('WEATHER_BREAKER_FAILURE_RATE', '0.5')),
+    window=int(os.getenv('WEATHER_BREAKER_WINDOW', '20')),
+    min_calls=int(os.getenv('WEATHER_BREAKER_MIN_CALLS', '5')),
+    open_seconds=float(os.getenv('WEATHER_BREAKER_OPEN_SECONDS', '30')),
+)
+
+_session = None
+_session_lock = threading.Lock()
+
+# city key -> (observation, fetched_at epoch seconds)
+_observations = {}
+_observations_lock = threading.Lock()
+_refreshing = set()
+_refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix='weather-refresh')
+# Side calls (air pollution) that run concurrently with a weather request
+_io_pool = ThreadPoolExecutor(max_workers=WEATHER_POOL_SIZE, thread_name_prefix='weather-io')
+
+# city key -> {'id', 'lat', 'lon'} (loaded lazily from WEATHER_CITY_ID_FILE)
+_geo = None
+_geo_lock = threading.Lock()
+
+# Indian National AQI breakpoints: (concentration low, high, index low, high), ug/m3
+NAQI_BREAKPOINTS = {
+    'pm2_5': [(0, 30, 0, 50), (30, 60, 50, 100), (60, 90, 100, 200),
+              (90, 120, 200, 300), (120, 250, 300, 400), (250, 500, 400, 500)],
+    'pm10': [(0, 50, 0, 50), (50, 100, 50, 100), (100, 250, 100, 200),
+             (250, 350, 200, 300), (350, 430, 300, 400), (430, 600, 400, 500)],
+}
+
+
+class UpstreamError(Exception):
+    """OpenWeatherMap did not answer usefully (timeout, connection error, 5xx, bad payload)."""
+
+
+def get_session():
+    """Shared keep-alive session, sized for one connection per worker thread."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=WEATHER_POOL_SIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+def owm_get(path, params, api_key=OWM_API_KEY):
+    """GET an OpenWeatherMap endpoint and return the decoded JSON."""
+    params = dict(params, appid=api_key)
+    res = get_session().get(f'{OWM_BASE_URL}{path}', params=params,
+                            timeout=(WEATHER_CONNECT_TIMEOUT, WEATHER_READ_TIMEOUT))
+    return res.json()
+
+
+def parse_current_weather(data):
+    """Map an OpenWeatherMap current-weather payload to model features."""
+    return {
+        'Temperature': data['main']['temp'],
+        'Humidity': data['main']['humidity'],
+        'AQI': DEFAULT_AQI,  # replaced by the air-pollution reading
+        'Rainfall': data.get('rain', {}).get('1h', 0),
+        'WindSpeed': data['wind']['speed'],
+        'Pressure': data['main']['pressure']
+    }
+
+
+def _load_geo():
+    global _geo
+    with _geo_lock:
+        if _geo is None:
+            try:
+                with open(WEATHER_CITY_ID_FILE) as file:
+                    raw = json.load(file)
+                # Older files stored just the id
+                _geo = {key: value if isinstance(value, dict) else {'id': int(value)} for key, value in raw.items()}
+            except (OSError, ValueError):
+                _geo = {}
+        return _geo
+
+
+def _save_geo(city, data):
+    """Remember the id and coordinates from a current-weather payload."""
+    geo = _load_geo()
+    entry = {'id': int(data['id'])}
+    if data.get('coord'):
+        entry['lat'] = data['coord']['lat']
+        entry['lon'] = data['coord']['lon']
+    key = city_key(city)
+    with _geo_lock:
+        if geo.get(key) == entry:
+            return
+        geo[key] = entry
+        snapshot = dict(geo)
+    try:
+        tmp_path = f'{WEATHER_CITY_ID_FILE}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(snapshot, file, indent=0, sort_keys=True)
+        os.replace(tmp_path, WEATHER_CITY_ID_FILE)
+    except OSError as e:
+        print(f"Warning: could not save city ids: {e}")
+
+
+def city_geo(city):
+    """Cached {'id', 'lat', 'lon'} for city, or None if it has not been resolved yet."""
+    return _load_geo().get(city_key(city))
+
+
+def city_id(city):
+    """Cached OpenWeatherMap id for city, or None if it has not been resolved yet."""
+    geo = city_geo(city)
+    return geo['id'] if geo else None
+
+
+def naqi_from_components(components):
+    """Indian National AQI from OpenWeatherMap pollutant concentrations (max of PM2.5 and PM10 sub-indices)."""
+    sub_indices = []
+    for pollutant, breakpoints in NAQI_BREAKPOINTS.items():
+        value = components.get(pollutant)
+        if value is None:
+            continue
+        for c_low, c_high, i_low, i_high in breakpoints:
+            if value <= c_high:
+                sub_indices.append(i_low + (i_high - i_low) * (value - c_low) / (c_high - c_low))
+                break
+        else:
+            sub_indices.append(500)
+    if not sub_indices:
+        raise UpstreamError('No PM2.5/PM10 in air-pollution payload')
+    return int(round(max(sub_indices)))
+
+
+def _fetch_aqi(lat, lon, api_key):
+    """Current AQI at a location; raises UpstreamError."""
+    try:
+        data = owm_get('/data/2.5/air_pollution', {'lat': lat, 'lon': lon}, api_key)
+        return naqi_from_components(data['list'][0]['components'])
+    except UpstreamError:
+        raise
+    except Exception as e:
+        raise UpstreamError(f"Air pollution fetch failed: {e}") from e
+
+
+def _start_aqi(city, api_key):
+    """Start the AQI call for a city with known coordinates; returns a future or None."""
+    geo = city_geo(city)
+    if not geo or 'lat' not in geo:
+        return None
+    return _io_pool.submit(follow(_fetch_aqi), geo['lat'], geo['lon'], api_key)
+
+
+def _merge_aqi(city, observation, aqi_future, api_key):
+    """Fill observation['AQI'] from the AQI call, falling back to the city's last reading."""
+    if aqi_future is None:
+        aqi_future = _start_aqi(city, api_key)  # first fetch: coordinates were only just resolved
+    try:
+        if aqi_future is None:
+            raise UpstreamError('No coordinates for AQI lookup')
+        observation['AQI'] = aqi_future.result(timeout=WEATHER_CONNECT_TIMEOUT + WEATHER_READ_TIMEOUT + 1)
+    except Exception as e:
+        print(f"Error fetching AQI for {city}: {e}")
+        with _observations_lock:
+            entry = _observations.get(city_key(city))
+        observation['AQI'] = entry[0]['AQI'] if entry else DEFAULT_AQI
+        observation['aqi_estimated'] = True
+    return observation
+
+
+def _fetch_live(city, api_key):
+    """One upstream call. Returns the observation, None for unknown cities, raises UpstreamError."""
+    aqi_future = _start_aqi(city, api_key)
+    try:
+        data = owm_get('/data/2.5/weather', {'q': canonical_city(city), 'units': 'metric'}, api_key)
+    except Exception as e:
+        raise UpstreamError(str(e)) from e
+    cod = str(data.get('cod'))
+    if cod == '200':
+        if data.get('id'):
+            _save_geo(city, data)
+        try:
+            observation = parse_current_weather(data)
+        except (KeyError, TypeError) as e:
+            raise UpstreamError(f"Malformed weather payload: {e}") from e
+        return _merge_aqi(city, observation, aqi_future, api_key)
+    if cod.startswith('4') and cod != '429':
+        return None  # e.g. city not found: the upstream is healthy
+    raise UpstreamError(f"OpenWeatherMap error {cod}: {data.get('message')}")
+
+
+def _remember(city, observation):
+    now = time.time()
+    with _observations_lock:
+        _observations[city_key(city)] = (observation, now)
+    store = observation_store()
+    if store is not None:
+        store.record(city, observation, now)  # queued; written in batches off this thread
+
+
+def _last_known(city):
+    """Last observation for city with a staleness marker, or None if missing/too old."""
+    with _observations_lock:
+        entry = _observations.get(city_key(city))
+    if entry is None:
+        return None
+    observation, fetched_at = entry
+    age = time.time() - fetched_at
+    if age > WEATHER_MAX_STALE_SECONDS:
+        return None
+    return dict(observation, stale=True, observed_at=datetime.fromtimestamp(fetched_at).strftime('%d/%m/%Y %H:%M'),
+                age_seconds=int(age))
+
+
+def _call_through_breaker(city, api_key):
+    """Live fetch guarded by the breaker. Returns (observation, ok); ok is False if no answer was obtained."""
+    if not breaker.allow():
+        return None, False
+    try:
+        observation = _fetch_live(city, api_key)
+    except UpstreamError as e:
+        breaker.record_failure()
+        print(f"Error fetching weather: {e}")
+        return None, False
+    breaker.record_success()
+    if observation is not None:
+        _remember(city, observation)
+    return observation, True
+
+
+def _refresh(city, api_key):
+    try:
+        _call_through_breaker(city, api_key)
+    finally:
+        with _observations_lock:
+            _refreshing.discard(city_key(city))
+
+
+def _schedule_refresh(city, api_key):
+    key = city_key(city)
+    with _observations_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+    _refresher.submit(_refresh, city, api_key)
+
+
+def fetch_weather_for_city(city, api_key=OWM_API_KEY):
+    """Fetch weather data for a city"""
+    with _observations_lock:
+        entry = _observations.get(city_key(city))
+    if entry is not None and time.time() - entry[1] < WEATHER_TTL_SECONDS:
+        return dict(entry[0])
+
+    state = breaker.state
+    if state != CLOSED:
+        # Don't make callers wait on an upstream that is down or being probed:
+        # serve the last known observation and revalidate in the background
+        stale = _last_known(city)
+        if stale is not None:
+            _schedule_refresh(city, api_key)
+            return stale
+        if state == OPEN:
+            return None
+
+    observation, ok = _call_through_breaker(city, api_key)
+    if ok:
+        return observation
+    return _last_known(city)
+
+
+def _fetch_group(ids, api_key):
+    """One /group call for up to GROUP_SIZE ids. Returns {id: observation}; raises UpstreamError."""
+    try:
+        data = owm_get('/data/2.5/group', {'id': ','.join(str(i) for i in ids), 'units': 'metric'}, api_key)
+    except Exception as e:
+        raise UpstreamError(str(e)) from e
+    if 'list' not in data:
+        raise UpstreamError(f"OpenWeatherMap group error {data.get('cod')}: {data.get('message')}")
+    results = {}
+    for item in data['list']:
+        try:
+            results[int(item['id'])] = parse_current_weather(item)
+        except (KeyError, TypeError, ValueError):
+            continue  # treat a malformed entry like a missing one
+    return results
+
+
+def fetch_weather_for_cities(cities, api_key=OWM_API_KEY):
+    """Fetch weather for many cities at once. Returns {city: observation or None}.
+
+    Fresh observations are reused, cities with a known id are fetched in groups of
+    GROUP_SIZE, and unresolved cities (or ids missing from a group reply) fall back
+    to fetch_weather_for_city(), which also resolves and caches their id. If a
+    group call fails, its cities get their last known (stale) observation and a
+    background refresh.
+    """
+    results = {}
+    by_id = {}
+    individual = []
+    now = time.time()
+    for city in dict.fromkeys(cities):  # unique, order kept
+        with _observations_lock:
+            entry = _observations.get(city_key(city))
+        if entry is not None and now - entry[1] < WEATHER_TTL_SECONDS:
+            results[city] = dict(entry[0])
+            continue
+        cid = city_id(city)
+        if cid is None:
+            individual.append(city)
+        else:
+            by_id.setdefault(cid, []).append(city)
+
+    ids = list(by_id)
+    for start in range(0, len(ids), GROUP_SIZE):
+        batch = ids[start:start + GROUP_SIZE]
+        if breaker.state != CLOSED or not breaker.allow():
+            for cid in batch:
+                for city in by_id[cid]:
+                    results[city] = _last_known(city)
+                    _schedule_refresh(city, api_key)
+            continue
+        aqi_futures = {city: _start_aqi(city, api_key) for cid in batch for city in by_id[cid]}
+        try:
+            observations = _fetch_group(batch, api_key)
+        except UpstreamError as e:
+            breaker.record_failure()
+            print(f"Error fetching weather group: {e}")
+            for cid in batch:
+                for city in by_id[cid]:
+                    results[city] = _last_known(city)
+                    _schedule_refresh(city, api_key)
+            continue
+        breaker.record_success()
+        for cid in batch:
+            for city in by_id[cid]:
+                if cid in observations:
+                    observation = _merge_aqi(city, dict(observations[cid]), aqi_futures[city], api_key)
+                    _remember(city, observation)
+                    results[city] = dict(observation)
+                else:
+                    individual.append(city)  # partial reply: retry this city on its own
+
+    for city in individual:
+        results[city] = fetch_weather_for_city(city, api_key)
+    return results
+
+
+def parse_forecast(data, aqi):
+    """Map a 5 day / 3 hour forecast payload to [(epoch seconds, model features)], one per step.
+
+    The forecast has no air quality, so every step carries the given AQI.
+    Rainfall is the 3-hour total spread per hour, to match the current reading.
+    """
+    steps = []
+    for item in data['list']:
+        steps.append((int(item['dt']), {
+            'Temperature': item['main']['temp'],
+            'Humidity': item['main']['humidity'],
+            'AQI': aqi,
+            'Rainfall': round(item.get('rain', {}).get('3h', 0) / 3, 2),
+            'WindSpeed': item['wind']['speed'],
+            'Pressure': item['main']['pressure'],
+        }))
+    return steps
+
+
+def fetch_forecast(city, api_key=OWM_API_KEY):
+    """5 day / 3 hour forecast for a city in one upstream call: [(epoch seconds, features)], or None.
+
+    AQI is the city's latest observed reading (DEFAULT_AQI if it has none).
+    Goes through the breaker like current-weather calls.
+    """
+    if not breaker.allow():
+        return None
+    cid = city_id(city)
+    params = {'id': cid} if cid else {'q': canonical_city(city)}
+    try:
+        data = owm_get('/data/2.5/forecast', dict(params, units='metric'), api_key)
+        cod = str(data.get('cod'))
+        if cod != '200':
+            if cod.startswith('4') and cod != '429':
+                breaker.record_success()
+                return None
+            raise UpstreamError(f"OpenWeatherMap forecast error {cod}: {data.get('message')}")
+        with _observations_lock:
+            entry = _observations.get(city_key(city))
+        steps = parse_forecast(data, entry[0]['AQI'] if entry else DEFAULT_AQI)
+    except Exception as e:
+        breaker.record_failure()
+        print(f"Error fetching forecast for {city}: {e}")
+        return None
+    breaker.record_success()
+    return steps
+
+
+def weather_status():
+    """Breaker state and observation store size, for the admin pages."""
+    with _observations_lock:
+        cached = len(_observations)
+        refreshing = len(_refreshing)
+    return {'breaker': breaker.stats(), 'cached_cities': cached, 'refreshing': refreshing,
+            'resolved_city_ids': len(_load_geo()),
+            'ttl_seconds': WEATHER_TTL_SECONDS, 'max_stale_seconds': WEATHER_MAX_STALE_SECONDS}
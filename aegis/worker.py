@@ -0,0 +1,130 @@
+"""Headless alert worker: runs the alert schedule without Flask or the web app.
+
+    python -m aegis.worker            # run until interrupted
+    python -m aegis.worker --once     # send whatever is due now, then exit
+    python -m aegis.worker --sharded  # one of several workers splitting users by city
+    python -m aegis.worker --profile  # profile the first due batch (see aegis.profiling)
+
+Only the scheduler and standard library are imported at startup; pandas,
+scikit-learn, requests and twilio load on the first batch that needs them.
+"""
+import atexit
+import os
+import time
+
+from aegis.alerts import send_due_alerts
+from aegis.forecast import RiskTimelines
+from aegis.model import model_from_env
+from aegis.riskview import RiskView
+from aegis.scheduler import AlertScheduler, run_schedule
+
+# Tells the Alerts page that the automated system is running
+PID_FILE = 'alert_process.pid'
+
+
+def _write_pid_file():
+    try:
+        with open(PID_FILE, 'w') as f:
+            f.write(str(os.getpid()))
+        print(f"[INFO] Alert system started. PID file created: {PID_FILE}")
+    except Exception as e:
+        print(f"[WARNING] Could not create PID file: {e}")
+        return
+    atexit.register(_remove_pid_file)
+
+
+def _remove_pid_file():
+    try:
+        if os.path.exists(PID_FILE):
+            os.remove(PID_FILE)
+            print(f"[INFO] PID file removed: {PID_FILE}")
+    except Exception as e:
+        print(f"[WARNING] Could not remove PID file: {e}")
+
+
+def _alertable():
+    from aegis.users import load_users, alertable_users
+    return alertable_users(load_users()).to_dict('records')
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Aegis Health alert worker')
+    parser.add_argument('--once', action='store_true', help='send alerts that are due now and exit')
+    parser.add_argument('--resync', type=int, default=60, help='seconds between users.csv re-reads')
+    parser.add_argument('--sharded', action='store_true',
+                        help='only handle the cities this worker holds a lease for (see aegis.sharding)')
+    parser.add_argument('--profile', action='store_true',
+                        help='profile the first batch of due alerts into PROFILE_DIR')
+    args = parser.parse_args(argv)
+
+    model = model_from_env()
+    if args.sharded:
+        from aegis.sharding import LeaseStore, ShardCoordinator
+        from aegis.sms import sent_since
+        store = LeaseStore()
+        # Sends a dead worker left in flight are checked against Twilio before its shards go live here
+        coordinator = ShardCoordinator(store, was_sent=sent_since)
+        scheduler = AlertScheduler(state_store=store)
+        # Only this worker's cities, so no shared file: other workers hold other cities
+        risk_view = RiskView(model, scheduler.cities, path=None)
+        timelines = RiskTimelines(model, scheduler.cities, path=None)
+        atexit.register(coordinator.leave)
+
+        # Leases are renewed by a heartbeat thread, so a batch can outlast ALERT_LEASE_TTL
+        coordinator.refresh()
+        if not args.once:
+            coordinator.start_heartbeat()
+
+        def load_users():
+            return coordinator.filter_users(_alertable())
+
+        def process_due(due):
+            # A shard handed over since the last resync belongs to its new owner now, and
+            # each send re-checks the lease so one lost mid-batch isn't sent twice
+            return send_due_alerts(coordinator.filter_users(due), model, risk_view, timelines,
+                                   claim=coordinator.claim_sends, progress=coordinator.send_finished)
+    else:
+        scheduler = AlertScheduler()
+        risk_view = RiskView(model, scheduler.cities)
+        timelines = RiskTimelines(model, scheduler.cities)
+        load_users = _alertable
+
+        def process_due(due):
+            return send_due_alerts(due, model, risk_view, timelines)
+
+    if args.profile:
+        unprofiled = process_due
+        pending = [True]
+
+        def process_due(due):
+            if pending:
+                from aegis.profiling import profile_call
+                pending.clear()
+                return profile_call('worker cycle', unprofiled, due)
+            return unprofiled(due)
+
+    if args.once:
+        scheduler.sync_users(load_users())
+        now = time.time()
+        due = scheduler.pop_due(now)
+        for phone in process_due(due) if due else []:
+            scheduler.mark_sent(phone, now)
+        scheduler.save_state()
+        print(f"[INFO] {len(due)} users were due")
+        return 0
+
+    _write_pid_file()
+    risk_view.start()
+    timelines.start()
+    try:
+        # Each user is sent on their own cadence, at a stable offset within the
+        # interval, instead of everyone at once every hour
+        run_schedule(scheduler, load_users, process_due, resync_seconds=args.resync)
+    except KeyboardInterrupt:
+        print("\n[INFO] Alert service stopped by user")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
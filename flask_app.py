@@ -1,352 +1,214 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import (Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response,
+                   stream_with_context, abort, send_from_directory, make_response)
+from markupsafe import Markup
 from functools import wraps
-import pandas as pd
-import pickle
-import requests
+import mimetypes
 import random
 import os
-from twilio.rest import Client
-from datetime import datetime
 import threading
 import time
+from aegis import alerts as alert_core
+from aegis.alerts import (build_health_alert_message, dispatch_alerts, prepare_alerts, record_delivery,
+                          send_due_alerts)
+from aegis.assets import AssetManifest, IMMUTABLE_CACHE_CONTROL
+from aegis.cities import canonical_city
+from aegis.jobs import create_job, start_job, read_job, cancel_job, stream_events
+from aegis.ledger import DIMENSIONS, GROUPINGS, aggregate, outcome, parse_time
+from aegis.model import model_from_env
+from aegis.pagecache import DataVersion, FragmentCache
+from aegis.forecast import RiskTimelines, daily, describe_outlook
+from aegis.observations import store_stats
+from aegis.riskview import RiskView
+from aegis import profiling
+from aegis.phones import normalize_phone
+from aegis.scheduler import AlertScheduler, describe_cadence, parse_cadence, run_schedule
+from aegis.tracing import CycleTrace, TRACES_DIR, recent_cycles
+from aegis.sms import send_sms, twilio_client, TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_PHONE_NUMBER
+from aegis.weather import fetch_weather_for_city, weather_status
+from aegis.users import (load_users, save_users, alertable_users, append_user, phone_registered,
+                         PHONE_OK)
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this-in-production'
+app.jinja_env.filters['cadence'] = describe_cadence
+
+# Hashed, precompressed static files from `python -m aegis.assets` (plain /static/ until built)
+asset_manifest = AssetManifest(os.path.join(app.root_path, 'static', 'dist'))
+
+def asset_url(filename):
+    """url_for('static', filename=...) that points at the built, fingerprinted copy when there is one"""
+    hashed = asset_manifest.lookup(filename)
+    if hashed is None:
+        return url_for('static', filename=filename)
+    return url_for('hashed_asset', filename=hashed)
+
+app.jinja_env.globals['asset_url'] = asset_url
+
+@app.route('/assets/<path:filename>')
+def hashed_asset(filename):
+    """Fingerprinted asset, precompressed variant if accepted; cached for a year since the name changes with the content"""
+    if not asset_manifest.served(filename):
+        abort(404)
+    variant, encoding = asset_manifest.variant(filename, request.headers.get('Accept-Encoding'))
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = send_from_directory(asset_manifest.dist_dir, variant, mimetype=mimetype, max_age=31536000)
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
 
 # Admin credentials (hardcoded)
 ADMIN_USERNAME = 'admin'
 ADMIN_PASSWORD = 'admin123'  # Change this to a secure password
 
-# Twilio credentials - loaded from environment variables
-# Set these in your environment or Render dashboard:
-# TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_PHONE_NUMBER
-TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID', '')
-TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN', '')
-TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER', '')
-
-# Set to True to simulate SMS (no real Twilio send). Use when Twilio is not set up or trial limits.
-# Default is now FALSE so real SMS are sent unless DEMO_SMS is explicitly set to true.
-DEMO_SMS = os.environ.get('DEMO_SMS', 'false').lower() in ('1', 'true', 'yes')
-
-# Global model variables
-gb_disease = gb_risk = le_disease = le_risklevel = precautions_tab = None
+# Health risk model and its optional prediction cache (PREDICTION_CACHE=true to enable).
+# Not loaded at import: MODEL_PRELOAD=background (default) loads it on a thread
+# after boot, 'lazy' waits for the first prediction, 'eager' blocks import as before.
+# Training processes (forkserver/spawn) re-import this file as __mp_main__; there it starts nothing.
+health_model = model_from_env()
+MODEL_PRELOAD = 'lazy' if __name__ == '__mp_main__' else os.getenv('MODEL_PRELOAD', 'background').lower()
 
 def auto_train_model():
     """Automatically train the health risk model"""
-    global gb_disease, gb_risk, le_disease, le_risklevel, precautions_tab
-    dataset_file = 'climate_health_precaution_dataset_500.csv'
-    
-    if not os.path.exists(dataset_file):
-        print(f"Error: Dataset file '{dataset_file}' not found. Cannot train model automatically.")
-        return False
-    
-    try:
-        print("Training model automatically...")
-        from sklearn.ensemble import GradientBoostingClassifier
-        from sklearn.preprocessing import LabelEncoder
-        
-        df = pd.read_csv(dataset_file)
-        df.columns = ['City', 'Temperature', 'Humidity', 'AQI', 'Rainfall', 'WindSpeed', 'Pressure', 'Date', 'DayType',
-                      'Disease_Risk', 'Risk_Level', 'Precaution_1', 'Precaution_2', 'Precaution_3']
-        
-        features = ['Temperature', 'Humidity', 'AQI', 'Rainfall', 'WindSpeed', 'Pressure']
-        X = df[features]
-        le_disease_local = LabelEncoder()
-        le_risklevel_local = LabelEncoder()
-        y_disease = le_disease_local.fit_transform(df['Disease_Risk'])
-        y_risklevel = le_risklevel_local.fit_transform(df['Risk_Level'])
-        
-        gb_disease_local = GradientBoostingClassifier(n_estimators=100, random_state=42)
-        gb_disease_local.fit(X, y_disease)
-        gb_risk_local = GradientBoostingClassifier(n_estimators=100, random_state=42)
-        gb_risk_local.fit(X, y_risklevel)
-        
-        precautions = df[['Disease_Risk', 'Risk_Level', 'Precaution_1', 'Precaution_2', 'Precaution_3']].drop_duplicates()
-        
-        bundle = {
-            'gb_disease': gb_disease_local,
-            'gb_risk': gb_risk_local,
-            'le_disease': le_disease_local,
-            'le_risklevel': le_risklevel_local,
-            'precautions': precautions
-        }
-        
-        with open('health_model.pkl', 'wb') as file:
-            pickle.dump(bundle, file)
-        
-        # Load the newly trained model
-        gb_disease = bundle['gb_disease']
-        gb_risk = bundle['gb_risk']
-        le_disease = bundle['le_disease']
-        le_risklevel = bundle['le_risklevel']
-        precautions_tab = bundle['precautions']
-        
-        print("Model trained and loaded successfully!")
-        return True
-    except Exception as e:
-        print(f"Error training model automatically: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return False
+    return health_model.train()
 
 def load_model():
     """Load or reload the health risk model, auto-train if not found"""
-    global gb_disease, gb_risk, le_disease, le_risklevel, precautions_tab
-    MODEL_FILE = 'health_model.pkl'
-    
-    if os.path.exists(MODEL_FILE):
-        try:
-            with open(MODEL_FILE, 'rb') as file:
-                bundle = pickle.load(file)
-            gb_disease = bundle['gb_disease']
-            gb_risk = bundle['gb_risk']
-            le_disease = bundle['le_disease']
-            le_risklevel = bundle['le_risklevel']
-            precautions_tab = bundle['precautions']
-            print("Model loaded successfully!")
-            return True
-        except (ModuleNotFoundError, ImportError, AttributeError, KeyError) as e:
-            print(f"Warning: Could not load model file due to compatibility issue: {e}")
-            print("Attempting to automatically retrain the model...")
-            if auto_train_model():
-                return True
-            gb_disease = gb_risk = le_disease = le_risklevel = precautions_tab = None
-            return False
-        except Exception as e:
-            print(f"Warning: Could not load model file: {e}")
-            print("Attempting to automatically retrain the model...")
-            if auto_train_model():
-                return True
-            gb_disease = gb_risk = le_disease = le_risklevel = precautions_tab = None
-            return False
-    else:
-        print("Model file not found. Training model automatically...")
-        if auto_train_model():
-            return True
-        gb_disease = gb_risk = le_disease = le_risklevel = precautions_tab = None
-        return False
+    return health_model.load()
 
-# Load model on startup
-load_model()
+def predict_health_risk(weather_data):
+    """Predict health risk from weather data (loads the model on first use)"""
+    health_model.ensure_loaded()
+    return health_model.predict(weather_data)
+
+if MODEL_PRELOAD == 'eager':
+    health_model.ensure_loaded()
+elif MODEL_PRELOAD == 'background':
+    threading.Thread(target=health_model.ensure_loaded, name='model-preload', daemon=True).start()
+
+def registered_cities():
+    """Canonical cities of alertable users, kept in the risk view"""
+    return list(alertable_users(load_users())['city'].unique())
+
+# Weather and prediction per registered city, refreshed in the background so /predict,
+# single sends and alert cycles don't wait on OpenWeatherMap. Started with the model
+# preload, or by the first lookup when MODEL_PRELOAD=lazy.
+risk_view = RiskView(health_model, registered_cities)
+# Five-day risk timelines per registered city, from one forecast call and one batched prediction each
+risk_timelines = RiskTimelines(health_model, registered_cities)
+if MODEL_PRELOAD != 'lazy':
+    risk_view.start()
+    risk_timelines.start()
+
+def city_risk(city):
+    """Risk view row for a city (computed live for an unregistered one), or None"""
+    risk_view.start()
+    return risk_view.lookup(city)
+
+def city_outlook(city):
+    """(daily worst risks, High-risk outlook line or None) from the city's forecast timeline"""
+    risk_timelines.start()
+    timeline = risk_timelines.get(city)
+    if timeline is None:
+        return None, None
+    step = risk_timelines.outlook(city)
+    return daily(timeline), describe_outlook(step) if step else None
 
 # Store OTPs temporarily (in production, use Redis or database)
 otp_store = {}
 
-def send_sms(phone, msg):
-    """Send SMS via Twilio (or simulate when DEMO_SMS is True)"""
-    # Validate phone number format before sending
-    if not phone or len(phone) < 10:
-        error_info = {
-            'type': 'ValidationError',
-            'message': f'Invalid phone number: {phone}',
-            'user_message': f'Invalid phone number format: {phone}. Phone number must be at least 10 digits.'
-        }
-        print(f"ERROR: {error_info['user_message']}")
-        return error_info
+def cadence_from_form(form):
+    """Cadence string from the registration form ('daily' + alert_time -> 'daily@HH:MM').
 
-    if DEMO_SMS:
-        print(f"\n[DEMO SMS] Would send to {phone}:")
-        print("-" * 40)
-        print(msg[:200] + ("..." if len(msg) > 200 else ""))
-        print("-" * 40)
-        return "DEMO_" + str(int(time.time()))
+    Raises ValueError for an unknown frequency or a malformed time.
+    """
+    cadence = form.get('cadence', 'hourly').strip().lower() or 'hourly'
+    if cadence == 'daily':
+        cadence = f"daily@{form.get('alert_time', '08:00').strip() or '08:00'}"
+    parse_cadence(cadence)
+    return cadence
 
-    try:
-        print(f"\n{'='*60}")
-        print(f"ATTEMPTING TO SEND SMS")
-        print(f"{'='*60}")
-        print(f"To: {phone}")
-        print(f"From: {TWILIO_PHONE_NUMBER}")
-        print(f"Message length: {len(msg)} characters")
-        print(f"Account SID: {TWILIO_ACCOUNT_SID[:10]}...")
-        
-        if not phone or len(phone) < 10:
-            error_info = {
-                'type': 'ValidationError',
-                'message': f'Invalid phone number: {phone}',
-                'user_message': f'Invalid phone number format: {phone}. Phone number must be at least 10 digits.'
-            }
-            print(f"ERROR: {error_info['user_message']}")
-            return error_info
-        
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-        print("Twilio client created successfully")
-        
-        message = client.messages.create(
-            body=msg,
-            from_=TWILIO_PHONE_NUMBER,
-            to=phone
-        )
-        
-        print(f"{'='*60}")
-        print(f"SMS SENT SUCCESSFULLY!")
-        print(f"Message SID: {message.sid}")
-        print(f"Message status: {message.status}")
-        print(f"Message price: {getattr(message, 'price', 'N/A')}")
-        print(f"{'='*60}\n")
-        return message.sid
-        
-    except Exception as e:
-        error_msg = str(e)
-        error_type = type(e).__name__
-        error_code = getattr(e, 'code', None)
-        
-        print(f"\n{'!'*60}")
-        print(f"SMS SENDING FAILED")
-        print(f"{'!'*60}")
-        print(f"Error type: {error_type}")
-        print(f"Error code: {error_code}")
-        print(f"Error message: {error_msg}")
-        print(f"Phone number: {phone}")
-        
-        # Check for specific Twilio errors and return detailed error info
-        error_info = {'type': error_type, 'message': error_msg, 'code': error_code}
-        
-        error_lower = error_msg.lower()
-        
-        if "exceeded" in error_lower and ("daily" in error_lower or "limit" in error_lower or "50" in error_msg):
-            print("→ Issue: Twilio daily message limit exceeded (50 messages/day for trial accounts)")
-            error_info['user_message'] = "Daily message limit exceeded. Twilio trial accounts are limited to 50 messages per day. Please upgrade your account or wait until tomorrow."
-        elif "not a valid phone number" in error_lower or "invalid" in error_lower or error_code == 21211:
-            print("→ Issue: Invalid phone number format")
-            error_info['user_message'] = f"Invalid phone number format: {phone}. Please ensure it's in E.164 format (e.g., +91XXXXXXXXXX)."
-        elif "authentication" in error_lower or "unauthorized" in error_lower or error_code == 20003:
-            print("→ Issue: Twilio authentication failed - check credentials")
-            error_info['user_message'] = "Twilio authentication failed. Please check your Twilio Account SID and Auth Token."
-        elif "insufficient" in error_lower or "balance" in error_lower or error_code == 20005:
-            print("→ Issue: Insufficient Twilio account balance")
-            error_info['user_message'] = "Insufficient Twilio account balance. Please add funds to your Twilio account."
-        elif "unverified" in error_lower or (error_code == 21610):
-            print("→ Issue: Phone number not verified in Twilio (trial account)")
-            error_info['user_message'] = f"Phone number {phone} is not verified in your Twilio account. For trial accounts, you must verify recipient numbers at https://console.twilio.com/us1/develop/phone-numbers/manage/verified"
-        elif "permission" in error_lower or "not allowed" in error_lower:
-            print("→ Issue: Permission denied")
-            error_info['user_message'] = "Permission denied. Check your Twilio account settings and phone number permissions."
-        elif error_code == 21408:
-            print("→ Issue: Permission to send SMS to this number denied")
-            error_info['user_message'] = f"Permission denied to send SMS to {phone}. This number may be blocked or not verified in your Twilio account."
-        else:
-            error_info['user_message'] = f"Failed to send SMS: {error_msg} (Code: {error_code})"
-        
-        print(f"User-friendly message: {error_info['user_message']}")
-        print(f"{'!'*60}\n")
-        
-        return error_info
+# What the dashboard, users and alerts pages are built from; an unchanged version means an unchanged page.
+# The traces directory's mtime changes whenever any process saves a cycle. The model file's signature is
+# also the loaded model's version, so nothing process-local goes into the token and every worker agrees.
+page_version = DataVersion(['users.csv', 'health_model.pkl', 'alert_process.pid', TRACES_DIR])
+page_fragments = FragmentCache()
+# Templates (partials included) only change with a deploy; part of every page ETag so new markup is
+# never answered with a 304
+TEMPLATES_VERSION = max((os.stat(os.path.join(folder, name)).st_mtime_ns
+                         for folder, _, names in os.walk(os.path.join(app.root_path, 'templates')) for name in names),
+                        default=0)
 
-def fetch_weather_for_city(city, api_key='ac9ea2b0cba9ab0943058f803c7f6e68'):
-    """Fetch weather data for a city"""
-    url = f'http://api.openweathermap.org/data/2.5/weather?q={city}&appid={api_key}&units=metric'
-    try:
-        res = requests.get(url, timeout=10)
-        data = res.json()
-        if data.get('cod') != 200:
-            return None
-        return {
-            'Temperature': data['main']['temp'],
-            'Humidity': data['main']['humidity'],
-            'AQI': 100,  # Default or connect to AQI API
-            'Rainfall': data.get('rain', {}).get('1h', 0),
-            'WindSpeed': data['wind']['speed'],
-            'Pressure': data['main']['pressure']
-        }
-    except Exception as e:
-        print(f"Error fetching weather: {e}")
-        return None
-
-def build_health_alert_message(city, weather_data, disease, risk, precautions):
-    """Build SMS alert message based on current weather/climate data - exact format for Twilio."""
-    now_str = datetime.now().strftime('%d/%m/%Y %H:%M')
-    return (
-        f"HEALTH ALERT - {city}\n"
-        f"==================\n\n"
-        f"Based on current conditions at {now_str}\n\n"
-        f"CLIMATE DATA:\n"
-        f"Temperature: {weather_data['Temperature']} C\n"
-        f"Humidity: {weather_data['Humidity']}%\n"
-        f"AQI: {weather_data['AQI']}\n"
-        f"Rainfall: {weather_data['Rainfall']} mm\n"
-        f"Wind Speed: {weather_data['WindSpeed']} m/s\n"
-        f"Pressure: {weather_data['Pressure']} hPa\n\n"
-        f"HEALTH RISK:\n"
-        f"Disease Risk: {disease}\n"
-        f"Risk Level: {risk}\n\n"
-        f"PRECAUTIONS:\n"
-        f"1. {precautions[0]}\n"
-        f"2. {precautions[1]}\n"
-        f"3. {precautions[2]}\n\n"
-        f"Stay safe! - Aegis Health"
-    )
-
-def check_phone_format(phone):
-    """Format phone number - handles various formats"""
-    if phone is None:
-        return None
-    
-    # Convert to string and clean up
-    phone_str = str(phone).strip()
-    
-    # Handle float conversion (e.g., if stored as 9.123456789e+09 in CSV)
-    if '.' in phone_str and 'e' not in phone_str.lower():
-        # Remove decimal point and everything after it
-        phone_str = phone_str.split('.')[0]
-    
-    # Remove all non-digit characters except +
-    phone_digits = ''.join(c for c in phone_str if c.isdigit() or c == '+')
-    
-    # Format based on patterns
-    if phone_digits.startswith('+'):
-        # Already has country code
-        if phone_digits.startswith('+91') and len(phone_digits) == 13:
-            return phone_digits  # +91XXXXXXXXXX (13 chars)
-        elif len(phone_digits) >= 10:
-            return phone_digits  # Other country codes
+def data_version():
+    """Version of the page data: users file, model file, alert worker PID file, saved cycle traces"""
+    return page_version.token()
+
+def cached_fragment(name, template, **context):
+    """Render a partial once per data version; context values may be callables, evaluated only on a miss"""
+    def render():
+        values = {key: value() if callable(value) else value for key, value in context.items()}
+        return render_template(template, **values)
+    return Markup(page_fragments.get(name, data_version(), render))
+
+def conditional_page(f):
+    """ETag/Last-Modified for a GET page from the data version; a matching If-None-Match gets a 304
+    before the view runs (no users.csv read, no template rendering)"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method != 'GET' or session.get('_flashes') or request.args:
+            return f(*args, **kwargs)  # flash messages and query parameters make the page one-off
+        etag = page_version.token(request.endpoint, request.view_args,
+                                  session.get('admin_logged_in'), session.get('admin_username'),
+                                  TEMPLATES_VERSION, sorted(asset_manifest.entries.items()))
+        last_modified = page_version.last_modified()
+        if etag in request.if_none_match or (
+                not request.if_none_match and last_modified and request.if_modified_since
+                and last_modified <= request.if_modified_since):
+            response = Response(status=304)
         else:
-            return None
-    elif phone_digits.startswith('91') and len(phone_digits) == 12:
-        return '+' + phone_digits  # 91XXXXXXXXXX -> +91XXXXXXXXXX
-    elif len(phone_digits) == 10:
-        return '+91' + phone_digits  # XXXXXXXXXX -> +91XXXXXXXXXX
-    elif len(phone_digits) == 11 and phone_digits.startswith('0'):
-        # Handle numbers starting with 0 (like 0XXXXXXXXXX)
-        return '+91' + phone_digits[1:]  # 0XXXXXXXXXX -> +91XXXXXXXXXX
-    else:
-        # Try to extract last 10 digits if longer (handles cases with extra digits)
-        if len(phone_digits) > 10:
-            last_10 = phone_digits[-10:]
-            if last_10.isdigit() and len(last_10) == 10:
-                return '+91' + last_10
-        return None
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200 or session.get('_flashes'):
+                return response
+        response.set_etag(etag)
+        # Last-Modified has 1 s resolution: only send it once that second is over, so a
+        # later write in the same second can't be mistaken for "not modified"
+        if last_modified and time.time() >= last_modified.timestamp() + 1:
+            response.last_modified = last_modified
+        # Always revalidate; an unchanged page then costs a 304 with no body
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return decorated_function
 
-def predict_health_risk(weather_data):
-    """Predict health risk from weather data"""
-    if gb_disease is None or gb_risk is None:
-        return None, None, []
-    
-    input_df = pd.DataFrame([weather_data], columns=['Temperature', 'Humidity', 'AQI', 'Rainfall', 'WindSpeed', 'Pressure'])
-    y_d_pred = le_disease.inverse_transform(gb_disease.predict(input_df))[0]
-    y_r_pred = le_risklevel.inverse_transform(gb_risk.predict(input_df))[0]
-    
-    result = precautions_tab[
-        (precautions_tab['Disease_Risk'] == y_d_pred) & 
-        (precautions_tab['Risk_Level'] == y_r_pred)
-    ]
-    
-    if result.empty:
-        result = precautions_tab[precautions_tab['Disease_Risk'] == y_d_pred]
-    
-    prc = result.iloc[0][['Precaution_1', 'Precaution_2', 'Precaution_3']].tolist() if not result.empty else ["No data"] * 3
-    
-    return y_d_pred, y_r_pred, prc
+def run_view(f, args, kwargs):
+    """Call a view, under the profiler if an admin asked for it with ?profile=1 or X-Aegis-Profile: 1.
+    Without the flag this is a plain call: no profiler is installed."""
+    if (profiling.requested(request.values, request.headers) and not getattr(f, 'profiles_cycle', False)
+            and session.get('admin_logged_in')):
+        return profiling.profile_call(f'{request.method} {request.endpoint}', f, *args, **kwargs)
+    return f(*args, **kwargs)
+
+def profile_cycle(f):
+    """Mark a view whose profile flag profiles the alert cycle it starts, not the request itself"""
+    f.profiles_cycle = True
+    return f
+
+def admin_profilable(f):
+    """Public route that an admin can still profile"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        return run_view(f, args, kwargs)
+    return decorated_function
 
 # Admin authentication decorator
 def admin_required(f):
-    """Decorator to require admin login for routes"""
+    """Decorator to require admin login for routes (and the opt-in profiler switch)"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if not session.get('admin_logged_in'):
             flash('Admin access required. Please login first.', 'error')
             return redirect(url_for('admin_login'))
-        return f(*args, **kwargs)
+        return run_view(f, args, kwargs)
     return decorated_function
 
 @app.route('/admin/login', methods=['GET', 'POST'])
@@ -378,22 +240,15 @@ def admin_logout():
     return redirect(url_for('admin_login'))
 
 @app.route('/')
+@admin_profilable
+@conditional_page
 def index():
     """Main dashboard"""
-    users_file = 'users.csv'
-    if os.path.exists(users_file):
-        df = pd.read_csv(users_file, dtype={'phone': str})
-        users_count = len(df)
-    else:
-        users_count = 0
-    
-    model_loaded = os.path.exists('health_model.pkl')
-    alerts_active = os.path.exists('alert_process.pid')  # Simple check
-    
-    return render_template('dashboard.html', 
-                         users_count=users_count,
-                         model_loaded=model_loaded,
-                         alerts_active=alerts_active)
+    stats = cached_fragment('dashboard_stats', 'partials/dashboard_stats.html',
+                            users_count=lambda: len(load_users()),
+                            model_loaded=page_version.exists('health_model.pkl'),
+                            alerts_active=page_version.exists('alert_process.pid'))  # Simple check
+    return render_template('dashboard.html', stats=stats)
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -416,7 +271,7 @@ def register():
                 return redirect(url_for('register'))
             
             original_phone = phone
-            phone = check_phone_format(phone)
+            phone = normalize_phone(phone)
             
             print(f"Formatted phone: {phone}")
             
@@ -425,11 +280,18 @@ def register():
                 print(f"ERROR: Invalid phone format for {original_phone}")
                 return redirect(url_for('register'))
             
+            try:
+                cadence = cadence_from_form(request.form)
+            except ValueError as e:
+                flash(str(e), 'error')
+                return redirect(url_for('register'))
+            
             # Generate OTP
             otp = f"{random.randint(100000, 999999)}"
             print(f"Generated OTP: {otp}")
             
-            otp_store[phone] = {'otp': otp, 'password': password, 'city': city, 'timestamp': time.time()}
+            otp_store[phone] = {'otp': otp, 'password': password, 'city': city, 'cadence': cadence,
+                                'timestamp': time.time()}
             print(f"OTP stored for {phone}")
             
             # Send OTP
@@ -485,22 +347,22 @@ def register_direct():
                 flash('Please fill all fields', 'error')
                 return redirect(url_for('register'))
 
-            formatted_phone = check_phone_format(phone)
+            formatted_phone = normalize_phone(phone)
             if not formatted_phone:
                 flash('Invalid phone number format. Use +91XXXXXXXXXX or 10-digit number.', 'error')
                 return redirect(url_for('register'))
 
-            users_file = 'users.csv'
-            user_data = pd.DataFrame([[formatted_phone, password, city]],
-                                     columns=['phone', 'password', 'city'])
-            if os.path.exists(users_file):
-                df = pd.read_csv(users_file, dtype={'phone': str})
-                if formatted_phone in df['phone'].astype(str).values:
-                    flash('This phone number is already registered.', 'warning')
-                    return redirect(url_for('register'))
-                user_data.to_csv(users_file, mode='a', header=False, index=False)
-            else:
-                user_data.to_csv(users_file, index=False)
+            try:
+                cadence = cadence_from_form(request.form)
+            except ValueError as e:
+                flash(str(e), 'error')
+                return redirect(url_for('register'))
+
+            if phone_registered(formatted_phone):
+                flash('This phone number is already registered.', 'warning')
+                return redirect(url_for('register'))
+            append_user(formatted_phone, password, city, cadence)
+            page_version.invalidate()
 
             flash('Registration successful! You will receive health alerts. (Registered without SMS verification.)', 'success')
             return redirect(url_for('index'))
@@ -543,20 +405,15 @@ def verify_otp():
             
             if otp == stored_otp:
                 print("OTP verified successfully!")
-                # Save user
-                user_data = pd.DataFrame([[phone, stored_data['password'], stored_data['city']]],
-                                       columns=['phone', 'password', 'city'])
-                users_file = 'users.csv'
-                if os.path.exists(users_file):
-                    user_data.to_csv(users_file, mode='a', header=False, index=False)
-                else:
-                    user_data.to_csv(users_file, index=False)
+                # Save user (phone was normalized when the OTP was issued)
+                append_user(phone, stored_data['password'], stored_data['city'], stored_data['cadence'])
+                page_version.invalidate()
                 
                 print(f"User saved: {phone}, {stored_data['city']}")
                 
                 del otp_store[phone]
                 session.pop('pending_phone', None)
-                flash('Registration successful! You will receive hourly health alerts.', 'success')
+                flash(f"Registration successful! You will receive health alerts ({describe_cadence(stored_data['cadence']).lower()}).", 'success')
                 return redirect(url_for('index'))
             else:
                 print(f"ERROR: OTP mismatch. Expected: {stored_otp}, Got: {otp}")
@@ -569,17 +426,22 @@ def verify_otp():
     return render_template('verify_otp.html', phone=phone)
 
 @app.route('/predict', methods=['GET', 'POST'])
+@admin_profilable
 def predict():
     """Health risk prediction"""
     if request.method == 'POST':
-        city = request.form.get('city', '').strip()
+        city = canonical_city(request.form.get('city', ''))
         use_weather = request.form.get('use_weather') == 'true'
         
+        row = None
         if use_weather and city:
-            weather_data = fetch_weather_for_city(city)
-            if not weather_data:
+            row = city_risk(city)
+            if not row:
                 flash(f'Could not fetch weather data for {city}. Please enter values manually.', 'warning')
                 return render_template('predict.html', city=city, weather_data=None)
+            weather_data = row['weather']
+            if weather_data.get('stale'):
+                flash(f'Weather service is unavailable. Showing last known conditions for {city} from {weather_data["observed_at"]}.', 'warning')
         else:
             # Manual input
             weather_data = {
@@ -591,7 +453,10 @@ def predict():
                 'Pressure': float(request.form.get('pressure', 0))
             }
         
-        disease, risk, precautions = predict_health_risk(weather_data)
+        if row:
+            disease, risk, precautions = row['disease'], row['risk'], row['precautions']
+        else:
+            disease, risk, precautions = predict_health_risk(weather_data)
         
         if disease is None:
             flash('Model not loaded. Attempting to train automatically...', 'warning')
@@ -605,65 +470,105 @@ def predict():
                 flash('Failed to train model automatically. Please check the dataset file.', 'error')
                 return render_template('predict.html')
         
+        forecast, outlook = city_outlook(city) if use_weather and city else (None, None)
         return render_template('predict.html', 
                              city=city if use_weather else 'Manual Input',
                              weather_data=weather_data,
                              disease=disease,
                              risk=risk,
-                             precautions=precautions)
+                             precautions=precautions,
+                             forecast=forecast,
+                             outlook=outlook,
+                             forecast_pending=use_weather and city and forecast is None
+                                              and risk_timelines.registered(city))
     
     return render_template('predict.html')
 
 @app.route('/fetch_weather', methods=['POST'])
+@admin_profilable
 def fetch_weather():
     """API endpoint to fetch weather"""
-    city = request.json.get('city', '').strip()
+    city = canonical_city(request.json.get('city', ''))
     if not city:
         return jsonify({'error': 'City is required'}), 400
     
-    weather_data = fetch_weather_for_city(city)
+    row = risk_view.get(city)
+    weather_data = row['weather'] if row else fetch_weather_for_city(city)
     if weather_data:
         return jsonify(weather_data)
     else:
         return jsonify({'error': 'Could not fetch weather data'}), 404
 
 @app.route('/users')
+@admin_profilable
+@conditional_page
 def users():
     """View registered users"""
-    users_file = 'users.csv'
-    if os.path.exists(users_file):
-        df = pd.read_csv(users_file, dtype={'phone': str})
-        users_list = df.to_dict('records')
-    else:
-        users_list = []
-    return render_template('users.html', users=users_list)
+    table = cached_fragment('users_table', 'partials/users_table.html',
+                            users=lambda: load_users().to_dict('records'))
+    return render_template('users.html', users_table=table)
 
 
 @app.route('/alerts')
 @admin_required
+@conditional_page
 def alerts():
     """View alert system status"""
-    users_file = 'users.csv'
-    if os.path.exists(users_file):
-        df = pd.read_csv(users_file, dtype={'phone': str})
-        total_users = len(df)
-        users_list = df.to_dict('records')
-    else:
-        total_users = 0
-        users_list = []
-    
-    # Check if alert system is running
-    # Method 1: Check for PID file (created by send_alerts.py when running)
-    alert_running = os.path.exists('alert_process.pid')
-    
-    # Method 2: If PID file doesn't exist but we have users, show as "ready" (can send manual alerts)
-    # The automated system requires send_alerts.py to be running separately
-    if not alert_running and total_users > 0:
-        # System is configured and ready, but automated alerts not running
-        # Show as active since manual alerts can be sent
-        alert_running = True
-    
-    return render_template('alerts.html', total_users=total_users, alert_running=alert_running, users=users_list)
+    loaded = []
+
+    def users_list():
+        # Read users.csv at most once per request, and only if a fragment is out of date
+        if not loaded:
+            loaded.append(load_users().to_dict('records'))
+        return loaded[0]
+
+    def alert_running():
+        # Method 1: Check for PID file (created by send_alerts.py when running)
+        # Method 2: If PID file doesn't exist but we have users, show as "ready" (can send manual alerts)
+        # The automated system requires send_alerts.py to be running separately; show as active
+        # since manual alerts can be sent
+        return page_version.exists('alert_process.pid') or len(users_list()) > 0
+
+    status = cached_fragment('alerts_status', 'partials/alerts_status.html',
+                             alert_running=alert_running, total_users=lambda: len(users_list()))
+    users_table = cached_fragment('alerts_users', 'partials/alerts_users.html', users=users_list)
+    diagnostics = cached_fragment('alerts_diagnostics', 'partials/alerts_diagnostics.html', users=users_list)
+    cycles = cached_fragment('alerts_cycles', 'partials/alerts_cycles.html', cycles=recent_cycles)
+    job = read_job(request.args.get('job', ''))
+    return render_template('alerts.html', status=status, users_table=users_table, diagnostics=diagnostics,
+                           cycles=cycles, job=job)
+
+@app.route('/admin/prediction_cache')
+@admin_required
+def prediction_cache_stats():
+    """Prediction cache hit-rate metrics"""
+    if health_model.cache is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **health_model.cache.stats()})
+
+@app.route('/admin/risk_view')
+@admin_required
+def risk_view_status():
+    """Materialized per-city risk: size, age and hit rate"""
+    return jsonify(risk_view.stats())
+
+@app.route('/admin/forecast')
+@admin_required
+def forecast_status():
+    """Risk timelines: cities, steps, upstream calls and batch sizes"""
+    return jsonify(risk_timelines.stats())
+
+@app.route('/admin/observations')
+@admin_required
+def observations_status():
+    """Stored weather observations: partitions, rows per resolution, size"""
+    return jsonify(store_stats())
+
+@app.route('/admin/weather')
+@admin_required
+def weather_service_status():
+    """Weather circuit breaker state and cached observations"""
+    return jsonify(weather_status())
 
 @app.route('/send_alert/<int:user_id>', methods=['GET', 'POST'])
 @admin_required
@@ -684,7 +589,7 @@ def send_alert(user_id):
             print("ERROR: users.csv not found")
             return redirect(url_for('alerts'))
         
-        df = pd.read_csv(users_file, dtype={'phone': str})
+        df = load_users(users_file)
         print(f"Total users in file: {len(df)}")
         
         if user_id < 0 or user_id >= len(df):
@@ -694,21 +599,19 @@ def send_alert(user_id):
         
         user = df.iloc[user_id]
         print(f"User data: {user.to_dict()}")
-        print(f"Raw phone from CSV: {user['phone']} (type: {type(user['phone'])})")
         
-        raw_phone = str(user['phone'])
-        phone = check_phone_format(raw_phone)
+        phone = user['phone']
         city = user['city']
         
-        print(f"Formatted phone: {phone}")
+        print(f"Phone: {phone} ({user['phone_status']})")
         print(f"City: {city}")
         
-        if not phone:
-            flash(f'Invalid phone number format: {raw_phone}. Please ensure the number is in format +91XXXXXXXXXX or XXXXXXXXXX', 'error')
-            print(f"ERROR: Phone number format invalid - Raw: {raw_phone}, Type: {type(raw_phone)}")
+        if user['phone_status'] != PHONE_OK:
+            flash(f'Phone number {phone} is flagged as {user["phone_status"]}. Please re-register this user with format +91XXXXXXXXXX or XXXXXXXXXX', 'error')
+            print(f"ERROR: Phone number flagged - {phone}: {user['phone_status']}")
             return redirect(url_for('alerts'))
         
-        if gb_disease is None or gb_risk is None:
+        if not health_model.loaded:
             flash('Model not loaded. Attempting to train automatically...', 'warning')
             print("WARNING: Model not loaded, attempting auto-training...")
             if auto_train_model():
@@ -720,19 +623,17 @@ def send_alert(user_id):
         
         print("Model is loaded, proceeding...")
         
-        # Fetch weather data
-        print(f"Fetching weather for {city}...")
-        weather_data = fetch_weather_for_city(city)
-        if not weather_data:
+        # Weather and prediction from the risk view (live only if the city isn't in it)
+        print(f"Looking up risk for {city}...")
+        row = city_risk(city)
+        if not row:
             flash(f'Could not fetch weather data for {city}', 'error')
             print(f"ERROR: Could not fetch weather for {city}")
             return redirect(url_for('alerts'))
         
-        print(f"Weather data fetched: {weather_data}")
-        
-        # Predict health risk
-        print("Predicting health risk...")
-        disease, risk, precautions = predict_health_risk(weather_data)
+        weather_data = row['weather']
+        disease, risk, precautions = row['disease'], row['risk'], row['precautions']
+        print(f"Weather data: {weather_data}")
         
         if disease is None:
             flash('Error predicting health risk', 'error')
@@ -743,7 +644,9 @@ def send_alert(user_id):
         print(f"Precautions: {precautions}")
         
         # Build alert message from current climate data (same format as Twilio alert)
-        alert_msg = build_health_alert_message(city, weather_data, disease, risk, precautions)
+        outlook = city_outlook(city)[1] if risk != 'High' else None
+        alert_msg = build_health_alert_message(city, weather_data, disease, risk, precautions, outlook,
+                                               row['computed_at'])
         
         print(f"\nMessage to send ({len(alert_msg)} chars):")
         print("-" * 60)
@@ -753,6 +656,7 @@ def send_alert(user_id):
         # Send SMS
         print(f"\nCalling send_sms() for {phone}...")
         result = send_sms(phone, alert_msg)
+        record_delivery({'phone': phone, 'city': city, 'disease': disease, 'risk': risk}, result, 'manual')
         
         if result and isinstance(result, str):
             # Success - result is message SID
@@ -782,115 +686,107 @@ def send_alert(user_id):
         flash(f'Error sending alert: {str(e)}', 'error')
         return redirect(url_for('alerts'))
 
+def run_alert_job(job):
+    """Send-to-all cycle, run in the background and reported through the job file"""
+    print(f"\n{'='*60}")
+    print(f"SEND ALERT TO ALL USERS - JOB {job.id} STARTED")
+    print(f"{'='*60}")
+    
+    if not health_model.loaded:
+        job.set_status('preparing', 'Loading model...')
+        if not health_model.ensure_loaded():
+            print("ERROR: Failed to load or train model")
+            job.set_status('failed', 'Failed to train model automatically. Please check the dataset file.')
+            return
+    
+    trace = CycleTrace('send_all')
+    with trace.span('load_users'):
+        all_users = load_users()
+    with trace.span('validate_phones'):
+        df = alertable_users(all_users)
+    flagged_count = len(all_users) - len(df)
+    job.total = len(df)
+    print(f"Total users to send alerts to: {len(df)} ({flagged_count} flagged phones skipped)")
+    
+    # One batched weather fetch for every city in the cycle, then predictions
+    job.set_status('preparing', f"Fetching weather for {df['city'].nunique()} cities...")
+    jobs = prepare_alerts(df.to_dict('records'), health_model,
+                          on_failed=lambda phone, city: job.record(phone, city, 'failed'),
+                          cancelled=job.cancelled, trace=trace, risk_view=risk_view, timelines=risk_timelines)
+    
+    # Send highest risk first, paced by ALERT_SEND_RATE (1/s by default)
+    job.set_status('sending', f"Sending {len(jobs)} alerts" + (f" ({flagged_count} flagged phones skipped)" if flagged_count else ''))
+    report = dispatch_alerts(
+        jobs,
+        progress=lambda alert, delivered: job.record(alert['phone'], alert['city'], outcome(alert.get('result'))[0],
+                                                     alert['risk']),
+        cancelled=job.cancelled,
+        source='send_all',
+        trace=trace)
+    job.report = report
+    trace.finish(users=len(df), sent=job.sent, submitted=job.submitted, failed=job.failed)
+    
+    print(f"\n{'='*60}")
+    print(f"COMPLETED: {job.sent} successful, {job.submitted} submitted in bulk, {job.failed} failed")
+    print(f"{'='*60}\n")
+    
+    summary = f'Alerts sent: {job.sent} successful'
+    if job.submitted:
+        summary += f', {job.submitted} submitted in bulk (delivery shows in the Twilio Notify logs)'
+    summary += f', {job.failed} failed'
+    if flagged_count:
+        summary += f', {flagged_count} skipped (flagged phone numbers)'
+    if job.cancelled():
+        handled = job.sent + job.submitted + job.failed
+        job.set_status('cancelled', summary + f", {job.total - handled} not sent (cancelled)")
+    else:
+        job.set_status('done', summary)
+
 @app.route('/send_alert_all', methods=['POST'])
 @admin_required
+@profile_cycle
 def send_alert_all():
-    """Send real-time alert to all registered users"""
-    try:
-        print(f"\n{'='*60}")
-        print("SEND ALERT TO ALL USERS - STARTED")
-        print(f"{'='*60}")
-        
-        users_file = 'users.csv'
-        if not os.path.exists(users_file):
-            flash('No users found', 'error')
-            print("ERROR: users.csv not found")
-            return redirect(url_for('alerts'))
-        
-        if gb_disease is None or gb_risk is None:
-            flash('Model not loaded. Attempting to train automatically...', 'warning')
-            print("WARNING: Model not loaded, attempting auto-training...")
-            if auto_train_model():
-                print("Model trained successfully!")
-            else:
-                flash('Failed to train model automatically. Please check the dataset file.', 'error')
-                print("ERROR: Failed to train model")
-                return redirect(url_for('alerts'))
-        
-        df = pd.read_csv(users_file, dtype={'phone': str})
-        total_users = len(df)
-        print(f"Total users to send alerts to: {total_users}")
-        
-        success_count = 0
-        fail_count = 0
-        
-        for idx, row in df.iterrows():
-            print(f"\n--- Processing user {idx + 1}/{total_users} ---")
-            raw_phone = str(row['phone'])
-            print(f"Raw phone from CSV: {raw_phone} (type: {type(row['phone'])})")
-            phone = check_phone_format(raw_phone)
-            city = row['city']
-            
-            print(f"Phone: {phone}, City: {city}")
-            
-            if not phone:
-                print(f"ERROR: Invalid phone format for {raw_phone}")
-                fail_count += 1
-                continue
-            
-            # Fetch weather data
-            print(f"Fetching weather for {city}...")
-            weather_data = fetch_weather_for_city(city)
-            if not weather_data:
-                print(f"ERROR: Could not fetch weather for {city}")
-                fail_count += 1
-                continue
-            
-            print(f"Weather data: {weather_data}")
-            
-            # Predict health risk
-            print("Predicting health risk...")
-            disease, risk, precautions = predict_health_risk(weather_data)
-            
-            if disease is None:
-                print("ERROR: Health risk prediction failed")
-                fail_count += 1
-                continue
-            
-            print(f"Prediction - Disease: {disease}, Risk: {risk}")
-            
-            # Build alert message from current climate data (same format as Twilio alert)
-            alert_msg = build_health_alert_message(city, weather_data, disease, risk, precautions)
-            
-            print(f"Message length: {len(alert_msg)} characters")
-            print(f"Sending SMS to {phone}...")
-            
-            # Send SMS
-            result = send_sms(phone, alert_msg)
-            if result and isinstance(result, str):
-                # Success - result is message SID
-                print(f"SUCCESS! Message SID: {result}")
-                success_count += 1
-            else:
-                # Error - result is error_info dictionary or None
-                if isinstance(result, dict):
-                    error_msg = result.get('user_message', result.get('message', 'Unknown error'))
-                    print(f"FAILED! Error: {error_msg}")
-                else:
-                    print(f"FAILED! Could not send SMS to {phone}")
-                fail_count += 1
-            
-            # Small delay to avoid rate limiting (1 second between messages)
-            if idx < len(df) - 1:  # Don't delay after last message
-                time.sleep(1)
-        
-        print(f"\n{'='*60}")
-        print(f"COMPLETED: {success_count} successful, {fail_count} failed")
-        print(f"{'='*60}\n")
-        
-        flash(f'Alerts sent: {success_count} successful, {fail_count} failed', 'success' if success_count > 0 else 'error')
-        return redirect(url_for('alerts'))
-        
-    except Exception as e:
-        error_msg = f"Unexpected error in send_alert_all: {str(e)}"
-        print(f"\n{'!'*60}")
-        print(f"EXCEPTION: {error_msg}")
-        print(f"Exception type: {type(e).__name__}")
-        import traceback
-        traceback.print_exc()
-        print(f"{'!'*60}\n")
-        flash(f'Error sending alerts: {str(e)}', 'error')
+    """Start a background job that sends a real-time alert to all registered users"""
+    if not os.path.exists('users.csv'):
+        flash('No users found', 'error')
+        print("ERROR: users.csv not found")
         return redirect(url_for('alerts'))
+    
+    job = create_job(total=len(alertable_users(load_users())))
+    if profiling.requested(request.values, request.headers):
+        # Profile the whole cycle: weather, predictions and the dispatcher's sender threads
+        start_job(job, lambda job: profiling.profile_call('alert cycle', run_alert_job, job))
+    else:
+        start_job(job, run_alert_job)
+    print(f"[Alert Job] Started job {job.id}")
+    
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'job_id': job.id}), 202
+    return redirect(url_for('alerts', job=job.id))
+
+@app.route('/alert_jobs/<job_id>')
+@admin_required
+def alert_job_status(job_id):
+    """Current state of a send-to-all job (JSON)"""
+    data = read_job(job_id)
+    if data is None:
+        return jsonify({'error': 'unknown job'}), 404
+    return jsonify(data)
+
+@app.route('/alert_jobs/<job_id>/events')
+@admin_required
+def alert_job_events(job_id):
+    """Server-Sent Events stream of a job's progress, ending when it finishes"""
+    return Response(stream_with_context(stream_events(job_id)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/alert_jobs/<job_id>/cancel', methods=['POST'])
+@admin_required
+def cancel_alert_job(job_id):
+    """Stop a running send-to-all job before its remaining sends"""
+    if cancel_job(job_id):
+        return jsonify({'cancelled': True})
+    return jsonify({'cancelled': False, 'error': 'job not running'}), 409
 
 @app.route('/test_sms/<phone>')
 def test_sms(phone):
@@ -908,7 +804,7 @@ def test_sms(phone):
 @app.route('/test_otp/<phone>')
 def test_otp(phone):
     """Test OTP sending to a phone number"""
-    formatted_phone = check_phone_format(phone)
+    formatted_phone = normalize_phone(phone)
     if not formatted_phone:
         return jsonify({'status': 'error', 'message': 'Invalid phone number format'}), 400
     
@@ -944,29 +840,27 @@ def test_alert(user_id):
         if not os.path.exists(users_file):
             return jsonify({'status': 'error', 'message': 'No users found'}), 400
         
-        df = pd.read_csv(users_file, dtype={'phone': str})
+        df = load_users(users_file)
         if user_id < 0 or user_id >= len(df):
             return jsonify({'status': 'error', 'message': 'Invalid user ID'}), 400
         
         user = df.iloc[user_id]
-        raw_phone = str(user['phone'])
-        phone = check_phone_format(raw_phone)
+        phone = user['phone']
         city = user['city']
         
-        if not phone:
+        if user['phone_status'] != PHONE_OK:
             return jsonify({
                 'status': 'error', 
-                'message': f'Invalid phone number format: {raw_phone}',
-                'raw_phone': raw_phone,
-                'formatted_phone': None
+                'message': f'Phone number is flagged as {user["phone_status"]}: {phone}',
+                'phone': phone,
+                'phone_status': user['phone_status']
             }), 400
         
         # Simple test message
         test_msg = f"Test Health Alert for {city}! This is a test message to verify alert functionality."
         
         print(f"\n=== TEST ALERT ===")
-        print(f"Raw phone: {raw_phone}")
-        print(f"Formatted phone: {phone}")
+        print(f"Phone: {phone}")
         print(f"City: {city}")
         print(f"Message: {test_msg}")
         
@@ -977,7 +871,6 @@ def test_alert(user_id):
                 'message_sid': result, 
                 'message': 'Test alert sent successfully',
                 'phone': phone,
-                'raw_phone': raw_phone,
                 'city': city
             })
         elif result and isinstance(result, dict):
@@ -987,8 +880,7 @@ def test_alert(user_id):
                 'status': 'error', 
                 'message': error_msg,
                 'error_code': error_code,
-                'phone': phone,
-                'raw_phone': raw_phone
+                'phone': phone
             }), 400
         else:
             return jsonify({'status': 'error', 'message': 'Failed to send test alert'}), 400
@@ -1007,19 +899,17 @@ def diagnose_sms(user_id):
         if not os.path.exists(users_file):
             return jsonify({'status': 'error', 'message': 'No users found'}), 400
         
-        df = pd.read_csv(users_file, dtype={'phone': str})
+        df = load_users(users_file)
         if user_id < 0 or user_id >= len(df):
             return jsonify({'status': 'error', 'message': 'Invalid user ID'}), 400
         
         user = df.iloc[user_id]
-        raw_phone = str(user['phone'])
-        formatted_phone = check_phone_format(raw_phone)
         
         diagnosis = {
             'user_id': user_id,
-            'raw_phone': raw_phone,
-            'formatted_phone': formatted_phone,
-            'phone_valid': formatted_phone is not None,
+            'phone': user['phone'],
+            'phone_status': user['phone_status'],
+            'phone_valid': user['phone_status'] == PHONE_OK,
             'city': user['city'],
             'twilio_account_sid': TWILIO_ACCOUNT_SID[:10] + '...' if TWILIO_ACCOUNT_SID else 'Not set',
             'twilio_phone': TWILIO_PHONE_NUMBER,
@@ -1028,7 +918,7 @@ def diagnose_sms(user_id):
         
         # Test Twilio connection
         try:
-            client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+            client = twilio_client()
             account = client.api.accounts(TWILIO_ACCOUNT_SID).fetch()
             diagnosis['twilio_connection'] = 'success'
             diagnosis['account_status'] = account.status
@@ -1047,99 +937,95 @@ def delete_user(user_id):
     """Delete a user"""
     users_file = 'users.csv'
     if os.path.exists(users_file):
-        df = pd.read_csv(users_file)
+        df = load_users(users_file)
         if 0 <= user_id < len(df):
             df = df.drop(df.index[user_id])
-            df.to_csv(users_file, index=False)
+            save_users(df, users_file)
+            page_version.invalidate()
             flash('User deleted successfully', 'success')
         else:
             flash('Invalid user ID', 'error')
     return redirect(url_for('users'))
 
-def run_hourly_alerts():
-    """Background thread to send hourly alerts to all registered users"""
-    import time
-    while True:
-        try:
-            time.sleep(3600)  # Wait 1 hour (3600 seconds)
-            
-            if not os.path.exists('users.csv'):
-                print("[Background Alert] No users.csv found, skipping...")
-                continue
-            
-            if gb_disease is None or gb_risk is None:
-                print("[Background Alert] Model not loaded, skipping...")
-                continue
-            
-            if DEMO_SMS:
-                print("[Background Alert] DEMO_SMS is enabled, skipping real alerts...")
-                continue
-            
-            if not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN:
-                print("[Background Alert] Twilio credentials not set, skipping...")
-                continue
-            
-            print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Starting automated alert cycle...")
-            df = pd.read_csv('users.csv', dtype={'phone': str})
-            print(f"[Background Alert] Found {len(df)} users to process")
-            
-            success_count = 0
-            fail_count = 0
-            
-            for idx, row in df.iterrows():
-                try:
-                    raw_phone = str(row['phone'])
-                    phone = check_phone_format(raw_phone)
-                    city = row['city']
-                    
-                    if not phone:
-                        print(f"[Background Alert] Invalid phone format: {raw_phone}")
-                        fail_count += 1
-                        continue
-                    
-                    weather_data = fetch_weather_for_city(city)
-                    if not weather_data:
-                        print(f"[Background Alert] Could not fetch weather for {city}")
-                        fail_count += 1
-                        continue
-                    
-                    disease, risk, precautions = predict_health_risk(weather_data)
-                    if disease is None:
-                        print(f"[Background Alert] Prediction failed for {city}")
-                        fail_count += 1
-                        continue
-                    
-                    alert_msg = build_health_alert_message(city, weather_data, disease, risk, precautions)
-                    result = send_sms(phone, alert_msg)
-                    
-                    if result and isinstance(result, str):
-                        print(f"[Background Alert] ✓ Sent to {phone} ({city})")
-                        success_count += 1
-                    else:
-                        print(f"[Background Alert] ✗ Failed to send to {phone}")
-                        fail_count += 1
-                    
-                    time.sleep(1)  # Small delay between messages
-                    
-                except Exception as e:
-                    print(f"[Background Alert] Error processing user {idx}: {str(e)}")
-                    fail_count += 1
-                    continue
-            
-            print(f"[Background Alert] Cycle completed: {success_count} successful, {fail_count} failed")
-            
-        except Exception as e:
-            print(f"[Background Alert] Critical error: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            time.sleep(300)  # Wait 5 minutes before retrying
+# Created when the background alert thread starts
+alert_scheduler = None
+
+def run_scheduled_alerts():
+    """Background thread: send each user's alerts on their own cadence, spread across the interval"""
+    global alert_scheduler
+    alert_scheduler = AlertScheduler()
+    run_schedule(alert_scheduler,
+                 lambda: alertable_users(load_users()).to_dict('records'),
+                 lambda due: send_due_alerts(due, health_model, risk_view, risk_timelines))
+
+@app.route('/admin/schedule')
+@admin_required
+def admin_schedule():
+    """Alert scheduler status (JSON)"""
+    if alert_scheduler is None:
+        return jsonify({'running': False})
+    return jsonify(dict(alert_scheduler.stats(), running=True))
+
+@app.route('/admin/dispatch')
+@admin_required
+def admin_dispatch():
+    """Per-risk-level delivery latency of the last alert cycle (JSON)"""
+    return jsonify(alert_core.last_dispatch_report or {})
+
+@app.route('/admin/cycles')
+@admin_required
+def admin_cycles():
+    """Stage timings of the recent alert cycles (JSON)"""
+    return jsonify(recent_cycles())
+
+@app.route('/admin/profiles')
+@admin_required
+def admin_profiles():
+    """Saved request and alert-cycle profiles"""
+    return render_template('profiles.html', profiles=profiling.list_profiles(),
+                           keep=profiling.PROFILE_KEEP, header=profiling.PROFILE_HEADER)
+
+@app.route('/admin/profiles/<name>.<ext>')
+@admin_required
+def admin_profile_file(name, ext):
+    """One saved profile: the text summary, or the .pstats file as a download"""
+    path = profiling.profile_path(name, f'.{ext}')
+    if path is None:
+        abort(404)
+    if ext == 'txt':
+        return send_from_directory(os.path.abspath(profiling.PROFILE_DIR), os.path.basename(path),
+                                   mimetype='text/plain')
+    return send_from_directory(os.path.abspath(profiling.PROFILE_DIR), os.path.basename(path),
+                               as_attachment=True)
+
+@app.route('/admin/deliveries')
+@admin_required
+def admin_deliveries():
+    """Aggregate counts from the delivery ledger (JSON).
+
+    ?since=2026-10-12&until=2026-10-19 (ISO, UTC; default the last 7 days)
+    &group_by=city,risk (any of city, disease, risk, status, error_code, day, hour)
+    &city=Pune&disease=Dengue&risk=High&status=sent&error_code=21610 (filters)
+    """
+    now = time.time()
+    try:
+        until = parse_time(request.args.get('until'), now)
+        since = parse_time(request.args.get('since'), until - 7 * 86400)
+        group_by = [name.strip() for name in request.args.get('group_by', '').split(',') if name.strip()]
+        filters = {name: request.args.get(name) for name in DIMENSIONS if request.args.get(name)}
+        limit = min(int(request.args.get('limit', 1000)), 10000)
+        result = aggregate(since, until, group_by=group_by, filters=filters, limit=limit)
+    except ValueError as e:
+        return jsonify({'error': str(e), 'dimensions': list(GROUPINGS)}), 400
+    result.update(since=since, until=until, group_by=group_by, filters=filters)
+    return jsonify(result)
 
 if __name__ == '__main__':
     # Start background alert thread (only in production, not in debug mode)
     if os.environ.get('FLASK_ENV') == 'production' or os.environ.get('RENDER'):
-        alert_thread = threading.Thread(target=run_hourly_alerts, daemon=True)
+        alert_thread = threading.Thread(target=run_scheduled_alerts, daemon=True)
         alert_thread.start()
-        print("[INFO] Background alert thread started - hourly alerts enabled")
+        print("[INFO] Background alert thread started - scheduled alerts enabled")
     
     # Disable reloader to prevent constant reloading from venv changes
     # Set use_reloader=False if you experience reload loops
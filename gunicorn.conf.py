@@ -0,0 +1,15 @@
+# Gunicorn settings (loaded automatically from the working directory)
+#
+# The default 'gthread' profile gives each worker WEB_THREADS request threads,
+# so a request waiting on OpenWeatherMap or Twilio holds one thread instead of
+# a whole worker. Set WEB_WORKER_CLASS=gevent (pip install gevent) to use
+# cooperative greenlets instead; requests is then patched to be non-blocking.
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+worker_class = os.environ.get('WEB_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('WEB_THREADS', '8' if worker_class == 'gthread' else '1'))
+worker_connections = int(os.environ.get('WEB_WORKER_CONNECTIONS', '200'))  # gevent only
+timeout = int(os.environ.get('WEB_TIMEOUT', '120'))
+keepalive = 5